@@ -0,0 +1,212 @@
+"""Static batching. Meshes which never move are merged into few big ones with
+   their transforms baked into vertices, so the viewer issues a draw call per
+   material of a batch instead of one per mesh. Meshes of different materials
+   share a batch as its subMeshes (with MultiMaterial).
+"""
+import os
+
+# Arrays of vertexData and number of their components (colors have 3 or 4):
+ATTRIBUTES = (('positions', 3), ('normals', 3), ('uvs', 2), ('uvs2', 2), ('colors', None))
+
+# Meshes differing in these can't be merged:
+FLAGS = ('isVisible', 'isEnabled', 'pickable', 'checkCollisions', 'billboardMode',
+         'receiveShadows')
+
+
+def static_meshes(scene):
+    """Meshes which can be batched: single subMesh, no animation, instances,
+       parents, children nor levels of detail.
+    """
+    levels  = set(id for mesh in scene['meshes'] for id in mesh.get('lodMeshIds', []))
+    parents = set(mesh.get('parentId') for mesh in scene['meshes'])
+    return [mesh for mesh in scene['meshes'] if len(mesh.get('subMeshes', [])) == 1 \
+            and not any(mesh.get(key) for key in ('animations', 'vertexAnimation', 'instances',
+                                                   'parentId', 'lodMeshIds')) \
+            and mesh['id'] not in levels and mesh['id'] not in parents \
+            and not scene.has('multiMaterial', mesh.get('materialId'))]
+
+
+def mesh_arrays(scene, mesh, directory):
+    """Geometry of mesh wherever it is kept (binary file, vertexData or mesh
+       itself) as dictionary of (nvertices, size) float arrays and flat indices.
+    """
+    import numpy
+    from habylon import decode_binary
+    if mesh.get('delayLoadingFile'):
+        with open(os.path.join(directory, mesh['delayLoadingFile']), 'rb') as file:
+            arrays = decode_binary(file.read(), mesh['_binaryInfo'])
+    else:
+        source = mesh if mesh.get('positions') else scene.get('vertexData', mesh.get('geometryId'))
+        arrays = dict((name, numpy.asarray(source.get(name) or [])) \
+                      for name, _ in ATTRIBUTES + (('indices', 1),))
+    count  = len(arrays['positions']) / 3
+    result = {'indices': numpy.asarray(arrays['indices'], dtype=numpy.int64)}
+    for name, size in ATTRIBUTES:
+        values = arrays.get(name)
+        if values is not None and len(values) and count:
+            values = numpy.asarray(values, dtype=numpy.float64).reshape(count, -1)
+            # NOTE: Babylon reads only two components of uvs:
+            result[name] = values[:, :size] if size else values
+    return result
+
+
+def bake(arrays, matrix):
+    """Transforms arrays (see mesh_arrays()) of mesh with its 4x4 matrix (row vectors).
+       Mirroring matrix flips triangles, so they keep facing out.
+    """
+    import numpy
+    linear = matrix[:3, :3]
+    arrays['positions'] = numpy.dot(arrays['positions'], linear) + matrix[3, :3]
+    if 'normals' in arrays:
+        normals = numpy.dot(arrays['normals'], numpy.linalg.inv(linear).T)
+        lengths = numpy.sqrt((normals ** 2).sum(axis=1))
+        arrays['normals'] = normals / numpy.where(lengths > 0, lengths, 1.0)[:, None]
+    if numpy.linalg.det(linear) < 0:
+        arrays['indices'] = arrays['indices'].reshape(-1, 3)[:, ::-1].ravel()
+    return arrays
+
+
+def plan_batches(meshes, max_vertices=65535):
+    """Splits meshes into lists of batches, so no batch has more than max_vertices
+       vertices. Meshes with the same flags and material are kept together (and
+       roughly in space), bigger meshes than the limit aren't batched.
+    """
+    import collections
+    groups = collections.OrderedDict()
+    for mesh in meshes:
+        vertices = mesh['subMeshes'][0]['verticesCount']
+        if vertices >= max_vertices:
+            continue
+        key = tuple(mesh.get(flag) for flag in FLAGS) + (bool(mesh.get('materialId')),)
+        groups.setdefault(key, collections.OrderedDict()) \
+              .setdefault(mesh.get('materialId'), []).append(mesh)
+
+    batches = []
+    for materials in groups.values():
+        batch, size = [], 0
+        for members in materials.values():
+            members.sort(key=lambda mesh: (mesh['position'][0], mesh['position'][2]))
+            for mesh in members:
+                vertices = mesh['subMeshes'][0]['verticesCount']
+                if batch and size + vertices > max_vertices:
+                    batches.append(batch)
+                    batch, size = [], 0
+                batch.append(mesh)
+                size += vertices
+        if batch:
+            batches.append(batch)
+    # Single mesh gains nothing:
+    return [item for item in batches if len(item) > 1]
+
+
+def merge(scene, batch, directory, name):
+    """Mesh made of batch (list of meshes), with one subMesh per material, and
+       its MultiMaterial (or None if whole batch has the same material).
+    """
+    import numpy
+    from fromHoudini import compose
+    from habylon import GeometryBuffer
+    materials = []
+    for mesh in batch:
+        if mesh.get('materialId') not in materials:
+            materials.append(mesh.get('materialId'))
+    # Vertices of a material have to be together:
+    batch    = sorted(batch, key=lambda mesh: materials.index(mesh.get('materialId')))
+    matrices = compose([mesh['position'] for mesh in batch], [mesh['rotation'] for mesh in batch],
+                       [mesh['scaling'] for mesh in batch])
+    parts    = [bake(mesh_arrays(scene, mesh, directory), matrix) \
+                for mesh, matrix in zip(batch, matrices)]
+
+    # Missing attributes are filled with zeros (white colors):
+    columns = {}
+    for attribute, size in ATTRIBUTES:
+        present = [part[attribute] for part in parts if attribute in part]
+        if not present:
+            continue
+        size   = max(values.shape[1] for values in present)
+        empty  = 1.0 if attribute == 'colors' else 0.0
+        filled = []
+        for part in parts:
+            values = numpy.full((len(part['positions']), size), empty)
+            if attribute in part:
+                values[:, :part[attribute].shape[1]] = part[attribute]
+            filled.append(values)
+        columns[attribute] = GeometryBuffer.floats(numpy.vstack(filled))
+
+    indices   = []
+    submeshes = []
+    vertices  = 0
+    for material in materials:
+        submesh = scene.new('subMesh')
+        submesh['materialIndex'] = materials.index(material)
+        submesh['verticesStart'] = vertices
+        submesh['indexStart']    = sum(len(values) for values in indices)
+        for mesh, part in zip(batch, parts):
+            if mesh.get('materialId') == material:
+                indices.append(part['indices'] + vertices)
+                vertices += len(part['positions'])
+        submesh['verticesCount'] = vertices - submesh['verticesStart']
+        submesh['indexCount']    = sum(len(values) for values in indices) - submesh['indexStart']
+        submeshes.append(submesh)
+
+    merged = scene.new('mesh')
+    merged['id']   = name
+    merged['name'] = name
+    for flag in FLAGS:
+        merged[flag] = batch[0][flag]
+    positions = columns['positions'].data.reshape(-1, 3)
+    merged['boundingBoxMinimum'] = positions.min(axis=0).tolist()
+    merged['boundingBoxMaximum'] = positions.max(axis=0).tolist()
+    merged['materialId'] = materials[0] or u""
+    multi = None
+    if len(materials) > 1:
+        multi = scene.new('multiMaterial')
+        multi['id']        = name + u"_materials"
+        multi['name']      = multi['id']
+        multi['materials'] = list(materials)
+        merged['materialId'] = multi['id']
+    arrays = [columns.get(attribute, []) for attribute, _ in ATTRIBUTES]
+    return merged, multi, arrays + [GeometryBuffer.ints(numpy.concatenate(indices))], submeshes
+
+
+def batch_meshes(scene, directory, max_vertices=65535, compact=False, remove=True):
+    """Merges static meshes of scene (see static_meshes()) into batches of at most
+       max_vertices vertices (65535 keeps 16 bit indices possible). Batches are
+       written as binary files (with compact encoding) if meshes were binary,
+       otherwise as vertexData. With remove binary files of merged meshes, which
+       nothing else uses, are deleted. Returns list of new meshes.
+       NOTE: Transforms are composed the way decompose() took them apart.
+    """
+    from fromHoudini import save_binary, set_geometry
+    from habylon import BinaryWriter
+    meshes  = static_meshes(scene)
+    binary  = any(mesh.get('delayLoadingFile') for mesh in meshes)
+    writer  = BinaryWriter()
+    batched = []
+    merged  = []
+    for number, batch in enumerate(plan_batches(meshes, max_vertices)):
+        mesh, multi, arrays, submeshes = merge(scene, batch, directory, u"batch%d" % number)
+        set_geometry(scene, mesh, mesh['id'], arrays, binary)
+        mesh['subMeshes'] = submeshes
+        if binary:
+            save_binary(scene, mesh, writer, directory, compact)
+        if multi is not None:
+            scene.add(multi)
+        merged.append(mesh)
+        batched.extend(batch)
+
+    scene.remove(*batched)
+    for mesh in merged:
+        scene.add(mesh)
+
+    # Geometry nobody refers to anymore:
+    used = set()
+    for mesh in scene['meshes']:
+        used.update((mesh.get('geometryId'), mesh.get('delayLoadingFile')))
+    scene.remove(*[data for data in scene['geometries']['vertexData'] if data['id'] not in used])
+    if remove:
+        files = set(mesh.get('delayLoadingFile') for mesh in batched) - used
+        for filename in files:
+            if filename and os.path.exists(os.path.join(directory, filename)):
+                os.remove(os.path.join(directory, filename))
+    return merged
@@ -0,0 +1,276 @@
+"""Benchmarks of the exporter on synthetic scenes made with fakehou, so they
+   run without Houdini. Every stage is timed and its peak memory measured
+   (in forked process, so stages don't see each other's garbage). Results
+   are saved as json and can be compared to results of other version.
+
+   Usage:
+        python benchmark.py --prims 1000 100000 1000000 --output new.json
+        python benchmark.py --prims 1000 100000 --compare old.json
+"""
+import os
+import sys
+import time
+
+
+def grid_for(prims, **keywords):
+    """fakehou.grid() with about prims triangles."""
+    import fakehou
+    side = max(2, int((prims / 2.0) ** 0.5) + 1)
+    return fakehou.grid(side, side, **keywords)
+
+
+def _resident_bytes():
+    """Current resident memory (Linux) or peak one elsewhere."""
+    import resource
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return _peak_bytes()
+
+
+def _peak_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NOTE: OSX reports bytes, Linux kilobytes:
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _call(function, args):
+    """Runs function(*args) with muted stdout. Returns seconds and peak memory growth."""
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        baseline = _resident_bytes()
+        start    = time.time()
+        function(*args)
+        seconds  = time.time() - start
+        return seconds, max(0, _peak_bytes() - baseline)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def measure(setup, repeat=3):
+    """Times function(*args), which setup() returns, repeat times. Each run
+       happens in a forked child, so stages modifying their input (or leaking)
+       start from the same state. Returns list of (seconds, peak bytes).
+    """
+    import json
+    runs = []
+    if not hasattr(os, 'fork'):
+        for _ in range(repeat):
+            runs.append(_call(*setup()))
+        return runs
+
+    function, args = setup()
+    for _ in range(repeat):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            status = 0
+            try:
+                result = _call(function, args)
+            except BaseException:
+                import traceback
+                result, status = traceback.format_exc(), 1
+            os.write(write, json.dumps(result))
+            os._exit(status)
+        os.close(write)
+        chunks = []
+        while True:
+            chunk = os.read(read, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(read)
+        _, status = os.waitpid(pid, 0)
+        result = json.loads(''.join(chunks))
+        if status:
+            raise RuntimeError("Stage failed:\n%s" % result)
+        runs.append(tuple(result))
+    return runs
+
+
+def setup_parse_sop(prims, options, normals='point'):
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    scene = habylon.Scene()
+    node  = fakehou.geo('grid', grid_for(prims, normals=normals, colors=True))
+    return fromHoudini.parse_sop, (scene, scene.new('mesh'), node.renderNode())
+
+
+def setup_parse_vertex_attribs(prims, options):
+    import fromHoudini
+    return fromHoudini.parse_vertex_attribs, (grid_for(prims, normals='vertex'),)
+
+
+def setup_parse_xform(prims, options):
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    scene = habylon.Scene()
+    node  = fakehou.geo('spinning', grid_for(2), velocity=(1, 0, 0), spin=(0, 45, 0))
+    return fromHoudini.parse_xform, (scene, scene.new('mesh'), node, 0, options.frames, 1,
+                                     options.key_tolerance)
+
+
+def setup_parse_vertex_animation(prims, options):
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    scene = habylon.Scene()
+    node  = fakehou.geo('ripple', grid_for(prims), deform=fakehou.ripple)
+    return fromHoudini.parse_vertex_animation, (scene, scene.new('mesh'), node.renderNode(), 1,
+        options.frames, 24, os.path.join(options.directory, 'ripple.babylonvertexanimation'))
+
+
+def setup_convert_to_binary(prims, options):
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    scene = habylon.Scene()
+    node  = fakehou.geo('grid', grid_for(prims, colors=True))
+    mesh  = fromHoudini.parse_sop(scene, scene.new('mesh'), node.renderNode(), True)
+    return fromHoudini.convert_to_binary, (scene, mesh, options.compact)
+
+
+def setup_stream_sop(prims, options):
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    scene = habylon.Scene()
+    node  = fakehou.geo('grid', grid_for(prims, colors=True))
+    return fromHoudini.stream_sop, (scene, scene.new('mesh'), node.renderNode(),
+                                    options.directory, 65536, options.compact)
+
+
+def setup_dump(prims, options):
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    scene = habylon.Scene()
+    node  = fakehou.geo('grid', grid_for(prims))
+    obj   = fromHoudini.parse_obj(scene, scene.new('mesh'), node)
+    scene.add(fromHoudini.parse_sop(scene, obj, node.renderNode()))
+    return scene.dump, (os.path.join(options.directory, 'dump.babylon'),)
+
+
+def setup_run(prims, options):
+    """Whole export: prims split among instances sharing single geometry,
+       some of them animated, plus material, camera and light.
+    """
+    import fakehou, habylon, fromHoudini
+    fakehou.clear()
+    fakehou.setFrameRange(1, options.frames)
+    material = fakehou.material('surface', texture='diffuse.jpg')
+    geometry = grid_for(prims / options.instances)
+    nodes    = fakehou.scatter('instance', geometry, options.instances,
+                               material=material.path(), animated=options.animated)
+    nodes   += [fakehou.camera('cam', translate=(0, 10, 50)), fakehou.light('light')]
+    return fromHoudini.run, (habylon.Scene(), nodes, True, options.directory, False, None,
+                             None, options.workers, 256*1024**2, options.key_tolerance,
+                             options.compact)
+
+
+# name, setup and whether stage depends on number of prims:
+STAGES = (('parse_sop',             setup_parse_sop,                 True),
+          ('parse_sop_vertex',      lambda prims, options: \
+                                    setup_parse_sop(prims, options, 'vertex'), True),
+          ('parse_vertex_attribs',  setup_parse_vertex_attribs,      True),
+          ('parse_xform',           setup_parse_xform,               False),
+          ('parse_vertex_animation',setup_parse_vertex_animation,    True),
+          ('convert_to_binary',     setup_convert_to_binary,         True),
+          ('stream_sop',            setup_stream_sop,                True),
+          ('scene_dump',            setup_dump,                      True),
+          ('run',                   setup_run,                       True))
+
+
+def revision():
+    """Git commit of the exporter, if we can tell."""
+    import subprocess
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(options):
+    """Runs selected stages for every prims count. Returns results' dictionary."""
+    import platform, numpy
+    results = []
+    for name, setup, scales in STAGES:
+        if options.stages and name not in options.stages:
+            continue
+        for prims in (options.prims if scales else [0]):
+            runs    = measure(lambda: setup(prims, options), options.repeat)
+            seconds = [run[0] for run in runs]
+            result  = {'stage': name, 'prims': prims, 'seconds': min(seconds),
+                       'mean': sum(seconds) / len(seconds),
+                       'peak_bytes': max(run[1] for run in runs)}
+            print "%-24s %10d prims %10.4f s %10.1f MB" % \
+                (name, prims, result['seconds'], result['peak_bytes'] / 1024.0**2)
+            results.append(result)
+
+    return {'revision': revision(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(), 'numpy': numpy.__version__,
+            'platform': platform.platform(), 'results': results}
+
+
+def compare(new, old, threshold=1.2):
+    """Prints ratios of new to old results. Returns number of stages, which
+       got slower (or hungrier) more than threshold times. Stages faster than 
+       10ms are too noisy to count.
+    """
+    previous    = dict(((r['stage'], r['prims']), r) for r in old['results'])
+    regressions = 0
+    print "Compared to %s (%s):" % (old.get('revision'), old.get('date'))
+    for result in new['results']:
+        before = previous.get((result['stage'], result['prims']))
+        if before is None:
+            continue
+        speed  = result['seconds'] / max(before['seconds'], 1e-9)
+        memory = (result['peak_bytes'] + 1.0) / (before['peak_bytes'] + 1.0)
+        worse  = (speed > threshold and result['seconds'] > 0.01) or memory > threshold
+        regressions += worse
+        print "%-24s %10d prims  time x%.2f  memory x%.2f%s" % (result['stage'],
+            result['prims'], speed, memory, "  <- regression" if worse else "")
+    return regressions
+
+
+def main():
+    import argparse, json, shutil, tempfile
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prims', type=int, nargs='+', default=[1000, 100000],
+                        help="Sizes of geometry in triangles (up to 10M or so).")
+    parser.add_argument('--stages', nargs='+', choices=[stage[0] for stage in STAGES])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--frames', type=int, default=240)
+    parser.add_argument('--instances', type=int, default=10)
+    parser.add_argument('--animated', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--key-tolerance', type=float, default=None)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--output', help="Save results as json.")
+    parser.add_argument('--compare', help="Compare to results saved with --output.")
+    parser.add_argument('--threshold', type=float, default=1.2)
+    options = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    os.environ.setdefault('HABYLON_PATH', here)
+    import fakehou
+    fakehou.install()
+
+    options.directory = tempfile.mkdtemp(prefix='habylon_benchmark')
+    try:
+        results = benchmark(options)
+    finally:
+        shutil.rmtree(options.directory, True)
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as file:
+            if compare(results, json.load(file), options.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__": main()
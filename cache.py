@@ -0,0 +1,91 @@
+"""Persistent cache of exported nodes. Every entry holds objects a node added
+   to the scene, keyed by node's path and fingerprint (see fromHoudini.node_fingerprint()),
+   so re-export of unchanged nodes can skip parsing and writing binary files.
+"""
+import json
+import os
+import time
+
+
+class ExportCache(object):
+    """Directory of json files, one per node, plus index.json with their sizes
+       and last use. Least recently used entries are evicted when cache grows
+       over max_bytes.
+    """
+    def __init__(self, directory, max_bytes=1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index     = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        index = os.path.join(directory, "index.json")
+        if os.path.exists(index):
+            with open(index) as file:
+                self.index = json.load(file)
+
+    def _filename(self, path):
+        import hashlib
+        return os.path.join(self.directory, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, path, fingerprint):
+        """Returns entry (dict with objects, resources and fingerprint)
+           stored for node's path, or None if there is none or it is stale.
+        """
+        item = self.index.get(path)
+        if item is None or item['fingerprint'] != fingerprint:
+            return None
+        try:
+            with open(self._filename(path)) as file:
+                entry = json.load(file)
+        except (IOError, ValueError):
+            self.invalidate(path)
+            return None
+        item['used'] = time.time()
+        return entry
+
+    def put(self, path, fingerprint, objects, resources=(), digests=None):
+        """Stores objects (BObjects) node with path added to the scene. resources are
+           names of vertexData and binary files they refer to, and digests their
+           GeometryRegistry digests (if any).
+        """
+        from habylon import json_default
+        digests = digests or [None] * len(objects)
+        entry   = {'fingerprint': fingerprint,
+                   'resources':   sorted(resources),
+                   'objects':     [{'type': obj.type, 'data': obj, 'digest': digest} \
+                                   for obj, digest in zip(objects, digests)]}
+        filename = self._filename(path)
+        with open(filename, 'w') as file:
+            json.dump(entry, file, default=json_default)
+        self.index[path] = {'fingerprint': fingerprint, 'used': time.time(),
+                            'size': os.path.getsize(filename)}
+        self.evict()
+
+    def invalidate(self, path=None):
+        """Forgets node with path, or everything if path is None.
+        """
+        paths = list(self.index) if path is None else [path]
+        for path in paths:
+            self.index.pop(path, None)
+            filename = self._filename(path)
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def size(self):
+        return sum(item['size'] for item in self.index.values())
+
+    def evict(self):
+        """Removes least recently used entries until cache fits max_bytes.
+        """
+        size = self.size()
+        for path in sorted(self.index, key=lambda path: self.index[path]['used']):
+            if size <= self.max_bytes:
+                break
+            size -= self.index[path]['size']
+            self.invalidate(path)
+
+    def save(self):
+        """Writes index to disk. Call it after export.
+        """
+        with open(os.path.join(self.directory, "index.json"), 'w') as file:
+            json.dump(self.index, file)
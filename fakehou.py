@@ -0,0 +1,555 @@
+"""Tiny stand-in for Houdini's hou module. It implements only the part of hou API
+   our exporter uses, so parsers can be run (and timed) outside of Houdini.
+   Geometry keeps its attributes in numpy arrays, so even big meshes are cheap
+   to create.
+
+   Nodes live in a flat registry by their paths (see node()), and functions
+   below hou API (grid(), scatter(), geo(), material()...) build scenes
+   of any size.
+
+   Usage:
+        import fakehou
+        fakehou.install()    # 'import hou' returns fakehou from now on.
+        geo = fakehou.grid(100, 100)
+        obj = fakehou.geo('grid', geo, spin=(0, 90, 0))
+"""
+import sys
+
+# Nodes by path and global variables, as hou.node() and hou.expandString() see them:
+_nodes     = {}
+_variables = {'RFSTART': 1, 'RFEND': 240, 'FPS': 24}
+
+
+class Attrib(object):
+    def __init__(self, name, size):
+        self._name = name
+        self._size = size
+
+    def name(self):
+        return self._name
+
+    def size(self):
+        return self._size
+
+
+class BoundingBox(object):
+    def __init__(self, minvec, maxvec):
+        self._min = tuple(minvec)
+        self._max = tuple(maxvec)
+
+    def minvec(self):
+        return self._min
+
+    def maxvec(self):
+        return self._max
+
+    def sizevec(self):
+        return tuple(b - a for a, b in zip(self._min, self._max))
+
+
+class Point(object):
+    def __init__(self, geometry, number):
+        self._geometry = geometry
+        self._number   = number
+
+    def number(self):
+        return self._number
+
+    def position(self):
+        return self.attribValue('P')
+
+    def attribValue(self, name):
+        return tuple(self._geometry._point_attribs[name][self._number].tolist())
+
+
+class Vertex(object):
+    def __init__(self, prim, number, linear):
+        self._prim   = prim
+        self._number = number
+        self._linear = linear
+
+    def number(self):
+        return self._number
+
+    def point(self):
+        geometry = self._prim._geometry
+        return Point(geometry, int(geometry._vertex_points[self._linear]))
+
+    def attribValue(self, name):
+        values = self._prim._geometry._vertex_attribs[name]
+        return tuple(values[self._linear].tolist())
+
+
+class primType(object):
+    Polygon        = 'Polygon'
+    PackedGeometry = 'PackedGeometry'
+
+
+class Prim(object):
+    def __init__(self, geometry, number):
+        self._geometry = geometry
+        self._number   = number
+
+    def number(self):
+        return self._number
+
+    def type(self):
+        return primType.Polygon
+
+    def numVertices(self):
+        return int(self._geometry._prim_counts[self._number])
+
+    def vertices(self):
+        start = int(self._geometry._prim_starts[self._number])
+        return tuple(Vertex(self, n, start + n) for n in range(self.numVertices()))
+
+
+class PackedGeometry(Prim):
+    """Packed primitive with embedded geometry (see copy_to_points())."""
+    def type(self):
+        return primType.PackedGeometry
+
+    def getEmbeddedGeometry(self):
+        return self._geometry._packed[self._number][0]
+
+    def fullTransform(self):
+        return Matrix4(self._geometry._packed[self._number][2])
+
+    def intrinsicValue(self, name):
+        geometry, id, matrix = self._geometry._packed[self._number]
+        if name == 'geometryid':
+            return id
+        if name == 'packedfulltransform':
+            return tuple(matrix.ravel().tolist())
+        raise KeyError(name)
+
+
+class Geometry(object):
+    """Polygonal geometry. Topology is defined by vertex count per primitive
+       and point number per vertex (both flat arrays), the way Houdini stores it.
+    """
+    def __init__(self, prim_counts=(), vertex_points=()):
+        import numpy
+        self._prim_counts    = numpy.asarray(prim_counts, dtype=numpy.int32)
+        self._vertex_points  = numpy.asarray(vertex_points, dtype=numpy.int32)
+        self._prim_starts    = numpy.zeros(len(self._prim_counts), dtype=numpy.int64)
+        self._prim_starts[1:]= numpy.cumsum(self._prim_counts)[:-1]
+        self._point_attribs  = {}
+        self._vertex_attribs = {}
+        # (embedded geometry, its id, 4x4 matrix) per prim of packed geometry:
+        self._packed         = None
+
+    def _set_attrib(self, attribs, name, values):
+        import numpy
+        values = numpy.asarray(values, dtype=numpy.float32)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        attribs[name] = values
+
+    def setPointAttrib(self, name, values):
+        """Not in hou API. values is (npoints, size) array."""
+        self._set_attrib(self._point_attribs, name, values)
+
+    def setVertexAttrib(self, name, values):
+        """Not in hou API. values is (nvertices, size) array."""
+        self._set_attrib(self._vertex_attribs, name, values)
+
+    def _find(self, attribs, name):
+        if name in attribs:
+            return Attrib(name, attribs[name].shape[1])
+
+    def findPointAttrib(self, name):
+        return self._find(self._point_attribs, name)
+
+    def findVertexAttrib(self, name):
+        return self._find(self._vertex_attribs, name)
+
+    def _prim(self, number):
+        return Prim(self, number) if self._packed is None else PackedGeometry(self, number)
+
+    def prim(self, number):
+        return self._prim(number)
+
+    def prims(self):
+        return tuple(self._prim(n) for n in range(len(self._prim_counts)))
+
+    def iterPrims(self):
+        return (self._prim(n) for n in range(len(self._prim_counts)))
+
+    def countPrimType(self, type):
+        kind = primType.Polygon if self._packed is None else primType.PackedGeometry
+        return len(self._prim_counts) if type == kind else 0
+
+    def points(self):
+        return tuple(Point(self, n) for n in range(len(self._point_attribs['P'])))
+
+    def pointFloatAttribValues(self, name):
+        return tuple(self._point_attribs[name].ravel().tolist())
+
+    def pointFloatAttribValuesAsString(self, name):
+        return self._point_attribs[name].tostring()
+
+    def vertexFloatAttribValues(self, name):
+        return tuple(self._vertex_attribs[name].ravel().tolist())
+
+    def vertexFloatAttribValuesAsString(self, name):
+        return self._vertex_attribs[name].tostring()
+
+    def vertexIntAttribValuesAsString(self, name):
+        import numpy
+        return self._vertex_attribs[name].astype(numpy.int32).tostring()
+
+    def pointAttribs(self):
+        return tuple(Attrib(name, values.shape[1]) for name, values in self._point_attribs.items())
+
+    def vertexAttribs(self):
+        return tuple(Attrib(name, values.shape[1]) for name, values in self._vertex_attribs.items())
+
+    def intrinsicValue(self, name):
+        counts = {'pointcount':     len(self._point_attribs['P']),
+                  'vertexcount':    len(self._vertex_points),
+                  'primitivecount': len(self._prim_counts)}
+        return counts[name]
+
+    def boundingBox(self):
+        positions = self._point_attribs['P']
+        return BoundingBox(positions.min(axis=0).tolist(), positions.max(axis=0).tolist())
+
+
+class SopVerb(object):
+    """Verb of SOP. It is no VEX compiler: attribwrangle runs only snippets,
+       which assign vertexpoint() or vertexprim() of @vtxnum to int vertex
+       attributes (like fromHoudini.vertex_topology() does).
+    """
+    def __init__(self, name):
+        self._name  = name
+        self._parms = {}
+
+    def setParms(self, parms):
+        self._parms.update(parms)
+
+    def execute(self, geometry, inputs):
+        import re, numpy
+        source = inputs[0]
+        geometry.__dict__.update(source.__dict__)
+        geometry._point_attribs  = dict(source._point_attribs)
+        geometry._vertex_attribs = dict(source._vertex_attribs)
+        assert self._name == 'attribwrangle' and self._parms.get('class') == 3, self._name
+        functions = {'vertexpoint': source._vertex_points,
+                     'vertexprim':  numpy.repeat(numpy.arange(len(source._prim_counts)), 
+                                                 source._prim_counts)}
+        for name, function in re.findall(r'i@(\w+)\s*=\s*(\w+)\(0,\s*@vtxnum\);', 
+                                         self._parms['snippet']):
+            geometry._vertex_attribs[name] = functions[function].astype(numpy.int32).reshape(-1, 1)
+
+
+class SopNodeTypeCategory(object):
+    def nodeVerb(self, name):
+        return SopVerb(name)
+
+
+def sopNodeTypeCategory():
+    return SopNodeTypeCategory()
+
+
+class Matrix4(object):
+    """4x4 matrix in Houdini's row vectors convention."""
+    def __init__(self, values=1.0):
+        import numpy
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if values.size == 1:
+            values = numpy.eye(4) * values
+        self._matrix = values.reshape(4, 4)
+
+    def asTuple(self):
+        return tuple(self._matrix.ravel().tolist())
+
+    def inverted(self):
+        import numpy
+        return Matrix4(numpy.linalg.inv(self._matrix))
+
+    def __mul__(self, other):
+        import numpy
+        return Matrix4(numpy.dot(self._matrix, other._matrix))
+
+
+def transform(translate=(0, 0, 0), rotate=(0, 0, 0), scale=(1, 1, 1)):
+    """Not in hou API (hou.hmath.buildTransform() is close). Returns Matrix4
+       with 'srt' transform and 'xyz' rotate orders, rotate in degrees.
+    """
+    import numpy
+    x, y, z = numpy.radians(rotate)
+    rx = numpy.array(((1, 0, 0), (0, numpy.cos(x), numpy.sin(x)), (0, -numpy.sin(x), numpy.cos(x))))
+    ry = numpy.array(((numpy.cos(y), 0, -numpy.sin(y)), (0, 1, 0), (numpy.sin(y), 0, numpy.cos(y))))
+    rz = numpy.array(((numpy.cos(z), numpy.sin(z), 0), (-numpy.sin(z), numpy.cos(z), 0), (0, 0, 1)))
+    matrix = numpy.eye(4)
+    matrix[:3, :3] = numpy.dot(numpy.diag(scale), numpy.dot(rx, numpy.dot(ry, rz)))
+    matrix[3, :3]  = translate
+    return Matrix4(matrix)
+
+
+class Parm(object):
+    """Both hou.Parm and hou.ParmTuple, value is a number, string or tuple."""
+    def __init__(self, name, value):
+        self._name  = name
+        self._value = value
+
+    def name(self):
+        return self._name
+
+    def eval(self):
+        return self._value
+
+    def tuple(self):
+        return self
+
+    def keyframes(self):
+        return ()
+
+    def evalAsFloatsAtFrame(self, frame):
+        return tuple(float(v) for v in self._value)
+
+
+class NodeType(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class Node(object):
+    """Any node. Creating it registers it under its path."""
+    def __init__(self, path, type, parms=None):
+        self._path  = path
+        self._type  = NodeType(type)
+        self._parms = dict((name, Parm(name, value)) for name, value in (parms or {}).items())
+        self._inputs= ()
+        _nodes[path] = self
+
+    def path(self):
+        return self._path
+
+    def name(self):
+        return self._path.rsplit('/', 1)[-1]
+
+    def type(self):
+        return self._type
+
+    def parm(self, name):
+        return self._parms.get(name)
+
+    def parmTuple(self, name):
+        return self._parms.get(name)
+
+    def parms(self):
+        return tuple(self._parms[name] for name in sorted(self._parms))
+
+    def inputs(self):
+        return self._inputs
+
+    def setInput(self, index, node):
+        self._inputs = (node,)
+
+
+class SopNode(Node):
+    """SOP with fixed geometry. deform(positions, time) makes it deforming,
+       returning positions at given time.
+    """
+    def __init__(self, path, geometry, deform=None):
+        super(SopNode, self).__init__(path, 'null')
+        self._geometry = geometry
+        self._deform   = deform
+
+    def geometry(self):
+        return self._geometry
+
+    def geometryAtFrame(self, frame):
+        import copy
+        if self._deform is None:
+            return self._geometry
+        geometry = copy.copy(self._geometry)
+        geometry._point_attribs = dict(geometry._point_attribs)
+        geometry.setPointAttrib('P', self._deform(self._geometry._point_attribs['P'], 
+                                                  (frame - 1) / fps()))
+        return geometry
+
+    def isTimeDependent(self):
+        return self._deform is not None
+
+
+class ObjNode(Node):
+    """Object with transform. velocity (units per second) and spin (degrees
+       per second) make it animated.
+    """
+    def __init__(self, path, type, parms=None, translate=(0, 0, 0), rotate=(0, 0, 0),
+                 scale=(1, 1, 1), velocity=None, spin=None):
+        super(ObjNode, self).__init__(path, type, parms)
+        self._transform = (translate, rotate, scale)
+        self._motion    = (velocity or (0, 0, 0), spin or (0, 0, 0))
+        self._animated  = bool(velocity or spin)
+        self._render    = None
+
+    def worldTransformAtTime(self, time):
+        (translate, rotate, scale), (velocity, spin) = self._transform, self._motion
+        return transform([t + v * time for t, v in zip(translate, velocity)],
+                         [r + s * time for r, s in zip(rotate, spin)], scale)
+
+    def worldTransform(self):
+        return self.worldTransformAtTime(0.0)
+
+    def isTimeDependent(self):
+        return self._animated
+
+    def renderNode(self):
+        return self._render
+
+
+def node(path):
+    return _nodes.get(path)
+
+
+def expandString(text):
+    import re
+    return re.sub(r'\$(\w+)', lambda match: str(_variables.get(match.group(1), '')), text)
+
+
+def fps():
+    return float(_variables['FPS'])
+
+
+def setFps(value):
+    _variables['FPS'] = value
+
+
+def setFrameRange(start, end):
+    """Not in hou API (hou.playbar.setFrameRange() is close)."""
+    _variables['RFSTART'], _variables['RFEND'] = start, end
+
+
+def clear():
+    """Not in hou API. Forgets all nodes."""
+    _nodes.clear()
+
+
+def grid(rows, columns, size=10.0, normals='point', uvs=True, colors=False):
+    """Creates triangulated grid on XZ plane. normals is either 'point'
+       or 'vertex', which decides which exporter's path will be taken.
+    """
+    import numpy
+    xs, zs = numpy.meshgrid(numpy.linspace(-size/2.0, size/2.0, columns),
+                            numpy.linspace(-size/2.0, size/2.0, rows))
+    npoints   = rows * columns
+    positions = numpy.zeros((npoints, 3), dtype=numpy.float32)
+    positions[:, 0] = xs.ravel()
+    positions[:, 2] = zs.ravel()
+
+    # Two triangles per quad:
+    quads  = numpy.arange(npoints).reshape(rows, columns)[:-1, :-1].ravel()
+    a, b   = quads, quads + 1
+    c, d   = quads + columns, quads + columns + 1
+    points = numpy.column_stack((a, c, b, b, c, d)).ravel()
+    geometry = Geometry(numpy.full(len(points) // 3, 3), points)
+    geometry.setPointAttrib('P', positions)
+
+    up = numpy.tile(numpy.float32((0, 1, 0)), (npoints, 1))
+    if normals == 'vertex':
+        geometry.setVertexAttrib('N', up[points])
+    else:
+        geometry.setPointAttrib('N', up)
+
+    if uvs:
+        uv = numpy.zeros((npoints, 3), dtype=numpy.float32)
+        uv[:, 0] = (xs.ravel() / size) + 0.5
+        uv[:, 1] = (zs.ravel() / size) + 0.5
+        if normals == 'vertex':
+            geometry.setVertexAttrib('uv', uv[points])
+        else:
+            geometry.setPointAttrib('uv', uv)
+
+    if colors:
+        geometry.setPointAttrib('Cd', numpy.random.RandomState(0).rand(npoints, 3))
+
+    return geometry
+
+
+def copy_to_points(geometries, count, radius=100.0, seed=0):
+    """Not in hou API. Geometry Copy to Points SOP makes with packing on:
+       count packed primitives of geometries (picked at random) at random 
+       places within radius, randomly rotated and scaled.
+    """
+    import numpy
+    random = numpy.random.RandomState(seed)
+    packed = []
+    for n in range(count):
+        which  = random.randint(len(geometries))
+        matrix = transform(random.uniform(-radius, radius, 3), random.uniform(-180, 180, 3),
+                           (random.uniform(0.5, 2.0),) * 3)
+        packed.append((geometries[which], which, matrix._matrix))
+    geometry = Geometry(numpy.ones(count), numpy.arange(count))
+    geometry.setPointAttrib('P', [item[2][3, :3] for item in packed] or numpy.zeros((0, 3)))
+    geometry._packed = packed
+    return geometry
+
+
+def geo(name, geometry, material=None, deform=None, **keywords):
+    """Creates /obj/name geo node with geometry in its render SOP. material
+       is path of a material node, deform makes SOP deforming (see SopNode),
+       keywords are ObjNode's transform and motion.
+    """
+    obj = ObjNode('/obj/' + name, 'geo', {'shop_materialpath': material or ''}, **keywords)
+    obj._render = SopNode(obj.path() + '/OUT', geometry, deform)
+    return obj
+
+
+def ripple(positions, time, height=0.5, length=2.0, speed=1.0):
+    """Not in hou API. Deform function (see SopNode) waving positions in Y."""
+    import numpy
+    positions = positions.copy()
+    distance  = numpy.sqrt(positions[:, 0] ** 2 + positions[:, 2] ** 2)
+    positions[:, 1] += height * numpy.sin(distance / length - time * speed)
+    return positions
+
+
+def scatter(name, geometry, count, radius=100.0, material=None, animated=0, seed=0):
+    """Creates count geo nodes sharing the same geometry at random places
+       within radius. First animated of them move and spin.
+    """
+    import numpy
+    random = numpy.random.RandomState(seed)
+    nodes  = []
+    for n in range(count):
+        motion = {}
+        if n < animated:
+            motion = {'velocity': tuple(random.uniform(-1, 1, 3)), 
+                      'spin':     tuple(random.uniform(-90, 90, 3))}
+        nodes.append(geo('%s%d' % (name, n), geometry, material,
+                         translate=tuple(random.uniform(-radius, radius, 3)),
+                         rotate=tuple(random.uniform(-180, 180, 3)),
+                         scale=(random.uniform(0.5, 2.0),) * 3, **motion))
+    return nodes
+
+
+def material(name, color=(0.8, 0.8, 0.8), texture='', normal_map=''):
+    """Creates /shop/name node with Mantra surface parameters our parser reads."""
+    return Node('/shop/' + name, 'principledshader', 
+                {'baseColor': tuple(color), 'diff_int': 1.0, 'specColor1': (1.0, 1.0, 1.0),
+                 'spec_int': 0.5, 'spec_rough': 0.3, 'opac_int': 1.0,
+                 'useColorMap': int(bool(texture)), 'baseColorMap': texture,
+                 'useNormalMap': int(bool(normal_map)), 'baseNormalMap': normal_map})
+
+
+def camera(name, **keywords):
+    return ObjNode('/obj/' + name, 'cam', {'aperture': 41.4214, 'focal': 50.0, 
+                   'lookatpath': ''}, **keywords)
+
+
+def light(name, shadows=True, **keywords):
+    return ObjNode('/obj/' + name, 'hlight', {'light_type': 0, 'coneenable': 0, 
+                   'light_color': (1.0, 1.0, 1.0), 'light_intensity': 1.0, 
+                   'coneangle': 45.0, 'shadow_type': int(shadows)}, **keywords)
+
+
+def install():
+    """Make 'import hou' return this module."""
+    sys.modules['hou'] = sys.modules[__name__]
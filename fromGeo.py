@@ -0,0 +1,330 @@
+"""Headless exporter of Houdini's geometry files (.geo json and .bgeo binary
+   json, optionally gzipped). Files are read into fakehou.Geometry and exported
+   with fromHoudini.run(), so output is the same as exporting /obj/<name>
+   with that geometry from Houdini. Many files are converted at once on
+   a process pool.
+
+   Usage:
+        python fromGeo.py -o /var/www/html/ --workers 8 *.bgeo.gz
+
+   NOTE: As in Houdini, geometry should be triangulated already and
+   only polygons are read.
+"""
+import os
+import sys
+
+# Binary json tokens (UT_JID in HDK):
+JID_NULL, JID_MAP_BEGIN, JID_MAP_END    = 0x00, 0x7b, 0x7d
+JID_ARRAY_BEGIN, JID_ARRAY_END          = 0x5b, 0x5d
+JID_BOOL, JID_FALSE, JID_TRUE           = 0x10, 0x30, 0x31
+JID_STRING, JID_UNIFORM_ARRAY           = 0x27, 0x40
+JID_TOKENDEF, JID_TOKENREF, JID_TOKENUNDEF = 0x2b, 0x26, 0x2d
+JID_KEY_SEPARATOR, JID_VALUE_SEPARATOR  = 0x3a, 0x2c
+JID_MAGIC                               = 0x7f
+JID_NUMBERS = {0x11: '<i1', 0x12: '<i2', 0x13: '<i4', 0x14: '<i8', 0x18: '<f2',
+               0x19: '<f4', 0x1a: '<f8', 0x21: '<u1', 0x22: '<u2'}
+
+
+class BinaryJSON(object):
+    """Reader of Houdini's binary json. Uniform arrays become numpy arrays,
+       the rest is the same as json.loads() would give.
+    """
+    def __init__(self, data):
+        self.data   = data
+        self.offset = 0
+        self.tokens = {}
+        self.order  = '<'
+
+    def byte(self):
+        value = ord(self.data[self.offset])
+        self.offset += 1
+        return value
+
+    def unpack(self, dtype, count=1):
+        import numpy
+        dtype  = numpy.dtype(dtype).newbyteorder(self.order)
+        values = numpy.frombuffer(self.data, dtype, count, self.offset)
+        self.offset += dtype.itemsize * count
+        return values
+
+    def length(self):
+        length = self.byte()
+        if length < 0xf1:
+            return length
+        dtype = {0xf2: 'u2', 0xf4: 'u4', 0xf8: 'i8'}[length]
+        return int(self.unpack(dtype)[0])
+
+    def string(self):
+        length = self.length()
+        value  = self.data[self.offset:self.offset + length].decode('utf-8')
+        self.offset += length
+        return value
+
+    def key(self, token):
+        if token == JID_TOKENREF:
+            return self.tokens[self.length()]
+        return self.string()
+
+    def skip(self, token):
+        """Handles tokens' definitions and separators. Returns first other token.
+        """
+        while token in (JID_TOKENDEF, JID_TOKENUNDEF, JID_KEY_SEPARATOR, JID_VALUE_SEPARATOR):
+            if token == JID_TOKENDEF:
+                number = self.length()
+                self.tokens[number] = self.string()
+            elif token == JID_TOKENUNDEF:
+                self.tokens.pop(self.length(), None)
+            token = self.byte()
+        return token
+
+    def value(self, token):
+        """Value starting with token (already read).
+        """
+        import numpy
+        token = self.skip(token)
+
+        if token in JID_NUMBERS:
+            return self.unpack(JID_NUMBERS[token])[0].item()
+        if token in (JID_STRING, JID_TOKENREF):
+            return self.key(token)
+        if token == JID_ARRAY_BEGIN:
+            items = []
+            token = self.skip(self.byte())
+            while token != JID_ARRAY_END:
+                items.append(self.value(token))
+                token = self.skip(self.byte())
+            return items
+        if token == JID_MAP_BEGIN:
+            items = {}
+            token = self.skip(self.byte())
+            while token != JID_MAP_END:
+                key = self.key(token)
+                items[key] = self.value(self.byte())
+                token = self.skip(self.byte())
+            return items
+        if token == JID_UNIFORM_ARRAY:
+            kind  = self.byte()
+            count = self.length()
+            if kind == JID_BOOL:
+                # NOTE: Bools are packed into 32 bits words:
+                words = self.unpack('u4', (count + 31) // 32)
+                bits  = (words[:, None] >> numpy.arange(32, dtype=numpy.uint32)) & 1
+                return bits.ravel()[:count].astype(bool)
+            return self.unpack(JID_NUMBERS[kind], count)
+        if token == JID_BOOL:
+            return bool(self.byte())
+        if token in (JID_TRUE, JID_FALSE):
+            return token == JID_TRUE
+        if token == JID_NULL:
+            return None
+        raise ValueError("Unknown binary json token 0x%x at %d" % (token, self.offset - 1))
+
+    def load(self):
+        token = self.byte()
+        if token == JID_MAGIC:
+            magic = self.data[self.offset:self.offset + 4]
+            self.order   = '<' if magic == 'NSJb' else '>'
+            self.offset += 4
+            token = self.byte()
+        return self.value(token)
+
+
+def load(filename):
+    """Reads .geo or .bgeo file (gzipped if it ends with .gz) into json like
+       structure.
+    """
+    import gzip, json
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rb') as file:
+        data = file.read()
+    if data[:1] == chr(JID_MAGIC):
+        return BinaryJSON(data).load()
+    return json.loads(data)
+
+
+def pairs(items):
+    """Houdini writes most of dictionaries as [key, value, key, value...] lists.
+    """
+    if isinstance(items, dict):
+        return items
+    return dict(zip(items[0::2], items[1::2]))
+
+
+def attribute_values(values, count):
+    """Values of an attribute as (count, size) float32 array. They can be
+       stored as tuples, arrays (per component) or paged raw data.
+    """
+    import numpy
+    values = pairs(values)
+    size   = values.get('size', 1)
+    if 'tuples' in values:
+        data = numpy.asarray(values['tuples'], dtype=numpy.float32).reshape(-1, size)
+    elif 'arrays' in values:
+        data = numpy.asarray(values['arrays'], dtype=numpy.float32).reshape(size, -1).T
+    elif 'rawpagedata' in values:
+        raw      = numpy.asarray(values['rawpagedata'], dtype=numpy.float32)
+        packing  = values.get('packing') or [size]
+        pagesize = values.get('pagesize', 1024)
+        flags    = values.get('constantpageflags') or [[]] * len(packing)
+        data     = numpy.empty((count, size), dtype=numpy.float32)
+        position = 0
+        for page, start in enumerate(range(0, count, pagesize)):
+            rows   = min(pagesize, count - start)
+            column = 0
+            for width, constant in zip(packing, flags):
+                if len(constant) and constant[page]:
+                    data[start:start + rows, column:column + width] = raw[position:position + width]
+                    position += width
+                else:
+                    data[start:start + rows, column:column + width] = \
+                        raw[position:position + rows * width].reshape(rows, width)
+                    position += rows * width
+                column += width
+    else:
+        raise ValueError("Unsupported attribute values: %s" % sorted(values))
+    return data
+
+
+def read_attributes(attributes, count):
+    """Numeric attributes from [[header, body], ...] list as {name: array}.
+    """
+    result = {}
+    for header, body in attributes or []:
+        header, body = pairs(header), pairs(body)
+        if header.get('type') != 'numeric':
+            continue
+        result[header['name']] = attribute_values(body['values'], count)
+    return result
+
+
+def read_polygons(primitives):
+    """Vertex numbers of polygons in primitives' order and vertex count
+       per polygon. Other primitives are skipped.
+    """
+    import numpy
+    vertices, counts = [], []
+    for primitive in primitives:
+        header, body = primitive
+        header = pairs(header)
+        kind   = header.get('type')
+        if kind == 'Poly':
+            polygon = numpy.asarray(pairs(body)['vertex'], dtype=numpy.int64)
+            vertices.append(polygon)
+            counts.append([len(polygon)])
+        elif kind == 'Polygon_run':
+            body  = pairs(body)
+            start = body.get('startvertex', 0)
+            if 'nvertices_rle' in body:
+                rle   = numpy.asarray(body['nvertices_rle'], dtype=numpy.int64)
+                sizes = numpy.repeat(rle[0::2], rle[1::2])
+            else:
+                sizes = numpy.asarray(body['nvertices'], dtype=numpy.int64)
+            vertices.append(numpy.arange(start, start + sizes.sum(), dtype=numpy.int64))
+            counts.append(sizes)
+        elif kind == 'run' and header.get('runtype') == 'Poly':
+            # Varying fields per polygon, we need only 'vertex':
+            field = list(header.get('varyingfields', ['vertex'])).index('vertex')
+            for fields in body:
+                polygon = numpy.asarray(fields[field], dtype=numpy.int64)
+                vertices.append(polygon)
+                counts.append([len(polygon)])
+    if not vertices:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(vertices), numpy.concatenate([numpy.asarray(c) for c in counts])
+
+
+def read_geometry(filename):
+    """Reads Houdini's geometry file into fakehou.Geometry.
+    """
+    import numpy
+    import fakehou
+    geo        = pairs(load(filename))
+    npoints    = geo['pointcount']
+    nvertices  = geo['vertexcount']
+    pointref   = pairs(pairs(geo['topology'])['pointref'])
+    points     = numpy.asarray(pointref['indices'], dtype=numpy.int64)
+    vertices, counts = read_polygons(geo.get('primitives', []))
+
+    geometry   = fakehou.Geometry(counts, points[vertices])
+    attributes = pairs(geo.get('attributes', []))
+    for name, values in read_attributes(attributes.get('pointattributes'), npoints).items():
+        # NOTE: Older files keep P homogeneous:
+        geometry.setPointAttrib(name, values[:, :3] if name == 'P' else values)
+    for name, values in read_attributes(attributes.get('vertexattributes'), nvertices).items():
+        geometry.setVertexAttrib(name, values[vertices])
+    return geometry
+
+
+def node_name(filename):
+    """Name of Obj node geometry of filename would have (foo.bgeo.gz -> foo).
+    """
+    import re
+    name = os.path.basename(filename)
+    for extension in ('.gz', '.sc', '.bgeo', '.geo'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def convert(job):
+    """Exports single file. job is (filename, output directory, run()'s keywords).
+       Returns filename, scene file and report's summary.
+    """
+    import time
+    import fakehou
+    from habylon import Scene
+    from fromHoudini import run
+    filename, directory, options = job
+    start    = time.time()
+    name     = node_name(filename)
+    fakehou.clear()
+    node     = fakehou.geo(name, read_geometry(filename))
+    scene    = run(Scene(), [node], scene_save_path=directory, filename=name + ".babylon",
+                   **options)
+    prims    = scene.report.stages.get('parse_sop', {}).get('prims', 0)
+    return filename, os.path.join(directory, name + ".babylon"), prims, time.time() - start
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-o', '--output', default='.', help="Directory for scenes.")
+    parser.add_argument('--workers', type=int, default=0, help="Processes (all cpus by default).")
+    parser.add_argument('--weld', action='store_true')
+    parser.add_argument('--weld-tolerance', type=float, default=None)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--lods', type=float, nargs='+', default=None,
+                        help="ratio distance pairs of levels of detail.")
+    options = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    os.environ.setdefault('HABYLON_PATH', here)
+    import fakehou
+    fakehou.install()
+
+    names = [node_name(filename) for filename in options.files]
+    if len(set(names)) != len(names):
+        parser.error("Files would overwrite each other's scenes: %s" % \
+                     sorted(name for name in set(names) if names.count(name) > 1))
+
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+    keywords = {'weld': options.weld, 'weld_tolerance': options.weld_tolerance,
+                'compact': options.compact}
+    if options.lods:
+        keywords['lods'] = list(zip(options.lods[0::2], options.lods[1::2]))
+    jobs = [(filename, options.output, keywords) for filename in options.files]
+
+    if options.workers == 1 or len(jobs) == 1:
+        results = (convert(job) for job in jobs)
+    else:
+        import multiprocessing
+        pool    = multiprocessing.Pool(options.workers or None)
+        results = pool.imap_unordered(convert, jobs)
+    for filename, scene, prims, seconds in results:
+        print "%s -> %s (%d prims, %.2f s)" % (filename, scene, prims, seconds)
+
+
+if __name__ == "__main__": main()
@@ -1,14 +1,14 @@
 def parse_camera(scene, bobject, node):
     """As the name says."""
-    from hou import Vector3, Matrix4
+    import numpy
     from math import atan
 
-    babylonTransform    = convert_space(node.worldTransform(), \
-                                        scene.HOUDINI_TO_BABYLON_SPACE)
+    babylonTransform    = babylon_matrices(node.worldTransform().asTuple(), \
+                                           scene.HOUDINI_TO_BABYLON_SPACE)[0]
     bobject['id']       = id_from_path(node.path())
     bobject['name']     = unicode(node.name())
-    bobject['position'] = list(babylonTransform.extractTranslates())
-    bobject['target']   = list(Vector3(0,0,-1) * babylonTransform)
+    bobject['position'] = babylonTransform[3, :3].tolist()
+    bobject['target']   = numpy.dot((0, 0, -1, 1), babylonTransform)[:3].tolist()
     aperture            = node.parm("aperture").eval()
     focal               = node.parm("focal").eval()
     bobject['fov']      = 2 * atan((aperture/2.0) / focal)
@@ -33,18 +33,91 @@ def parse_camera(scene, bobject, node):
     return bobject
 
 
-def convert_space(matrix, space):
-    """ Convert between different coordinate system using provided
-        matrix.
+def babylon_matrices(matrices, space):
+    """ Converts Houdini's matrices (sequence of 16 floats tuples or (n, 4, 4) 
+        array) into space all at once. Returns (n, 4, 4) numpy array.
     """
-    from hou import Matrix4
-    new_space = Matrix4(space)
-    return new_space.inverted() * matrix * new_space
+    import numpy
+    space    = numpy.array(space, dtype=numpy.float64).reshape(4, 4)
+    matrices = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+    return numpy.matmul(numpy.matmul(numpy.linalg.inv(space), matrices), space)
+
+
+def decompose(matrices):
+    """ Batch version of hou.Matrix4.extractTranslates(), extractRotates() and 
+        extractScales() with default 'srt' transform order, but rotates are 
+        in Babylon's order (Matrix.RotationYawPitchRoll(y, x, z): roll around
+        Z first, then pitch around X and yaw around Y), so Babylon builds the
+        same matrix from them. matrices is (n, 4, 4) array (row vectors 
+        convention, as in Houdini and Babylon).
+        Returns (n, 3) arrays of translates, rotates (in degrees) and scales.
+    """
+    import numpy
+    translates = matrices[:, 3, :3].copy()
+    linear     = matrices[:, :3, :3]
+    scales     = numpy.sqrt((linear ** 2).sum(axis=2))
+    # Mirroring matrices have negative scale:
+    scales[numpy.linalg.det(linear) < 0] *= -1
+    scales[scales == 0] = 1.0
+    rotation   = linear / scales[:, :, None]
+
+    # With row vectors R = Rz * Rx * Ry, so R[2,1] = -sin(rx):
+    sin_x      = numpy.clip(-rotation[:, 2, 1], -1.0, 1.0)
+    rotates    = numpy.empty_like(translates)
+    rotates[:, 0] = numpy.arcsin(sin_x)
+    rotates[:, 1] = numpy.arctan2(rotation[:, 2, 0], rotation[:, 2, 2])
+    rotates[:, 2] = numpy.arctan2(rotation[:, 0, 1], rotation[:, 1, 1])
+    # Gimbal lock, rz is arbitrary, so keep it zero (then R = Rx * Ry):
+    locked     = numpy.abs(sin_x) > 1.0 - 1e-12
+    if locked.any():
+        rotates[locked, 1] = numpy.arctan2(-rotation[locked, 0, 2], rotation[locked, 0, 0])
+        rotates[locked, 2] = 0.0
+    return translates, numpy.degrees(rotates), scales
+
+
+def compose(translates, rotates, scales):
+    """ Inverse of decompose(): builds (n, 4, 4) matrices from (n, 3) arrays
+        of translates, rotates (in degrees) and scales the way Babylon does
+        (scaling, then RotationYawPitchRoll(), then translation).
+    """
+    import numpy
+    translates = numpy.asarray(translates, dtype=numpy.float64).reshape(-1, 3)
+    x, y, z    = numpy.radians(numpy.asarray(rotates, dtype=numpy.float64).reshape(-1, 3)).T
+    zeros, ones = numpy.zeros_like(x), numpy.ones_like(x)
+    def stack(rows):
+        return numpy.array(rows).transpose(2, 0, 1)
+    rx = stack(((ones, zeros, zeros), (zeros, numpy.cos(x), numpy.sin(x)), 
+                (zeros, -numpy.sin(x), numpy.cos(x))))
+    ry = stack(((numpy.cos(y), zeros, -numpy.sin(y)), (zeros, ones, zeros), 
+                (numpy.sin(y), zeros, numpy.cos(y))))
+    rz = stack(((numpy.cos(z), numpy.sin(z), zeros), (-numpy.sin(z), numpy.cos(z), zeros), 
+                (zeros, zeros, ones)))
+    matrices = numpy.zeros((len(translates), 4, 4))
+    matrices[:, :3, :3] = numpy.matmul(rz, numpy.matmul(rx, ry)) * \
+                          numpy.asarray(scales, dtype=numpy.float64).reshape(-1, 3, 1)
+    matrices[:, 3, :3]  = translates
+    matrices[:, 3, 3]   = 1.0
+    return matrices
+
+
+def sample_world_transforms(nodes, start, end, freq=30):
+    """ Samples world transforms of all nodes in single pass over the time
+        (the way parse_xform() does it). Returns dictionary with (frames, 4, 4)
+        arrays per node's path.
+    """
+    import numpy
+    samples = dict((node.path(), []) for node in nodes)
+    for frame in range(start, end, freq):
+        for node in nodes:
+            samples[node.path()].append(node.worldTransformAtTime(1.0*frame/freq).asTuple())
+    return dict((path, numpy.array(matrices, dtype=numpy.float64).reshape(-1, 4, 4)) \
+                for path, matrices in samples.items())
+
 
 def parse_light(scene, bobject, node):
     """As name says. Point, spot, and distante light are supported.
     """
-    from hou import Vector3, Matrix4
+    import numpy
 
     light_type = node.parm('light_type').eval()
     if light_type == 0:
@@ -57,14 +130,14 @@ def parse_light(scene, bobject, node):
     else:
         light_type = 0
 
-    babylonTransform    = convert_space(node.worldTransform(), \
-                                        scene.HOUDINI_TO_BABYLON_SPACE)
+    babylonTransform    = babylon_matrices(node.worldTransform().asTuple(), \
+                                           scene.HOUDINI_TO_BABYLON_SPACE)[0]
     bobject['type']     = light_type
     bobject['id']       = id_from_path(node.path())
     bobject['name']     = unicode(node.name())
-    bobject['position'] = list(babylonTransform.extractTranslates())
+    bobject['position'] = babylonTransform[3, :3].tolist()
     # Similarly to camera, Houdini's lights have flipped z axis:
-    bobject['direction']= list(Vector3(0,0,-1) * babylonTransform)
+    bobject['direction']= numpy.dot((0, 0, -1, 1), babylonTransform)[:3].tolist()
     bobject['diffuse']  = list(node.parmTuple('light_color').eval())
     bobject['intensity']= node.parm('light_intensity').eval()
     #FIXME: JS examples claims this should be in radians, but makes no sense in tests...
@@ -83,35 +156,129 @@ def parse_geo_as_bbox(bobject, node):
     bobject['id']   = unicode(node.name())
     return bobject
 
-def parse_vertex_attribs(geometry, ignore_uv=False, duplicate_uv=False):
-    """Parses vertices' attribs by iterating over polygons and its vertices.
-        TODO: This will be terribly slow for many/big meshes.
+# VEX run over vertices by vertex_topology(), and attributes it writes:
+TOPOLOGY_SNIPPET = "i@__habylon_point = vertexpoint(0, @vtxnum);\n" \
+                   "i@__habylon_prim = vertexprim(0, @vtxnum);"
+TOPOLOGY_ATTRIBS = ('__habylon_point', '__habylon_prim')
+
+
+def vertex_topology(geometry):
+    """Point and primitive number of every vertex (in vertices' order) as int32
+    arrays. HOM has no bulk reader of topology, so attribwrangle verb writes them 
+    into vertex attributes of geometry's copy and VEX does the per vertex work.
+    Returns None if there are no verbs (Houdini before 16).
+    """
+    import hou, numpy
+    try:
+        verb = hou.sopNodeTypeCategory().nodeVerb('attribwrangle')
+    except AttributeError:
+        return None
+    # Run over vertices:
+    verb.setParms({'class': 3, 'snippet': TOPOLOGY_SNIPPET})
+    result = hou.Geometry()
+    verb.execute(result, [geometry])
+    return tuple(numpy.frombuffer(result.vertexIntAttribValuesAsString(name), dtype=numpy.int32) \
+                 for name in TOPOLOGY_ATTRIBS)
+
+
+def bulk_topology(geometry, out=None, chunk_size=65536):
+    """Returns point number of every vertex in primitives' order as int32 array
+    (or fills out with it, like memory mapped one). See vertex_topology().
+    NOTE: Without verbs it is looped over chunk_size prims at a time.
+    """
+    import numpy
+    from itertools import islice
+    topology = vertex_topology(geometry)
+    if topology is not None:
+        if out is None:
+            return topology[0]
+        out[:] = topology[0]
+        return out
+
+    if out is None:
+        out = numpy.empty(geometry.intrinsicValue('vertexcount'), dtype=numpy.int32)
+    prims    = geometry.iterPrims()
+    position = 0
+    while True:
+        points = [v.point().number() for prim in islice(prims, chunk_size) \
+                  for v in prim.vertices()]
+        if not points:
+            break
+        out[position:position + len(points)] = points
+        position += len(points)
+    return out
+
+
+def bulk_prim_counts(geometry):
+    """Returns number of vertices of every primitive as int32 array (counted
+    from vertex_topology(), or looped over prims without verbs).
     """
+    import numpy
+    topology = vertex_topology(geometry)
+    if topology is not None:
+        return numpy.bincount(topology[1], minlength=geometry.intrinsicValue('primitivecount')) \
+                    .astype(numpy.int32)
+    return numpy.fromiter((prim.numVertices() for prim in geometry.iterPrims()), 
+                          dtype=numpy.int32)
 
-    positions = []
-    normals   = []
+
+def bulk_point_attrib(geometry, name):
+    """Reads point attribute at once. Returns (npoints, size) float32 array.
+    """
+    import numpy
+    size = geometry.findPointAttrib(name).size()
+    data = geometry.pointFloatAttribValuesAsString(name)
+    return numpy.frombuffer(data, dtype=numpy.float32).reshape(-1, size)
+
+
+def bulk_vertex_attrib(geometry, name):
+    """Reads vertex attribute at once. Returns (nvertices, size) float32 array.
+    """
+    import numpy
+    size = geometry.findVertexAttrib(name).size()
+    # NOTE: Older Houdinis don't have bulk readers for vertices:
+    if not hasattr(geometry, 'vertexFloatAttribValuesAsString'):
+        values = [v.attribValue(name) for prim in geometry.prims() for v in prim.vertices()]
+        return numpy.array(values, dtype=numpy.float32).reshape(-1, size)
+    data = geometry.vertexFloatAttribValuesAsString(name)
+    return numpy.frombuffer(data, dtype=numpy.float32).reshape(-1, size)
+
+
+def bulk_attrib(geometry, name, points):
+    """Per vertex values of an attribute. Vertex attribute wins over point one,
+    which is duplicated per vertex using points (from bulk_topology()).
+    Returns None if there is no such attribute.
+    """
+    if geometry.findVertexAttrib(name):
+        return bulk_vertex_attrib(geometry, name)
+    if geometry.findPointAttrib(name):
+        return bulk_point_attrib(geometry, name)[points]
+
+
+def parse_vertex_attribs(geometry, ignore_uv=False, duplicate_uv=False, points=None):
+    """Parses vertices' attribs with bulk reads. Point attributes are duplicated
+        per vertex with numpy indexing, so there is no Python loop over vertices
+        except for topology (pass points if you have it already).
+    """
+    import numpy
+    from habylon import GeometryBuffer
     uvs       = []
-    indices   = []
+    if points is None:
+        points = bulk_topology(geometry)
+    # NOTE: We need duplicate positions for vertices' attributes:
+    positions = bulk_point_attrib(geometry, 'P')[points]
+    normals   = bulk_vertex_attrib(geometry, 'N')
+    if not ignore_uv:
+        if not duplicate_uv:
+            uvs = bulk_vertex_attrib(geometry, 'uv')
+        else:
+            uvs = bulk_point_attrib(geometry, 'uv')[points]
+        uvs = GeometryBuffer.floats(uvs[:, :-1])
+    indices = numpy.arange(len(points), dtype=numpy.int32)
+
+    return GeometryBuffer.floats(positions), GeometryBuffer.floats(normals), uvs, \
+           GeometryBuffer.ints(indices)
 
-    for prim in geometry.prims():
-        pr_num = prim.number()
-        for v in prim.vertices():
-            # NOTE: We need duplicate positions for vertices' attributes:
-            pos = list(v.point().position())
-            nor = list(v.attribValue("N"))
-            if not ignore_uv:
-                if not duplicate_uv:
-                    uv = list(v.attribValue('uv'))
-                else:
-                    uv = list(v.point().attribValue('uv'))
-                uvs += uv[:-1]
-            idx = (3 * pr_num) + v.number()
-            positions += pos
-            normals   += nor
-            indices.append(idx)
-
-    return positions, normals, uvs, indices
-    
 
 def define_submesh(submesh, positions, indices, materialIndex=0, 
                     verticesStart=0, indexStart=0):
@@ -123,92 +290,218 @@ def define_submesh(submesh, positions, indices, materialIndex=0,
     return submesh
 
 
-def parse_sop(scene, bobject, sop, localData=False):
+def parse_sop(scene, bobject, sop, localData=False, weld=False, weld_tolerance=None,
+              vertex_cache=None):
     """Parse SOP geometry for attributes suppored by Babylon. Two paths seem to be necesery, 
     as we apparantly can't mix point's and vertex arrays. That is either all arrays hold 
     data per vertex or per point. The latter one is more efficent for us.
-    TODO: Support uv2, color 
+    Arrays are stored as GeometryBuffers, not lists. With weld vertices of the vertex 
+    path with equal attributes (within weld_tolerance) are merged. vertex_cache 
+    reorders triangles and vertices for GPU cache of that size (see sop_arrays()).
+    """
+    arrays, corners = sop_arrays(scene, sop.geometry(), weld, weld_tolerance, vertex_cache)
+    # NOTE: early quit as it seams that Babylon can't deal with 
+    # geometry without normals.
+    if arrays is None:
+        return bobject
+    positions, normals, uvs, uvs2, colors, indices = arrays
+    scene.report.count(prims=len(indices) / 3, vertices=len(positions) / 3)
+    return set_geometry(scene, bobject, id_from_path(sop.path()), arrays, localData)
+
+
+def sop_arrays(scene, geometry, weld=False, weld_tolerance=None, vertex_cache=None):
+    """Arrays (positions, normals, uvs, uvs2, colors, indices) of geometry as parse_sop()
+    exports them, and corners: None if they are per point, or (points, vertices) telling
+    which point and vertex every exported vertex came from (vertices are None if normals
+    are per point). Arrays are None if there are no normals. With vertex_cache triangles
+    are reordered for post-transform cache of that size and vertices by their first use
+    (see optimize.optimize_vertex_cache()).
     """
-    geometry  = sop.geometry()
+    import numpy
+    from habylon import GeometryBuffer
     positions = []
     indices   = []
     normals   = []
     uvs       = []
     uvs2      = []
     colors    = []
-    import hou
+    corners   = None
     # Check if we have vertex' or points's defined attributes:
     if geometry.findVertexAttrib("N"):
         ignore_uv = True if not geometry.findVertexAttrib('uv') \
         and not geometry.findPointAttrib('uv') else False
         duplicate_uv = not geometry.findVertexAttrib('uv')
+        points = bulk_topology(geometry)
         positions, normals, uvs, indices = parse_vertex_attribs(\
-            geometry, ignore_uv, duplicate_uv)
+            geometry, ignore_uv, duplicate_uv, points)
+        # uv2 and color, either per vertex or per point:
+        uv2    = bulk_attrib(geometry, 'uv2', points)
+        if uv2 is not None:
+            uvs2 = GeometryBuffer.floats(uv2[:, :-1])
+        color  = bulk_attrib(geometry, 'Cd', points)
+        if color is not None:
+            colors = GeometryBuffer.floats(color)
+        vertices = numpy.arange(len(points))
+
+        # Corners sharing all attributes become single vertex:
+        if weld:
+            from optimize import weld_vertices
+            arrays  = [positions, normals, uvs, uvs2, colors]
+            present = [n for n, array in enumerate(arrays) if len(array)]
+            with scene.report.stage('weld'):
+                welded, indices = weld_vertices([arrays[n] for n in present], indices, weld_tolerance)
+            for n, array in zip(present, welded):
+                arrays[n] = GeometryBuffer.floats(array)
+            positions, normals, uvs, uvs2, colors = arrays
+            # First corner of every welded vertex:
+            _, vertices = numpy.unique(indices, return_index=True)
+            indices = GeometryBuffer.ints(indices)
+        corners = (points[vertices], vertices)
 
     # Aternatively use point attribs (faster!)
     else:
         if geometry.findPointAttrib('N'):
-            normals = list(geometry.pointFloatAttribValues('N'))
+            normals = GeometryBuffer.floats(bulk_point_attrib(geometry, 'N'))
         else:
-            # NOTE: early quit as it seams that Babylon can't deal with 
-            # geometry without normals.
-            return bobject
+            return None, None
 
         # Uvs:
         if geometry.findPointAttrib('uv'):
-            uvs = list(geometry.pointFloatAttribValues('uv'))
+            uvs = GeometryBuffer.floats(bulk_point_attrib(geometry, 'uv'))
         # Uvs2:
         if geometry.findPointAttrib('uv2'):
-            uvs2 = list(geometry.pointFloatAttribValues('uv2'))
+            uvs2 = GeometryBuffer.floats(bulk_point_attrib(geometry, 'uv2'))
 
         # Color:
         # TODO: add alpha per point:
         if geometry.findPointAttrib('Cd'):
-            colors = list(geometry.pointFloatAttribValues('Cd'))
+            colors = GeometryBuffer.floats(bulk_point_attrib(geometry, 'Cd'))
 
-        positions = list(geometry.pointFloatAttribValues('P'))
+        positions = GeometryBuffer.floats(bulk_point_attrib(geometry, 'P'))
 
         # We need only indices now:
-        # TODO: Can it be faster without inlinec++?
-        # Maybe vex preprocess?
-        for prim in geometry.prims():
-            for v in prim.vertices():
-                indices.append(v.point().number())
+        indices = GeometryBuffer.ints(bulk_topology(geometry))
+
+    arrays = (positions, normals, uvs, uvs2, colors, indices)
+    if vertex_cache:
+        arrays, order = reorder_for_cache(scene, arrays, vertex_cache)
+        if corners is None:
+            corners = (order, None)
+        else:
+            corners = (corners[0][order], corners[1][order])
+
+    return arrays, corners
+
+
+def reorder_for_cache(scene, arrays, cache_size=16):
+    """Reorders triangles of arrays (positions, normals, uvs, uvs2, colors, indices)
+    for GPU's post-transform cache of cache_size and then vertices by their first use
+    (see optimize.py). Cache misses before and after go to the report. Returns new
+    arrays and old number of every vertex.
+    """
+    from habylon import GeometryBuffer
+    from optimize import optimize_vertex_cache, optimize_vertex_fetch, vertex_cache_misses
+    arrays  = list(arrays)
+    indices = arrays.pop()
+    present = [n for n, array in enumerate(arrays) if len(array)]
+    with scene.report.stage('vertex_cache') as report:
+        misses  = vertex_cache_misses(indices, cache_size)
+        indices = optimize_vertex_cache(indices, len(arrays[0]) / 3, cache_size)
+        report.count(triangles=len(indices) / 3, misses_before=misses,
+                     misses_after=vertex_cache_misses(indices, cache_size))
+        ordered, indices, order = optimize_vertex_fetch([arrays[n] for n in present], indices)
+    for n, array in zip(present, ordered):
+        arrays[n] = GeometryBuffer.floats(array)
+    return tuple(arrays) + (GeometryBuffer.ints(indices),), order
+
+
+def parse_vertex_animation(scene, mesh, sop, start, end, fps, filename, step=1e-4, 
+                           weld=False, weld_tolerance=None, vertex_cache=None):
+    """Samples positions and normals of deforming SOP every frame from start to end
+    into filename (see habylon.VertexAnimationWriter), one frame at a time, so memory
+    doesn't grow with length of animation. Vertices follow parse_sop()'s layout
+    (same weld and vertex_cache options), so topology can't change over time.
+    """
+    import os
+    from habylon import VertexAnimationWriter
+    geometry = sop.geometryAtFrame(start)
+    arrays, corners = sop_arrays(scene, geometry, weld, weld_tolerance, vertex_cache)
+    if arrays is None:
+        return mesh
+    vertices = len(arrays[0]) / 3
+    writer   = VertexAnimationWriter(filename, vertices, True, step)
+    try:
+        for frame in range(start, end + 1):
+            if frame != start:
+                geometry = sop.geometryAtFrame(frame)
+            positions = bulk_point_attrib(geometry, 'P')
+            if corners is None:
+                normals   = bulk_point_attrib(geometry, 'N')
+            elif corners[1] is None:
+                positions = positions[corners[0]]
+                normals   = bulk_point_attrib(geometry, 'N')[corners[0]]
+            else:
+                positions = positions[corners[0]]
+                normals   = bulk_vertex_attrib(geometry, 'N')[corners[1]]
+            writer.write(positions, normals)
+    finally:
+        nbytes = writer.close()
+
+    mesh['vertexAnimation'] = {'file': os.path.basename(filename), 'vertices': vertices,
+                               'from': start, 'to': end, 'framePerSecond': fps,
+                               'frames': end - start + 1, 'step': writer.step,
+                               'keyframes': writer.keyframes}
+    scene.report.count(frames=end - start + 1, bytes=nbytes)
+    return mesh
+
+
+def set_geometry(scene, bobject, geometryId, arrays, localData=False):
+    """Assigns arrays (positions, normals, uvs, uvs2, colors, indices) to mesh
+    either directly (localData, to be converted to binary) or via vertexData
+    with geometryId id.
+    """
+    positions, normals, uvs, uvs2, colors, indices = arrays
 
     # Assign arrays to our object using vertexData
-    # and assigning it to this mesh.
-    # TODO: I assume vertexData could be shared among meshes. Can we support it?
-    # This would be possible via packed primitive assuming we can recongize them
-    # via an attribute (check).
+    # and assigning it to this mesh. Identical geometry
+    # (by hash of its arrays) shares single vertexData.
 
     # Use either vertexData object to hold geometry
     # or convert arrays to binary string, which we should
     # save to file later on.
     if not localData:
-        # FIXME: This isn't clean...
-        vertexData = scene.new('vertexData')
-        vertexData['id'] = id_from_path(sop.path())
-        bobject['geometryId'] = vertexData['id']
-        scene.add(vertexData)
         bobject.__delitem__('delayLoadingFile')
         bobject.__delitem__('_binaryInfo')
-        data_holder = vertexData
+        registry = scene.geometry_registry
+        digest   = registry.digest(arrays)
+        shared   = registry.find(digest, sum(registry.nbytes(a) for a in arrays))
+        if shared is not None:
+            bobject['geometryId'] = shared['id']
+            data_holder = None
+        else:
+            # FIXME: This isn't clean...
+            vertexData = scene.new('vertexData')
+            vertexData['id'] = geometryId
+            bobject['geometryId'] = vertexData['id']
+            scene.add(vertexData)
+            registry.register(digest, vertexData)
+            data_holder = vertexData
     else:
         data_holder = bobject
 
     # data_holder is either vertexData or mesh object
     # depending whether we want save data to binary format (the latter case)
-    data_holder['positions'] = positions
-    data_holder['normals']   = normals
-    data_holder['uvs']       = uvs
-    data_holder['uvs2']      = uvs2
-    data_holder['colors']    = colors
-    data_holder['indices']   = indices
-
-    # We have to remove this key, otherwise Bab. will see black color:
-    if not colors:
-        data_holder.__delitem__('colors')
-
+    if data_holder is not None:
+        data_holder['positions'] = positions
+        data_holder['normals']   = normals
+        data_holder['uvs']       = uvs
+        data_holder['uvs2']      = uvs2
+        data_holder['colors']    = colors
+        data_holder['indices']   = indices
+
+        # We have to remove this key, otherwise Bab. will see black color:
+        if not colors:
+            data_holder.__delitem__('colors')
 
     submesh = scene.new('subMesh')
     submesh = define_submesh(submesh, positions, indices)
@@ -217,29 +510,139 @@ def parse_sop(scene, bobject, sop, localData=False):
     return bobject
 
 
+def parse_lods(scene, mesh, lods, localData=False, vertex_cache=None):
+    """Creates decimated copies of mesh (see optimize.decimate()) for every 
+    (ratio, distance) pair in lods and makes them mesh's levels of detail. 
+    Returns list of new meshes, which aren't added to the scene yet.
+    vertex_cache reorders them like parse_sop() does.
+    """
+    from habylon import GeometryBuffer
+    from optimize import decimate
+    source = mesh
+    if not mesh.get('positions'):
+        source = scene.get('vertexData', mesh['geometryId'])
+    names  = [name for name in ('uvs', 'uvs2', 'colors') if source.get(name)]
+
+    levels = []
+    for level, (ratio, distance) in enumerate(lods, 1):
+        positions, normals, attributes, indices = decimate(source['positions'], 
+            source['indices'], ratio, source['normals'], [source[name] for name in names])
+        arrays = dict(zip(names, [GeometryBuffer.floats(values) for values in attributes]))
+
+        lod = scene.new('mesh')
+        for key in ('name', 'position', 'rotation', 'scaling', 'boundingBoxMinimum', 
+                    'boundingBoxMaximum'):
+            lod[key] = list(mesh[key]) if isinstance(mesh[key], list) else mesh[key]
+        lod['id'] = mesh['id'] + u"_lod%d" % level
+        arrays = (GeometryBuffer.floats(positions), GeometryBuffer.floats(normals), 
+                  arrays.get('uvs', []), arrays.get('uvs2', []), arrays.get('colors', []), 
+                  GeometryBuffer.ints(indices))
+        if vertex_cache:
+            arrays = reorder_for_cache(scene, arrays, vertex_cache)[0]
+        set_geometry(scene, lod, lod['id'], arrays, localData)
+        scene.report.count(prims=len(indices) / 3, vertices=len(positions))
+        mesh['lodMeshIds'].append(lod['id'])
+        mesh['lodDistances'].append(float(distance))
+        levels.append(lod)
+    return levels
+
+
+def is_packed(geometry):
+    """True if geometry is made of packed primitives only (Copy to Points 
+    with packing and such), which are exported as instances (see parse_packed()).
+    """
+    import hou
+    count = geometry.intrinsicValue('primitivecount')
+    return count > 0 and geometry.countPrimType(hou.primType.PackedGeometry) == count
+
+
+def bulk_packed(geometry):
+    """Reads packed primitives. Returns their full transforms as (n, 4, 4)
+    array, id of embedded geometry per primitive and dictionary of embedded 
+    geometries by id (in order of first use).
+    NOTE: HOM has no bulk reader of prims' intrinsics (and wrangle copying
+    them to attributes would make transforms float32), so in Houdini this
+    is loop-bound: one intrinsicValue() pair per prim.
+    """
+    import collections
+    import numpy
+    sources  = collections.OrderedDict()
+    matrices = []
+    ids      = []
+    for prim in geometry.iterPrims():
+        id = prim.intrinsicValue('geometryid')
+        if id not in sources:
+            sources[id] = prim.getEmbeddedGeometry()
+        ids.append(id)
+        matrices.append(prim.intrinsicValue('packedfulltransform'))
+    return numpy.array(matrices, dtype=numpy.float64).reshape(-1, 4, 4), \
+           numpy.array(ids), sources
+
+
+def parse_packed(scene, obj, sop, localData=False, weld=False, weld_tolerance=None,
+                 vertex_cache=None):
+    """Exports packed primitives of SOP as one mesh per embedded geometry plus
+    Babylon instances of it, one per primitive, carrying its position, rotation
+    and scaling. All of them are children of obj (which keeps Obj's transform
+    and animation, but no geometry). Transforms are converted and decomposed
+    all at once. Returns list of new meshes, which aren't added to the scene yet.
+    """
+    import numpy
+    matrices, ids, sources = bulk_packed(sop.geometry())
+    translates, rotates, scales = decompose(babylon_matrices(matrices, \
+                                            scene.HOUDINI_TO_BABYLON_SPACE))
+    meshes = []
+    for number, (id, geometry) in enumerate(sources.items()):
+        arrays, _ = sop_arrays(scene, geometry, weld, weld_tolerance, vertex_cache)
+        if arrays is None:
+            continue
+        prims = numpy.flatnonzero(ids == id)
+        mesh  = scene.new('mesh')
+        mesh['id']       = obj['id'] + u"_packed%d" % number
+        mesh['name']     = mesh['id']
+        mesh['parentId'] = obj['id']
+        mesh['position'] = translates[prims[0]].tolist()
+        mesh['rotation'] = rotates[prims[0]].tolist()
+        mesh['scaling']  = scales[prims[0]].tolist()
+        mesh['boundingBoxMinimum'] = list(geometry.boundingBox().minvec())
+        mesh['boundingBoxMaximum'] = list(geometry.boundingBox().maxvec())
+        set_geometry(scene, mesh, id_from_path(sop.path()) + u"_packed%d" % number, 
+                     arrays, localData)
+        # First primitive is the mesh itself. NOTE: Instances don't inherit its parent:
+        mesh['instances'] = [{'name': u"%s_%d" % (mesh['id'], prim), 'parentId': obj['id'],
+                              'position': position, 'rotation': rotation, 
+                              'scaling': scaling} for prim, position, \
+                             rotation, scaling in zip(prims[1:].tolist(), 
+                             translates[prims[1:]].tolist(), rotates[prims[1:]].tolist(), 
+                             scales[prims[1:]].tolist())]
+        scene.report.count(prims=len(arrays[5]) / 3, vertices=len(arrays[0]) / 3, 
+                           instances=len(prims))
+        meshes.append(mesh)
+    return meshes
+
+
 def parse_obj(scene, bobject, node):
     """ Creates a babylon mesh from Obj node.
     """
-    babylonTransform    = convert_space(node.worldTransform(), \
-                                        scene.HOUDINI_TO_BABYLON_SPACE)
-    transform  = babylonTransform.extractTranslates()
-    rotation   = babylonTransform.extractRotates()
-    scale      = babylonTransform.extractScales()
+    babylonTransform    = babylon_matrices(node.worldTransform().asTuple(), \
+                                           scene.HOUDINI_TO_BABYLON_SPACE)
+    transform, rotation, scale = decompose(babylonTransform)
 
     bobject['id']       = id_from_path(node.path())
     bobject['name']     = unicode(node.name())
-    bobject['position'] = list(transform)
-    bobject['rotation'] = list(rotation)
-    bobject['scaling']  = list(scale)
+    bobject['position'] = transform[0].tolist()
+    bobject['rotation'] = rotation[0].tolist()
+    bobject['scaling']  = scale[0].tolist()
     # TODO: Not sure it this is right place for bounding box retrival.
     geometry = node.renderNode().geometry()
     bobject['boundingBoxMinimum'] = list(geometry.boundingBox().minvec())
     bobject['boundingBoxMaximum'] = list(geometry.boundingBox().maxvec())
     return bobject
 
-def parse_material(scene, bobject, shop):
+def parse_material(scene, bobject, shop, textures=None):
     """Find usual Mantra parameters on usual shaders and tries to map it
-       to Babylon material.
+       to Babylon material. With textures (textures.TexturePipeline) images
+       are copied to the scene, otherwise only their names are kept.
     """
     import os.path
     def getparmv(shop, s, bobject=None, d=None):
@@ -265,6 +668,10 @@ def parse_material(scene, bobject, shop):
             m = list(m)
             return [x*y for x, y in zip(vec, m)]
 
+    def texture_name(path):
+        name = textures.add(path) if textures is not None else None
+        return unicode(name or os.path.split(path)[1])
+
 
     bobject['id']            = id_from_path(shop.path())
     bobject['name']          = unicode(shop.name())
@@ -278,12 +685,12 @@ def parse_material(scene, bobject, shop):
     # Maps:
     if shop.parm("useColorMap").eval():
         diffuseTexture           = scene.new('texture')
-        diffuseTexture['name']   = unicode(os.path.split(shop.parm('baseColorMap').eval())[1])
+        diffuseTexture['name']   = texture_name(shop.parm('baseColorMap').eval())
         bobject['diffuseTexture']= diffuseTexture
     if shop.parm("useNormalMap").eval():
         # Babylon bump map is actually normal map...
         bumpTexture              = scene.new('texture')
-        bumpTexture['name']      = unicode(os.path.split(shop.parm('baseNormalMap').eval())[1])
+        bumpTexture['name']      = texture_name(shop.parm('baseNormalMap').eval())
         bobject['bumpTexture']   = bumpTexture
 
 
@@ -310,19 +717,16 @@ def parse_channels(scene, bobject, node, parm, start, end,  freq=30):
     parm = node.parm(parm)
     # NOTE: we assume for now that single keyframe means expression...
     if len(parm.keyframes()) > 1:
-        for item in parm.keyframes():
-            keyframe = scene.new('animationKey')
-            keyframe['frame']  = item.frame()
-            keyframe['values'] = list(parm.tuple().evalAsFloatsAtFrame(item.frame()))
-            bobject['keys'].append(keyframe)
+        keys = [{'frame': item.frame(), 
+                 'values': list(parm.tuple().evalAsFloatsAtFrame(item.frame()))} \
+                for item in parm.keyframes()]
     else:
     # Single keyframe makes channel to bake. 
     # This definitely should be exporter option per object.
-        for frame in range(start, end, freq):
-            keyframe = scene.new("animationKey")
-            keyframe['frame']  = frame * 1.0
-            keyframe['values'] = list(parm.tuple().evalAsFloatsAtFrame(int(frame)))
-            bobject['keys'].append(keyframe)
+        keys = [{'frame': frame * 1.0, 
+                 'values': list(parm.tuple().evalAsFloatsAtFrame(int(frame)))} \
+                for frame in range(start, end, freq)]
+    bobject['keys'].extend(scene.new_many('animationKey', keys))
 
     first = bobject['keys'][0]['frame']
     last  = bobject['keys'][-1]['frame']
@@ -331,88 +735,308 @@ def parse_channels(scene, bobject, node, parm, start, end,  freq=30):
 
     return bobject
 
-def parse_xform(scene, obj, node, start, end, freq=30):
+def parse_xform(scene, obj, node, start, end, freq=30, tolerance=None, matrices=None):
     """ Creates a series of animations from object's world transform.
-        This is replacement for parse_channels().
+        This is replacement for parse_channels(). With tolerance keys, which 
+        linear interpolation of the others reproduces within it, are dropped.
+        matrices are node's transforms from sample_world_transforms(), if
+        they were sampled already.
     """
-    from habylon import vector_equal
-    properties = {u'position': [], u'rotation': [], u'scaling' : []}
+    import numpy
+    from optimize import constant_samples, reduce_keys
     xform = []
 
     # Get transformations in Babylon space:
-    for frame in range(start, end, freq):
-        transform        = node.worldTransformAtTime(1.0*frame/freq)
-        babylonTransform = convert_space(transform, scene.HOUDINI_TO_BABYLON_SPACE)
-        position         = babylonTransform.extractTranslates()
-        rotation         = babylonTransform.extractRotates()
-        scale            = babylonTransform.extractScales()
-        properties['position'].append(position)
-        properties['rotation'].append(rotation)
-        properties['scaling'].append(scale)
+    if matrices is None:
+        matrices = sample_world_transforms([node], start, end, freq)[node.path()]
+    babylonTransforms = babylon_matrices(matrices, scene.HOUDINI_TO_BABYLON_SPACE)
+    position, rotation, scale = decompose(babylonTransforms)
+    properties = {u'position': position, u'rotation': rotation, u'scaling' : scale}
 
     # Create animation object per transformation component (t,r,s)
     for prop in properties:
         item = properties[prop]
         # Check for constant component and don't bother with them.
-        # This is expensive!
-        if False in [vector_equal(item[0], item[x]) for x in range(1, len(item))]:
-            animation = scene.new('animation')
-            animation['name'] = id_from_path(node.path()) + "_" + prop
-            animation['dataType'] = scene.ANIM_TYPE_VECTOR
-            animation['autoAnimateFrom'] = start*1.0
-            animation['autoAnimateTo']   = end*1.0
-            animation['framePerSecond']  = freq
-            animation['property'] = prop
-            for frame in range(len(item)):
-                keyframe = scene.new('animationKey') 
-                keyframe['frame'] = frame * 1.0 * freq
-                keyframe['values'] = list(item[frame])
-                animation['keys'].append(keyframe)
-            xform.append(animation)
+        if constant_samples(item):
+            continue
+        frames = numpy.arange(len(item)) * 1.0 * freq
+        keep   = numpy.arange(len(item))
+        if tolerance:
+            keep = reduce_keys(frames, item, tolerance)
+        scene.animation_keys[0] += len(item)
+        scene.animation_keys[1] += len(keep)
+        scene.report.count(sampled_keys=len(item), keys=len(keep))
+
+        animation = scene.new('animation')
+        animation['name'] = id_from_path(node.path()) + "_" + prop
+        animation['dataType'] = scene.ANIM_TYPE_VECTOR
+        animation['autoAnimateFrom'] = start*1.0
+        animation['autoAnimateTo']   = end*1.0
+        animation['framePerSecond']  = freq
+        animation['property'] = prop
+        keys = [{'frame': frame, 'values': values} for frame, values in \
+                zip(frames[keep].tolist(), item[keep].tolist())]
+        animation['keys'] = scene.new_many('animationKey', keys)
+        xform.append(animation)
 
     return xform
 
 
-def convert_to_binary(scene, mesh):
-    """ Converts provided Mesh object into babylon binary format, 
-        and saves it to path location.
+def convert_to_binary(scene, mesh, compact=False, normal_bits=16, uv_bits=16, color_bits=8):
+    """ Converts provided Mesh object into babylon binary format. Returns mesh
+        and list of buffers to be saved with habylon.write_binary(). Buffers
+        are views of mesh's arrays, nothing is copied.
+        With compact indices are 16 bits wide if there are less than 65536
+        vertices, normals are packed into normal_bits wide signed integers and
+        uvs and colors quantized to uv_bits and color_bits. Note, this is our 
+        extension, Babylon loader itself needs help with such data 
+        (see habylon.decode_binary()).
     """
-    # For starter. TODO: add colors, uvs2:
+    binaryInfo, buffers = binary_buffers(scene, mesh, compact, normal_bits, uv_bits, color_bits)
+    return apply_binary(mesh, binaryInfo), buffers
+
+
+def apply_binary(mesh, binaryInfo):
+    """Removes from mesh data binary_buffers() took and points it to its file.
+    """
+    for key in binaryInfo:
+        attribName = key[:-len('AttrDesc')]
+        if attribName != 'subMeshes':
+            mesh[attribName] = []
+    mesh['_binaryInfo']      = binaryInfo
+    mesh['delayLoadingFile'] = mesh['id'] + ".babylonbinarymeshdata"
+    return mesh
+
+
+def binary_buffers(scene, mesh, compact=False, normal_bits=16, uv_bits=16, color_bits=8):
+    """Packs mesh's data like convert_to_binary() does, but only reads the mesh,
+    so it can run on a worker. Returns _binaryInfo and buffers.
+    """
+    import numpy
+    from habylon import GeometryBuffer, quantize
     binary_attributes =  (('positions', 3, scene.BINARY_DATA_FLOAT), 
+                          ('colors',    3, scene.BINARY_DATA_FLOAT), 
                           ('normals',   3, scene.BINARY_DATA_FLOAT), 
                           ('uvs',       2, scene.BINARY_DATA_FLOAT),  
+                          ('uvs2',      2, scene.BINARY_DATA_FLOAT),  
                           ('indices',   1, scene.BINARY_DATA_INT))
 
-    binaryStr = ""
-    offset    = 0
+    buffers    = []
+    offset     = 0
     binaryInfo = {}# scene.new('_binaryInfo')
+    vertices   = len(mesh['positions']) / 3
 
     for attribName, stride, _type in binary_attributes:
-        attribArray = mesh[attribName]
+        attribArray = mesh.get(attribName)
         # Attribute == []:
         if not attribArray:
             continue
-        # otherwise convert and concatenate:
-        binaryStr  += scene.to_binary_string(attribArray)
-        binaryInfo["%sAttrDesc"%attribName] = \
-        {'count': len(attribArray), 'stride': stride, 'offset': offset, 'dataType': _type}
-        # Offset in bytes, it seems both floats and int are 4bytes long: 
-        offset += len(attribArray)*4
-        # Remove data from mesh:
-        mesh[attribName] = []
+        if not isinstance(attribArray, GeometryBuffer):
+            typecode    = 'i' if _type == scene.BINARY_DATA_INT else 'f'
+            attribArray = GeometryBuffer(attribArray, typecode)
+        # Colors may come with or without alpha:
+        if attribName == 'colors' and vertices:
+            stride = len(attribArray) / vertices
+        data       = attribArray.data
+        descriptor = {'count': len(attribArray), 'stride': stride, 'offset': offset, 'dataType': _type}
+
+        if compact and vertices:
+            components = len(data) / vertices
+            if attribName == 'indices' and vertices < 2**16:
+                data = data.astype('<u2')
+                descriptor['dataType'] = scene.BINARY_DATA_USHORT
+            elif attribName == 'normals':
+                data, descriptor['dataType'], extra = quantize(data, components, normal_bits, True)
+                descriptor.update(extra)
+            elif attribName in ('uvs', 'uvs2', 'colors'):
+                bits = color_bits if attribName == 'colors' else uv_bits
+                data, descriptor['dataType'], extra = quantize(data, components, bits)
+                descriptor.update(extra)
+
+        buffers.append(data)
+        binaryInfo["%sAttrDesc"%attribName] = descriptor
+        offset += data.nbytes
+        # Keep sections 4 bytes aligned for typed arrays:
+        if offset % 4:
+            buffers.append(numpy.zeros(4 - offset % 4, dtype=numpy.uint8))
+            offset += 4 - offset % 4
 
     # last x5 ints are subMeshesInfo:
-    for submesh in mesh['subMeshes']:
-        _array = [submesh["materialIndex"], submesh["verticesStart"], 
-                  submesh["indexCount"], submesh["indexStart"], submesh["verticesCount"]]
-        binaryStr += scene.to_binary_string(_array)
+    subMeshes = [(submesh["materialIndex"], submesh["verticesStart"], submesh["indexCount"],
+                  submesh["indexStart"], submesh["verticesCount"]) for submesh in mesh['subMeshes']]
+    buffers.append(numpy.array(subMeshes, dtype='<i4').ravel())
 
     binaryInfo['subMeshesAttrDesc'] = \
     {'count': len(mesh['subMeshes']), 'stride': 5, 'offset': offset, 'dataType': 0}
+    return binaryInfo, buffers
+
+
+def stream_sop(scene, bobject, sop, directory, chunk_size=65536, compact=False, 
+               normal_bits=16, uv_bits=16, color_bits=8):
+    """Binary export of SOP, which never holds its arrays: attributes are copied
+        chunk_size points (vertices, prims) at a time straight into memory mapped
+        .babylonbinarymeshdata file with the layout convert_to_binary() makes, and
+        _binaryInfo, bounding box and submesh are filled in on the way. Houdini
+        hands over one attribute at a time, so peak memory is the biggest attribute
+        plus a chunk, not all arrays and their copies. Returns None if geometry 
+        can't be streamed (no normals or vertices), parse_sop() takes it then.
+        NOTE: weld and levels of detail need whole arrays, so they can't stream.
+    """
+    import numpy, os, tempfile
+    from habylon import BINARY_DATA_TYPES, QUANTIZED_DATA_TYPES, quantize
+    geometry   = sop.geometry()
+    per_vertex = bool(geometry.findVertexAttrib('N'))
+    nvertices  = geometry.intrinsicValue('vertexcount')
+    count      = nvertices if per_vertex else geometry.intrinsicValue('pointcount')
+    if not (per_vertex or geometry.findPointAttrib('N')) or not count:
+        return None
+
+    # Attribute, its size and whether it is per vertex (else per point), with
+    # the same choices sop_arrays() makes: vertex path drops third uv component,
+    # point ones are duplicated per vertex there:
+    def source(name, trim=False):
+        if per_vertex and geometry.findVertexAttrib(name):
+            attrib, vertex = geometry.findVertexAttrib(name), True
+        elif geometry.findPointAttrib(name):
+            attrib, vertex = geometry.findPointAttrib(name), False
+        else:
+            return None
+        return name, vertex, attrib.size() - (1 if trim and per_vertex else 0)
+
+    binary_attributes =  (('positions', 3, source('P')),
+                          ('colors',    3, source('Cd')),
+                          ('normals',   3, source('N')),
+                          ('uvs',       2, source('uv', True)),
+                          ('uvs2',      2, source('uv2', True)))
+
+    # Layout of the file, it is allocated whole upfront:
+    layout     = []
+    offset     = 0
+    binaryInfo = {}
+    for attribName, stride, attrib in binary_attributes:
+        if attrib is None:
+            continue
+        components = attrib[2]
+        dataType   = scene.BINARY_DATA_FLOAT
+        extra      = {}
+        if attribName == 'colors':
+            stride = components
+        if compact and attribName == 'normals':
+            dataType, extra = QUANTIZED_DATA_TYPES[normal_bits, True], {'normalized': True}
+        elif compact and attribName in ('uvs', 'uvs2', 'colors'):
+            bits     = color_bits if attribName == 'colors' else uv_bits
+            dataType = QUANTIZED_DATA_TYPES[bits, False]
+        layout.append((attribName, attrib, offset, dataType))
+        binaryInfo["%sAttrDesc" % attribName] = dict({'count': count * components, 
+            'stride': stride, 'offset': offset, 'dataType': dataType}, **extra)
+        offset += count * components * numpy.dtype(BINARY_DATA_TYPES[dataType]).itemsize
+        offset += -offset % 4
+
+    dataType = scene.BINARY_DATA_USHORT if compact and count < 2**16 else scene.BINARY_DATA_INT
+    binaryInfo['indicesAttrDesc'] = {'count': nvertices, 'stride': 1, 'offset': offset, 
+                                     'dataType': dataType}
+    offset += nvertices * numpy.dtype(BINARY_DATA_TYPES[dataType]).itemsize
+    offset += -offset % 4
+    binaryInfo['subMeshesAttrDesc'] = {'count': 1, 'stride': 5, 'offset': offset, 'dataType': 0}
+    nbytes   = offset + 5 * 4
+
+    filename = os.path.join(directory, bobject['id'] + ".babylonbinarymeshdata")
+    data     = numpy.memmap(filename, dtype=numpy.uint8, mode='w+', shape=(nbytes,))
+    buffers  = []
+
+    def section(key, components=1):
+        descriptor = binaryInfo[key]
+        dtype      = numpy.dtype(BINARY_DATA_TYPES[descriptor['dataType']])
+        size       = descriptor['count'] * dtype.itemsize
+        if key == 'subMeshesAttrDesc':
+            size  *= descriptor['stride']
+        start      = descriptor['offset']
+        view       = data[start:start + size].view(dtype)
+        # Views of the file, the same buffers convert_to_binary() returns:
+        buffers.append(view)
+        if size % 4:
+            buffers.append(data[start + size:start + size + 4 - size % 4])
+        return view.reshape(-1, components)
+
+    def chunks():
+        for start in xrange(0, count, chunk_size):
+            yield start, min(start + chunk_size, count)
+
+    # Point of every vertex, in a temporary file too:
+    with tempfile.TemporaryFile() as temporary:
+        topology = numpy.memmap(temporary, dtype=numpy.int32, mode='w+', shape=(nvertices,))
+        bulk_topology(geometry, topology, chunk_size)
+
+        low, high = None, None
+        for attribName, (name, vertex, components), _, dataType in layout:
+            values = bulk_vertex_attrib(geometry, name) if vertex else bulk_point_attrib(geometry, name)
+            output = section("%sAttrDesc" % attribName, components)
+            descriptor = binaryInfo["%sAttrDesc" % attribName]
+
+            def rows(start, stop):
+                if per_vertex and not vertex:
+                    return values[topology[start:stop], :components]
+                return values[start:stop, :components]
+
+            # Quantization range of the whole attribute goes first:
+            if 'normalized' not in descriptor and dataType in (3, 5):
+                ranges = [(part.min(axis=0), part.max(axis=0)) for part in \
+                          (rows(start, stop) for start, stop in chunks())]
+                descriptor.update({'normalized': True,
+                                   'min': numpy.min([r[0] for r in ranges], axis=0).tolist(),
+                                   'max': numpy.max([r[1] for r in ranges], axis=0).tolist()})
+
+            for start, stop in chunks():
+                part = rows(start, stop)
+                if attribName == 'positions':
+                    low  = part.min(axis=0) if low is None else numpy.minimum(low, part.min(axis=0))
+                    high = part.max(axis=0) if high is None else numpy.maximum(high, part.max(axis=0))
+                if dataType != scene.BINARY_DATA_FLOAT:
+                    bits = 8 * output.dtype.itemsize
+                    part = quantize(part, components, bits, 'min' not in descriptor, 
+                                    descriptor.get('min'), descriptor.get('max'))[0]
+                output[start:stop] = part.reshape(-1, components)
+            values = None
+            data.flush()
+
+        indices = section('indicesAttrDesc')[:, 0]
+        for start in xrange(0, nvertices, chunk_size):
+            stop = min(start + chunk_size, nvertices)
+            indices[start:stop] = numpy.arange(start, stop) if per_vertex else topology[start:stop]
+        topology = None
+
+    # materialIndex, verticesStart, indexCount, indexStart, verticesCount:
+    section('subMeshesAttrDesc', 5)[0] = (0, 0, nvertices, 0, count)
+    data.flush()
 
-    mesh['_binaryInfo']      = binaryInfo
-    mesh['delayLoadingFile'] = mesh['id'] + ".babylonbinarymeshdata"
-    return mesh, binaryStr
+    submesh = scene.new('subMesh')
+    submesh['materialIndex'] = 0
+    submesh['verticesStart'] = 0
+    submesh['verticesCount'] = count
+    submesh['indexStart']    = 0
+    submesh['indexCount']    = nvertices
+    bobject['subMeshes']     = [submesh]
+    bobject['boundingBoxMinimum'] = low.tolist()
+    bobject['boundingBoxMaximum'] = high.tolist()
+    bobject['_binaryInfo']      = binaryInfo
+    bobject['delayLoadingFile'] = os.path.basename(filename)
+    if not binaryInfo.get('colorsAttrDesc'):
+        bobject.__delitem__('colors')
+    scene.report.count(prims=nvertices / 3, vertices=count, bytes=nbytes)
+
+    # Reuse binary file of identical geometry (see save_binary()):
+    registry = scene.geometry_registry
+    digest   = registry.digest(buffers)
+    # NOTE: File can't be removed while it is mapped (on Windows):
+    buffers  = output = indices = data = None
+    shared   = registry.find(digest, nbytes)
+    if shared is not None:
+        os.remove(filename)
+        bobject['_binaryInfo']      = dict(shared['_binaryInfo'])
+        bobject['delayLoadingFile'] = shared['delayLoadingFile']
+    else:
+        registry.register(digest, bobject)
+    return bobject
 
 
 def id_from_path(path):
@@ -421,67 +1045,449 @@ def id_from_path(path):
     return unicode(path.replace("/", "_")[1:])
 
 
-def run(scene, selected, binary=False, scene_save_path="/var/www/html/"):
-    """Callback of Houdini's shelf.
+def export_node(scene, node, binary=False, scene_save_path="/var/www/html/", weld=False,
+                weld_tolerance=None, writer=None, key_tolerance=None, matrices=None,
+                compact=False, lods=None, vertex_animation=None, textures=None,
+                stream=None, vertex_cache=None):
+    """Parses single Obj node and adds results to the scene. Binary
+       files of meshes are written to scene_save_path with writer
+       (habylon.BinaryWriter, serial one by default). key_tolerance
+       enables keyframe reduction and matrices are pre-sampled
+       transforms (see parse_xform()). compact turns on compact 
+       binary encoding (see convert_to_binary()). lods are pairs
+       of (ratio, distance) for levels of detail (see parse_lods()).
+       vertex_animation is quantization step of deforming geometry's
+       point cache (see parse_vertex_animation()), None disables it.
+       textures is TexturePipeline for images of materials. With stream
+       binary geometry is extracted that many points at a time (see stream_sop()).
+       vertex_cache reorders triangles for GPU cache of that size (see sop_arrays()).
+       SOPs of packed primitives are exported as instances (see parse_packed()).
     """
     import hou, os
-    binary = True
-    for node in selected:
-        if node.type().name() == "cam":
+    from habylon import BinaryWriter
+    writer = writer or BinaryWriter()
+    report = scene.report
+    if node.type().name() == "cam":
+        with report.stage('parse_camera'):
             camera = parse_camera(scene, scene.new("camera"), node)
-            scene.add(camera)
+        scene.add(camera)
 
-        elif node.type().name() == "hlight":
+    elif node.type().name() == "hlight":
+        with report.stage('parse_light'):
             light  = parse_light(scene, scene.new("light"), node)
-            # shadow_type = 0 means no shadow, else raytrace or depth shadows:
-            if node.parm('shadow_type').eval():
-                shadow = scene.new("shadowGenerator")
-                shadow['lightId'] = light['id']
-                scene.add(shadow)
-            scene.add(light)
-
-        elif node.type().name() == 'geo':
-            # Babylon mesh is Houdini's Obj, and babylon geometry/vertexData
-            # is closer to Houdini's SOPs. NOTE: We send to the parsers the same 
-            # object twise just changing its name (mesh->obj), so Mesh will keep 
-            # both geometry and object data.
-
-            # Parse object level properties:
+        # shadow_type = 0 means no shadow, else raytrace or depth shadows:
+        if node.parm('shadow_type').eval():
+            shadow = scene.new("shadowGenerator")
+            shadow['lightId'] = light['id']
+            scene.add(shadow)
+        scene.add(light)
+
+    elif node.type().name() == 'geo':
+        # Babylon mesh is Houdini's Obj, and babylon geometry/vertexData
+        # is closer to Houdini's SOPs. NOTE: We send to the parsers the same 
+        # object twise just changing its name (mesh->obj), so Mesh will keep 
+        # both geometry and object data.
+
+        # Parse object level properties:
+        with report.stage('parse_obj'):
             obj   = parse_obj(scene, scene.new('mesh'), node)
-            mesh  = parse_sop(scene, obj, node.renderNode(), binary)
+        mesh    = None
+        sources = []
+        # Packed primitives become instances of their geometry:
+        packed  = is_packed(node.renderNode().geometry())
+        if packed:
+            with report.stage('parse_packed'):
+                sources = parse_packed(scene, obj, node.renderNode(), binary, weld, 
+                                       weld_tolerance, vertex_cache)
+        elif binary and stream and not weld and not lods and not vertex_cache:
+            # Files of previous meshes are registered first, as in serial export:
+            writer.flush()
+            with report.stage('stream_sop'):
+                mesh = stream_sop(scene, obj, node.renderNode(), scene_save_path, stream, compact)
+        streamed = mesh is not None
+        if not streamed and not packed:
+            with report.stage('parse_sop'):
+                mesh = parse_sop(scene, obj, node.renderNode(), binary, weld, weld_tolerance,
+                                 vertex_cache)
+
+        # Levels of details are made from full resolution arrays:
+        levels = []
+        if lods and not packed:
+            with report.stage('parse_lods'):
+                levels = parse_lods(scene, obj, lods, binary, vertex_cache)
+
+        # Deforming geometry is sampled into point cache:
+        if vertex_animation and deforming(node) and not packed:
+            start, end, fps = animation_range()
+            filename = os.path.join(scene_save_path, obj['id'] + ".babylonvertexanimation")
+            with report.stage('parse_vertex_animation'):
+                parse_vertex_animation(scene, obj, node.renderNode(), start, end, fps, 
+                                       filename, vertex_animation, weld, weld_tolerance,
+                                       vertex_cache)
+
+        # Binary format: 
+        if binary:
+            for item in ([] if streamed or packed else [mesh]) + levels + sources:
+                save_binary(scene, item, writer, scene_save_path, compact)
+
+
+        # Obj level materials for now:
+        material_path = node.parm('shop_materialpath').eval()
+        if material_path != "":
+            # Materials shared by many objects are parsed once:
+            material = scene.get('material', id_from_path(material_path))
+            if material is None:
+                with report.stage('parse_material'):
+                    material = parse_material(scene, scene.new('material'), 
+                                              hou.node(material_path), textures)
+                material = scene.add(material)
+            obj['materialId'] = material['id']
+            for level in levels + sources:
+                level['materialId'] = material['id']
+
+        # Animation export. Babylon deals with vector or float animation,
+        # so we have to treat all tuple channeles at once even if only one axe
+        # is animated.
+
+        if node.isTimeDependent():
+            start, end, freq = animation_range()
+            with report.stage('parse_xform'):
+                xform = parse_xform(scene, obj, node, start, end, freq, key_tolerance, matrices)
+            obj['animations'] = xform
+
+        scene.add(obj)
+        for level in levels + sources:
+            scene.add(level)
+
+
+def save_binary(scene, mesh, writer, scene_save_path, compact=False):
+    """Converts mesh to binary format and writes its file (unless 
+    identical one was written already). Packing and hashing run on 
+    writer's workers, the rest in order of calls (see BinaryWriter.submit()).
+    """
+    import os
+    import time
+    registry = scene.geometry_registry
+    report   = scene.report
+    asset    = report.asset
+
+    def prepare():
+        start = time.time()
+        binaryInfo, buffers = binary_buffers(scene, mesh, compact)
+        return binaryInfo, buffers, registry.digest(buffers), time.time() - start
+
+    def finish(binaryInfo, buffers, digest, seconds):
+        nbytes = sum(b.nbytes for b in buffers)
+        with report.for_asset(asset):
+            report.add('convert_to_binary', seconds=seconds, calls=1, bytes=nbytes)
+            apply_binary(mesh, binaryInfo)
+            # Reuse binary file of identical geometry:
+            shared = registry.find(digest, nbytes)
+            if shared is not None:
+                mesh['_binaryInfo']      = dict(shared['_binaryInfo'])
+                mesh['delayLoadingFile'] = shared['delayLoadingFile']
+            else:
+                registry.register(digest, mesh)
+                filename = mesh['delayLoadingFile']
+                with report.stage('write', bytes=nbytes, files=1):
+                    writer.write(os.path.join(scene_save_path, filename), buffers)
+
+    writer.submit(prepare, (), finish)
+    return mesh
+
+
+def animation_range():
+    """Frames range and frequency animation is sampled with.
+    """
+    import hou
+    start, end = (hou.expandString("$RFSTART"), hou.expandString('$RFEND'))
+    return int(start), int(end), int(hou.fps())
 
-            # Binary format: 
-            if binary:
-                mesh, bin = convert_to_binary(scene, mesh)
-                filename  = mesh['id'] + ".babylonbinarymeshdata"
-                with open(os.path.join(scene_save_path, filename), 'wb') as file: 
-                    file.write(bin)
 
+def animated_nodes(nodes):
+    """Nodes which animation is exported.
+    """
+    return [node for node in nodes if node.type().name() == 'geo' and node.isTimeDependent()]
 
-            # Obj level materials for now:
-            material_path = node.parm('shop_materialpath').eval()
-            if material_path != "":
-                material = parse_material(scene, scene.new('material'), hou.node(material_path))
-                obj['materialId'] = material['id']
-                scene.add(material)
 
-            # Animation export. Babylon deals with vector or float animation,
-            # so we have to treat all tuple channeles at once even if only one axe
-            # is animated.
+def deforming(node):
+    """True if geometry of node changes over time.
+    """
+    return node.type().name() == 'geo' and node.renderNode().isTimeDependent()
 
-            if node.isTimeDependent():
-                start, end = (hou.expandString("$RFSTART"), hou.expandString('$RFEND'))
-                xform      = parse_xform(scene, obj, node, int(start), int(end), int(hou.fps()))
-                obj['animations'] = xform
 
-            scene.add(obj)
+def geometry_fingerprint(sha, geometry):
+    """Updates sha with everything parse_sop() reads from geometry: topology 
+       and values of exported attributes.
+    """
+    sha.update(repr([geometry.intrinsicValue(name) for name in \
+                     ('pointcount', 'vertexcount', 'primitivecount')]))
+    topology = vertex_topology(geometry)
+    if topology is None:
+        topology = (bulk_topology(geometry), bulk_prim_counts(geometry))
+    for array in topology:
+        sha.update(array.tostring())
+    for name in ('P', 'N', 'uv', 'uv2', 'Cd'):
+        if geometry.findPointAttrib(name):
+            sha.update(repr(('point', name)))
+            sha.update(bulk_point_attrib(geometry, name).tostring())
+        if geometry.findVertexAttrib(name):
+            sha.update(repr(('vertex', name)))
+            sha.update(bulk_vertex_attrib(geometry, name).tostring())
+
+
+def node_fingerprint(node, options=(), matrices=None):
+    """Hash of everything export of node depends on: its parameters, transformation,
+       geometry and material (plus export options). Used as a key of ExportCache.
+       matrices are sampled transforms of animated node, if we have them already.
+    """
+    import hashlib, hou, os
+    sha = hashlib.sha1()
+    sha.update(repr((node.path(), node.type().name(), options)))
+    sha.update(repr(node.worldTransform().asTuple()))
+    for parm in node.parms():
+        sha.update(repr((parm.name(), parm.eval())))
+
+    if node.type().name() == 'geo':
+        sop      = node.renderNode()
+        geometry = sop.geometry()
+        bbox     = geometry.boundingBox()
+        sha.update(repr((sop.path(), bbox.minvec(), bbox.maxvec())))
+        # Instances turn without moving their points:
+        if is_packed(geometry):
+            transforms, ids, sources = bulk_packed(geometry)
+            sha.update(transforms.tostring())
+            sha.update(ids.tostring())
+            for source in sources.values():
+                geometry_fingerprint(sha, source)
+        else:
+            geometry_fingerprint(sha, geometry)
+
+        material_path = node.parm('shop_materialpath').eval()
+        if material_path != "":
+            for parm in hou.node(material_path).parms():
+                sha.update(repr((parm.name(), parm.eval())))
+                # Images count too:
+                if isinstance(parm.eval(), basestring) and os.path.isfile(parm.eval()):
+                    stat = os.stat(parm.eval())
+                    sha.update(repr((stat.st_size, stat.st_mtime)))
+
+        # Whole animation counts:
+        if node.isTimeDependent():
+            start, end, freq = animation_range()
+            sha.update(repr((start, end, freq)))
+            if matrices is None:
+                matrices = sample_world_transforms([node], start, end, freq)[node.path()]
+            sha.update(matrices.tostring())
+
+    return sha.hexdigest()
+
+
+def node_resources(node, lods=0, vertex_animation=False):
+    """Names of vertexData and binary files which export of node (re)creates.
+    """
+    resources = set()
+    if node.type().name() == 'geo':
+        meshes = [id_from_path(node.path())]
+        sop    = id_from_path(node.renderNode().path())
+        if is_packed(node.renderNode().geometry()):
+            sources = range(len(bulk_packed(node.renderNode().geometry())[2]))
+            resources.update(sop + u"_packed%d" % number for number in sources)
+            meshes += [meshes[0] + u"_packed%d" % number for number in sources]
+        else:
+            meshes += [meshes[0] + u"_lod%d" % level for level in range(1, lods + 1)]
+        resources.update(mesh + ".babylonbinarymeshdata" for mesh in meshes)
+        if vertex_animation and deforming(node):
+            resources.add(meshes[0] + ".babylonvertexanimation")
+        resources.update(meshes[1:])
+        resources.add(sop)
+    return resources
+
+
+def object_resources(bobject):
+    """Names of vertexData and files (binary ones, images) the object refers to.
+    """
+    resources = set(bobject.get(key) for key in ('geometryId', 'delayLoadingFile') if bobject.get(key))
+    if bobject.get('vertexAnimation'):
+        resources.add(bobject['vertexAnimation']['file'])
+    for key in ('diffuseTexture', 'bumpTexture'):
+        if bobject.get(key, {}).get('name'):
+            resources.add(bobject[key]['name'])
+    return resources
+
+
+def run(scene, selected, binary=False, scene_save_path="/var/www/html/", weld=False, 
+        weld_tolerance=None, cache=None, workers=0, max_pending_bytes=256*1024**2, 
+        key_tolerance=None, compact=False, lods=None, profile=False, 
+        filename="test.binary.babylon", vertex_animation=None, textures=None,
+        chunk_bytes=None, stream=None, vertex_cache=None, batch=None):
+    """Callback of Houdini's shelf. cache is an ExportCache (or True for default
+    one in scene_save_path), which lets unchanged nodes skip parsing. With workers
+    binary files are written on that many threads while next nodes are parsed,
+    holding at most max_pending_bytes of data waiting for write. key_tolerance
+    drops animation keys linear interpolation reproduces within it. compact
+    writes binary files with quantized attributes (see convert_to_binary()).
+    lods is a list of (ratio, distance) pairs for levels of detail of meshes.
+    Timings and sizes per stage and node are saved next to the scene as 
+    *.report.json (see habylon.ExportReport), with profile also cProfile's
+    hot spots. Scene itself is saved as filename in scene_save_path.
+    vertex_animation turns on point cache of deforming geometry with that
+    quantization step. Such nodes are never cached. textures is 
+    textures.TexturePipeline (or True for default one) copying images of
+    materials to scene_save_path. Identical materials are merged (see Scene.add()).
+    chunk_bytes turns on progressive output: binary files are regrouped into
+    gzipped chunks of that size, most visible meshes first, and the order
+    they should be fetched in is saved as *.manifest.json (see progressive.py).
+    stream extracts geometry that many points at a time straight into binary
+    files, so huge SOPs don't need memory for all their arrays (see stream_sop()).
+    vertex_cache reorders triangles and vertices of meshes for GPU cache of that
+    size (16 or 32 are usual), ACMR before and after is printed. batch merges
+    static meshes into batches of at most that many vertices (see batching.py).
+    """
+    import os
+    from habylon import BinaryWriter, ExportReport
+    binary = True
+    writer = BinaryWriter(workers, max_pending_bytes)
+    report = scene.report = ExportReport(profile)
+
+    # All animations are sampled at once:
+    samples  = {}
+    animated = animated_nodes(selected)
+    if animated:
+        with report.stage('sample_transforms', nodes=len(animated)):
+            samples = sample_world_transforms(animated, *animation_range())
+
+    if textures is True:
+        from textures import TexturePipeline
+        textures = TexturePipeline(scene_save_path, workers=workers)
+
+    entries = {}
+    if cache is True:
+        from cache import ExportCache
+        cache = ExportCache(os.path.join(scene_save_path, ".habylon_cache"))
+    if cache is not None:
+        # Materials name images differently with conversion on or off:
+        images       = textures and (textures.max_size, textures.format, textures.quality)
+        options      = (binary, weld, weld_tolerance, key_tolerance, compact, lods, 
+                        vertex_animation, vertex_cache, images)
+        with report.stage('fingerprint'):
+            fingerprints = dict((node.path(), node_fingerprint(node, options, samples.get(node.path()))) \
+                                for node in selected)
+        # Point cache would have to be sampled whole to tell it changed:
+        if vertex_animation:
+            fingerprints.update((node.path(), None) for node in selected if deforming(node))
+        for node in selected:
+            entries[node.path()] = cache.get(node.path(), fingerprints[node.path()])
+
+        # Cached nodes can't use geometry which other nodes will rewrite now
+        # nor binary files which are gone:
+        rewritten = set()
+        for node in selected:
+            if entries[node.path()] is None:
+                rewritten |= node_resources(node, len(lods or ()), vertex_animation)
+        for path, entry in entries.items():
+            if entry is None:
+                continue
+            for resource in entry['resources']:
+                # NOTE: Houdini's names can't have dots, so only files have extensions:
+                if resource in rewritten or (os.path.splitext(resource)[1] \
+                    and not os.path.exists(os.path.join(scene_save_path, resource))):
+                    entries[path] = None
+                    break
+
+    stored = []
+    for node in selected:
+        with report.for_asset(node.path()):
+            entry = entries.get(node.path())
+            if entry is not None:
+                with report.stage('cache_restore', objects=len(entry['objects'])):
+                    for item in entry['objects']:
+                        obj = scene.restore(item['type'], item['data'])
+                        if item.get('digest'):
+                            # After files of previous nodes (see BinaryWriter.submit()):
+                            register = scene.geometry_registry.register
+                            writer.submit(None, (), lambda digest=item['digest'], obj=obj: \
+                                          register(digest, obj))
+                        scene.add(obj)
+                continue
+
+            before = scene.snapshot()
+            export_node(scene, node, binary, scene_save_path, weld, weld_tolerance, writer, 
+                        key_tolerance, samples.get(node.path()), compact, lods, vertex_animation,
+                        textures, stream, vertex_cache)
+            if cache is not None and fingerprints[node.path()] is not None:
+                objects = scene.added_since(before)
+                # Shared material or geometry added by other node goes too, 
+                # so entry restores without that node:
+                for obj in list(objects):
+                    for reference in scene.references(obj):
+                        if not any(reference is item for item in objects):
+                            objects.insert(0, reference)
+                stored.append((node.path(), objects))
+
+    # Waiting for pending writes:
+    with report.stage('write'):
+        writer.close()
+    # Binary files of meshes are known once they are written:
+    for path, objects in stored:
+        with report.for_asset(path):
+            with report.stage('cache_store'):
+                resources = set()
+                for obj in objects:
+                    resources |= object_resources(obj)
+                cache.put(path, fingerprints[path], objects, resources, \
+                          [scene.geometry_registry.digest_of(obj) for obj in objects])
+
+    if textures is not None:
+        with report.stage('textures'):
+            textures.close()
+        report.add('textures', copied=textures.copied, skipped=textures.skipped)
+    if cache is not None:
+        cache.save()
+
+    # Static meshes merged by material (after caching, which keeps them apart):
+    if batch:
+        from batching import batch_meshes
+        with report.stage('batch'):
+            meshes  = len(scene['meshes'])
+            batches = batch_meshes(scene, scene_save_path, batch, compact, remove=cache is None)
+            merged  = meshes - len(scene['meshes']) + len(batches)
+            report.count(meshes=merged, batches=len(batches))
+        if batches:
+            print "Static batching: %d meshes merged into %d." % (merged, len(batches))
 
     # link shadows:
     # TODO: Respect shadow linking. 
-    for shadow in scene['shadowGenerators']:
-        for mesh in scene['meshes']:
-            if mesh['id'] not in shadow['renderList']:
-                shadow['renderList'].append(mesh['id'])
-
-    scene.dump(os.path.join(scene_save_path, "test.binary.babylon"))
+    scene.link_shadows()
+
+    if scene.geometry_registry.deduplicated:
+        print "Shared geometry: %d duplicates, %d bytes saved." % \
+            (scene.geometry_registry.deduplicated, scene.geometry_registry.deduplicated_bytes)
+
+    if scene.animation_keys[0]:
+        print "Animation keys: %d sampled, %d exported." % tuple(scene.animation_keys)
+
+    cache_stats = report.stages.get('vertex_cache')
+    if cache_stats and cache_stats['triangles']:
+        print "Vertex cache: ACMR %.3f -> %.3f." % \
+            (float(cache_stats['misses_before']) / cache_stats['triangles'],
+             float(cache_stats['misses_after']) / cache_stats['triangles'])
+
+    # Geometry goes to chunks, scene file keeps only bounding boxes of meshes:
+    if chunk_bytes:
+        from progressive import write_chunks
+        with report.stage('chunks'):
+            chunks = write_chunks(scene, scene_save_path, filename.replace(".babylon", ""), 
+                                  chunk_bytes, remove=cache is None)
+            report.count(bytes=sum(chunk['bytes'] for chunk in chunks), files=len(chunks))
+
+    filename = os.path.join(scene_save_path, filename)
+    with report.stage('dump'):
+        scene.dump(filename)
+        report.count(bytes=os.path.getsize(filename), files=1)
+        if chunk_bytes:
+            from progressive import write_manifest
+            scene.dump(filename, compress=True)
+            write_manifest(filename.replace(".babylon", ".manifest.json"), filename, chunks)
+    report.save(filename.replace(".babylon", ".report.json"))
     return scene
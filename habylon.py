@@ -1,6 +1,6 @@
 import json
-import os, sys
-import collections
+import os, sys, time, struct
+import collections, contextlib
 
 BABYLON_CONSTANTS = dict((("ANIM_TYPE_FLOAT", 0),
                           ("ANIM_TYPE_VECTOR", 1),
@@ -10,7 +10,665 @@ BABYLON_CONSTANTS = dict((("ANIM_TYPE_FLOAT", 0),
                           ("ANIM_LOOP_CYC", 1),
                           ("ANIM_LOOP_CONST", 2),
                           ("BINARY_DATA_INT", 0),
-                          ("BINARY_DATA_FLOAT",1)))
+                          ("BINARY_DATA_FLOAT",1),
+                          # Compact encoding (not in Babylon loader):
+                          ("BINARY_DATA_SHORT", 2),
+                          ("BINARY_DATA_USHORT", 3),
+                          ("BINARY_DATA_BYTE", 4),
+                          ("BINARY_DATA_UBYTE", 5)))
+
+# numpy types of BINARY_DATA_* constants:
+BINARY_DATA_TYPES = {0: '<i4', 1: '<f4', 2: '<i2', 3: '<u2', 4: '<i1', 5: '<u1'}
+# BINARY_DATA_* of quantized values by (bits, signed), see quantize():
+QUANTIZED_DATA_TYPES = {(8, True): 4, (16, True): 2, (8, False): 5, (16, False): 3}
+
+class GeometryBuffer(object):
+    """Compact, typed replacement of list for big geometry arrays (positions, indices etc).
+       Values are kept in flat numpy array of little endian float32 or int32, so
+       a vertex takes 12 bytes instead of three boxed Python floats.
+       BObject accepts it wherever schema expects a list.
+    """
+    DTYPES = {'f': '<f4', 'i': '<i4'}
+
+    def __init__(self, data, typecode='f'):
+        import numpy
+        self.typecode = typecode
+        self.data     = numpy.ascontiguousarray(data, dtype=self.DTYPES[typecode]).ravel()
+
+    @classmethod
+    def floats(cls, data):
+        return cls(data, 'f')
+
+    @classmethod
+    def ints(cls, data):
+        return cls(data, 'i')
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data.tolist())
+
+    def __getitem__(self, index):
+        return self.data[index].tolist()
+
+    def __array__(self, dtype=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __eq__(self, other):
+        if isinstance(other, GeometryBuffer):
+            other = other.data
+        return len(self.data) == len(other) and bool((self.data == other).all())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "GeometryBuffer(%s, %r)" % (self.data.tolist(), self.typecode)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def tolist(self):
+        return self.data.tolist()
+
+
+class GeometryRegistry(object):
+    """Keeps track of exported geometry by hash of its arrays, so
+       identical geometry can be shared instead of written again.
+    """
+    def __init__(self):
+        self.geometries         = {}
+        self.digests            = {}
+        self.deduplicated       = 0
+        self.deduplicated_bytes = 0
+
+    @staticmethod
+    def nbytes(array):
+        if hasattr(array, 'nbytes'):
+            return array.nbytes
+        return len(array) * 4
+
+    def digest(self, arrays):
+        """Hash of list of arrays (GeometryBuffers, numpy arrays or lists).
+        """
+        import hashlib
+        import numpy
+        sha = hashlib.sha1()
+        for array in arrays:
+            if isinstance(array, GeometryBuffer):
+                array = array.data
+            elif not isinstance(array, numpy.ndarray):
+                array = numpy.array(array, dtype=numpy.float32)
+            # Length and type separate arrays, so [] + [1] != [1] + []:
+            sha.update("%s:%d;" % (array.dtype.str, len(array)))
+            sha.update(numpy.ascontiguousarray(array))
+        return sha.hexdigest()
+
+    def find(self, digest, nbytes=0):
+        """Returns object registered with digest or None. Found objects
+           are counted as duplicates of nbytes size.
+        """
+        found = self.geometries.get(digest)
+        if found is not None:
+            self.deduplicated       += 1
+            self.deduplicated_bytes += nbytes
+        return found
+
+    def register(self, digest, obj):
+        self.geometries[digest] = obj
+        self.digests[id(obj)]   = digest
+
+    def digest_of(self, obj):
+        """Digest obj was registered with (or None).
+        """
+        return self.digests.get(id(obj))
+
+
+class ExportReport(object):
+    """Wall time, counts (prims, vertices, keys...) and bytes of export stages,
+       both in total and per asset (node's path). Stages nest, so time of outer
+       stage includes inner ones. With profile cProfile (and tracemalloc, if
+       we have it) watch the export as well.
+    """
+    def __init__(self, profile=False):
+        self.stages   = {}
+        self.assets   = {}
+        self.asset    = None
+        self.started  = time.time()
+        self.profiler = None
+        self._stack   = []
+        if profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            try:
+                import tracemalloc
+                tracemalloc.start()
+            except ImportError:
+                pass
+
+    def add(self, stage, **counts):
+        """Adds counts to stage's totals and to current asset's ones.
+        """
+        records = [self.stages.setdefault(stage, {})]
+        if self.asset is not None:
+            records.append(self.assets[self.asset]['stages'].setdefault(stage, {}))
+        for record in records:
+            for key, value in counts.items():
+                record[key] = record.get(key, 0) + value
+
+    def count(self, **counts):
+        """Adds counts to the innermost running stage.
+        """
+        self.add(self._stack[-1] if self._stack else 'other', **counts)
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        start = time.time()
+        self._stack.append(name)
+        try:
+            yield self
+        finally:
+            self._stack.pop()
+            self.add(name, seconds=time.time() - start, calls=1, **counts)
+
+    @contextlib.contextmanager
+    def for_asset(self, path):
+        """Stages (and counts) inside belong to asset with path (None for
+        scene totals only).
+        """
+        previous, self.asset = self.asset, path
+        if path is not None:
+            self.assets.setdefault(path, {'asset': path, 'seconds': 0.0, 'stages': {}})
+        start = time.time()
+        try:
+            yield self
+        finally:
+            if path is not None:
+                self.assets[path]['seconds'] += time.time() - start
+            self.asset = previous
+
+    def results(self, top=30):
+        """Report as dictionary, assets sorted from the slowest one.
+        """
+        report = {'seconds': time.time() - self.started, 'stages': self.stages,
+                  'assets': sorted(self.assets.values(), key=lambda a: -a['seconds'])}
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # NOTE: OSX reports bytes, Linux kilobytes:
+            report['peak_memory'] = peak if sys.platform == 'darwin' else peak * 1024
+        except ImportError:
+            pass
+
+        if self.profiler is not None:
+            import pstats
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).stats
+            calls = sorted(stats.items(), key=lambda item: -item[1][3])[:top]
+            report['profile'] = [{'function': "%s:%d(%s)" % function, 'calls': nc, 
+                                  'seconds': tt, 'cumulative': ct} \
+                                 for function, (cc, nc, tt, ct, callers) in calls]
+            try:
+                import tracemalloc
+                if tracemalloc.is_tracing():
+                    snapshot = tracemalloc.take_snapshot()
+                    report['allocations'] = [{'line': str(stat.traceback), 'bytes': stat.size, 
+                                              'count': stat.count} \
+                                             for stat in snapshot.statistics('lineno')[:top]]
+            except ImportError:
+                pass
+        return report
+
+    def save(self, filename, top=30):
+        with open(filename, 'w') as file:
+            json.dump(self.results(top), file, indent=2, sort_keys=True)
+
+
+def quantize(values, components, bits, signed=False, low=None, high=None):
+    """Packs float values into bits (8 or 16) wide integers. Signed values are
+       expected in -1..1 range (like normals), unsigned ones are scaled to
+       min..max of every component (or low..high, if values are a part of 
+       bigger array). Returns array, its BINARY_DATA_* type and extra
+       descriptor keys for _binaryInfo (see dequantize()).
+    """
+    import numpy
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, components)
+    if signed:
+        dataType = QUANTIZED_DATA_TYPES[bits, True]
+        limit    = 2 ** (bits - 1) - 1
+        packed   = numpy.round(numpy.clip(values, -1.0, 1.0) * limit)
+        return packed.astype(BINARY_DATA_TYPES[dataType]).ravel(), dataType, {'normalized': True}
+
+    dataType = QUANTIZED_DATA_TYPES[bits, False]
+    limit    = 2 ** bits - 1
+    if low is None:
+        low  = values.min(axis=0) if len(values) else numpy.zeros(components)
+        high = values.max(axis=0) if len(values) else numpy.zeros(components)
+    low, high = numpy.asarray(low, dtype=numpy.float64), numpy.asarray(high, dtype=numpy.float64)
+    scale    = numpy.where(high > low, high - low, 1.0)
+    packed   = numpy.round((values - low) / scale * limit)
+    extra    = {'normalized': True, 'min': low.tolist(), 'max': high.tolist()}
+    return packed.astype(BINARY_DATA_TYPES[dataType]).ravel(), dataType, extra
+
+
+def dequantize(packed, descriptor, components):
+    """Inverse of quantize(). Returns float32 array.
+    """
+    import numpy
+    limit = float(numpy.iinfo(packed.dtype).max)
+    if 'min' not in descriptor:
+        return numpy.clip(packed / limit, -1.0, 1.0).astype(numpy.float32)
+    low    = numpy.array(descriptor['min'])
+    high   = numpy.array(descriptor['max'])
+    values = low + packed.reshape(-1, components) / limit * (high - low)
+    return values.astype(numpy.float32).ravel()
+
+
+def decode_attribute(data, descriptor, name=None):
+    """Reads one attribute (subMeshes if name says so) from binary data as its
+       descriptor (of _binaryInfo) tells. Compact types are unpacked back to
+       float32 (or int32 for indices).
+    """
+    import numpy
+    dtype    = numpy.dtype(BINARY_DATA_TYPES[descriptor['dataType']])
+    count    = descriptor['count']
+    if name == 'subMeshes':
+        count *= descriptor['stride']
+    values   = numpy.frombuffer(data, dtype=dtype, count=count, offset=descriptor['offset'])
+    if descriptor.get('normalized'):
+        components = len(descriptor['min']) if 'min' in descriptor else 1
+        values     = dequantize(values, descriptor, components)
+    elif dtype.kind in 'iu':
+        values = values.astype('<i4')
+    return values
+
+
+def decode_binary(data, binaryInfo):
+    """Reads attributes from .babylonbinarymeshdata contents (string, mmap or other
+       buffer) as described by _binaryInfo. Compact types are unpacked back to
+       float32 (or int32 for indices). Returns dictionary of numpy arrays keyed with
+       attributes' names (positions, normals, ..., subMeshes).
+    """
+    attributes = {}
+    for key, descriptor in binaryInfo.items():
+        name = key[:-len("AttrDesc")]
+        attributes[name] = decode_attribute(data, descriptor, name)
+    return attributes
+
+
+class BinaryAttributes(object):
+    """Attributes of a mesh in (memory mapped) binary file, described by its 
+       _binaryInfo. attributes['positions'] is flat numpy view of the file in
+       type the attribute is stored in, nothing is read or copied until it is
+       used. Compact attributes stay packed there, decoded() unpacks them.
+       NOTE: Views are invalid after Scene.close().
+    """
+    def __init__(self, data, binaryInfo):
+        self.data       = data
+        self.binaryInfo = binaryInfo
+
+    def keys(self):
+        return [key[:-len("AttrDesc")] for key in self.binaryInfo]
+
+    def __contains__(self, name):
+        return name + "AttrDesc" in self.binaryInfo
+
+    def __getitem__(self, name):
+        import numpy
+        descriptor = self.binaryInfo[name + "AttrDesc"]
+        count      = descriptor['count']
+        if name == 'subMeshes':
+            count *= descriptor['stride']
+        return numpy.frombuffer(self.data, dtype=BINARY_DATA_TYPES[descriptor['dataType']],
+                                count=count, offset=descriptor['offset'])
+
+    def decoded(self, name):
+        """Attribute as float32 (int32 for indices and subMeshes), unpacked
+           if it is compact. Plain ones are still views of the file.
+        """
+        descriptor = self.binaryInfo[name + "AttrDesc"]
+        if descriptor['dataType'] in (BABYLON_CONSTANTS['BINARY_DATA_INT'], 
+                                      BABYLON_CONSTANTS['BINARY_DATA_FLOAT']):
+            return self[name]
+        return decode_attribute(self.data, descriptor, name)
+
+
+def json_default(obj):
+    """Fallback for json.dump(s) for objects it doesn't know about.
+    """
+    if isinstance(obj, GeometryBuffer):
+        return obj.tolist()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def write_binary(file, buffers):
+    """Writes buffers (numpy arrays or anything else with buffer interface)
+       one after another without joining them into a string.
+    """
+    import numpy
+    for buffer in buffers:
+        if len(buffer):
+            file.write(memoryview(numpy.frombuffer(buffer, dtype=numpy.uint8)))
+
+
+class BinaryWriter(object):
+    """Writes binary files with write_binary(). With workers files are written
+       on a thread pool while caller goes on (with parsing next node for example).
+       Buffers waiting for write can't take more than max_pending_bytes, write()
+       blocks until enough of them are done. submit() runs other work (packing,
+       hashing) on the same pool. Files are the same in both modes.
+    """
+    def __init__(self, workers=0, max_pending_bytes=256*1024**2):
+        import threading
+        self.workers           = workers
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes     = 0
+        self.results           = []
+        self.prepared          = []
+        self.condition         = threading.Condition()
+        self.pool              = None
+        if workers:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(workers)
+
+    @staticmethod
+    def _write(filename, buffers):
+        import io
+        with io.open(filename, 'wb') as file:
+            write_binary(file, buffers)
+
+    def _job(self, filename, buffers, nbytes):
+        try:
+            self._write(filename, buffers)
+        finally:
+            with self.condition:
+                self.pending_bytes -= nbytes
+                self.condition.notify_all()
+
+    def write(self, filename, buffers):
+        """Writes buffers (numpy arrays) to filename, now or later.
+        """
+        if self.pool is None:
+            return self._write(filename, buffers)
+
+        nbytes = sum(b.nbytes for b in buffers)
+        with self.condition:
+            # Single file bigger than the limit has to go anyway:
+            while self.pending_bytes and self.pending_bytes + nbytes > self.max_pending_bytes:
+                self.condition.wait()
+            self.pending_bytes += nbytes
+        self.results.append(self.pool.apply_async(self._job, (filename, buffers, nbytes)))
+
+    def submit(self, prepare, args, finish):
+        """Runs prepare(*args) on a worker and later finish(*its result) on
+           caller's thread. finish() calls come in order of submit(), whatever
+           order workers are done in, so they can register, name and write 
+           files the same way serial export does. Without prepare finish() 
+           just waits for its turn. Without workers both run right away.
+        """
+        if self.pool is None:
+            return finish(*(prepare(*args) if prepare else ()))
+        result = prepare and self.pool.apply_async(prepare, args)
+        self.prepared.append((result, finish))
+        # Keep workers busy, but don't hold all the scene's results:
+        while len(self.prepared) > 2 * self.workers:
+            self._finish()
+        self.flush(False)
+
+    def _finish(self):
+        result, finish = self.prepared.pop(0)
+        finish(*(result.get() if result else ()))
+
+    def flush(self, wait=True):
+        """Calls finish() of submitted jobs in order. Without wait stops at
+           first job which isn't done yet.
+        """
+        while self.prepared and (wait or not self.prepared[0][0] \
+                                 or self.prepared[0][0].ready()):
+            self._finish()
+
+    def close(self):
+        """Waits for all jobs and files. Errors of workers are raised here.
+        """
+        if self.pool is None:
+            return
+        self.flush()
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        for result in self.results:
+            result.get()
+        self.results = []
+
+
+class VertexAnimationWriter(object):
+    """Streams vertex animation (point cache) into file frame by frame, so only
+       the last frame is held in memory. Positions are quantized to step and 
+       normals to 1/32767, and frames are stored as differences to the previous
+       one in smallest integer type they fit. Every keyframes-th frame is stored
+       whole, so any frame is at most keyframes-1 differences away. Frames are
+       zlib compressed (unless compression is 0). Table of frames' offsets is
+       written at the end of the file and its offset into the header.
+       File layout (little endian):
+            header: magic 'HBVA', version, frames, vertices, flags (1 positions,
+                    2 normals, 4 zlib), step, keyframes, table's offset (u8)
+            frames: positions and normals data
+            table:  per frame offset (u8), size (u4), keyframe (u1) and
+                    dataType (see BINARY_DATA_TYPES) of positions and normals (u1 each)
+       This is our extension, see VertexAnimationReader.
+    """
+    HEADER = struct.Struct('<4sIIIIfIQ')
+    FRAME  = struct.Struct('<QIBBB')
+    MAGIC  = 'HBVA'
+    NORMAL_SCALE = 32767.0
+
+    def __init__(self, filename, vertices, normals=True, step=1e-4, keyframes=30, compression=6):
+        import numpy
+        self.file        = open(filename, 'wb')
+        self.vertices    = vertices
+        self.normals     = normals
+        # NOTE: Header keeps step as float32, so we use the same:
+        self.step        = float(numpy.float32(step))
+        self.keyframes   = keyframes
+        self.compression = compression
+        self.table       = []
+        self.previous    = None
+        self.nbytes      = 0
+        self.file.write(self.HEADER.pack(self.MAGIC, 1, 0, 0, 0, 0, 0, 0))
+
+    @staticmethod
+    def _narrow(values):
+        """values (int64) in smallest of int8, int16 and int32 with its BINARY_DATA_ type.
+        """
+        import numpy
+        limit = int(numpy.abs(values).max()) if values.size else 0
+        for dataType in (BABYLON_CONSTANTS['BINARY_DATA_BYTE'], 
+                         BABYLON_CONSTANTS['BINARY_DATA_SHORT'], 
+                         BABYLON_CONSTANTS['BINARY_DATA_INT']):
+            dtype = numpy.dtype(BINARY_DATA_TYPES[dataType])
+            if limit <= numpy.iinfo(dtype).max:
+                return values.astype(dtype), dataType
+        raise ValueError("Vertex animation doesn't fit 32 bits, use bigger step.")
+
+    def write(self, positions, normals=None):
+        """Adds frame. positions and normals are (vertices, 3) arrays.
+        """
+        import numpy, zlib
+        current = [numpy.round(numpy.asarray(positions, dtype=numpy.float64) / self.step)]
+        if self.normals:
+            current.append(numpy.round(numpy.asarray(normals, dtype=numpy.float64) \
+                                       * self.NORMAL_SCALE))
+        current  = [values.astype(numpy.int64).reshape(self.vertices, 3) for values in current]
+        keyframe = len(self.table) % self.keyframes == 0
+        if keyframe:
+            stored = current
+        else:
+            stored = [values - previous for values, previous in zip(current, self.previous)]
+        stored, types = zip(*[self._narrow(values) for values in stored])
+        data = b''.join(values.tostring() for values in stored)
+        if self.compression:
+            data = zlib.compress(data, self.compression)
+
+        types = list(types) + [0] * (2 - len(types))
+        self.table.append(self.FRAME.pack(self.file.tell(), len(data), keyframe, *types))
+        self.file.write(data)
+        self.previous = current
+        self.nbytes  += len(data)
+
+    def close(self):
+        offset = self.file.tell()
+        self.file.write(b''.join(self.table))
+        flags  = 1 | (2 if self.normals else 0) | (4 if self.compression else 0)
+        self.file.seek(0)
+        self.file.write(self.HEADER.pack(self.MAGIC, 1, len(self.table), self.vertices, 
+                                         flags, self.step, self.keyframes, offset))
+        self.file.close()
+        return self.nbytes + len(self.table) * self.FRAME.size + self.HEADER.size
+
+
+class VertexAnimationReader(object):
+    """Random access to frames of VertexAnimationWriter's file.
+    """
+    def __init__(self, filename):
+        header = VertexAnimationWriter.HEADER
+        self.file = open(filename, 'rb')
+        magic, version, self.frames, self.vertices, flags, self.step, self.keyframes, \
+            offset = header.unpack(self.file.read(header.size))
+        assert magic == VertexAnimationWriter.MAGIC, "Not a vertex animation: %s" % filename
+        self.normals    = bool(flags & 2)
+        self.compressed = bool(flags & 4)
+        frame = VertexAnimationWriter.FRAME
+        self.file.seek(offset)
+        table = self.file.read(frame.size * self.frames)
+        self.table = [frame.unpack_from(table, n * frame.size) for n in range(self.frames)]
+
+    def _stored(self, number):
+        import numpy, zlib
+        offset, size, keyframe, positions, normals = self.table[number]
+        self.file.seek(offset)
+        data = self.file.read(size)
+        if self.compressed:
+            data = zlib.decompress(data)
+        result, start = [], 0
+        for dataType in ([positions, normals] if self.normals else [positions]):
+            dtype = numpy.dtype(BINARY_DATA_TYPES[dataType])
+            count = self.vertices * 3
+            result.append(numpy.frombuffer(data, dtype, count, start).astype(numpy.int64))
+            start += dtype.itemsize * count
+        return result
+
+    def frame(self, number):
+        """Positions and normals (or None) of frame as (vertices, 3) float32 arrays.
+        """
+        import numpy
+        first  = number - number % self.keyframes
+        values = self._stored(first)
+        for n in range(first + 1, number + 1):
+            values = [a + b for a, b in zip(values, self._stored(n))]
+        positions = (values[0] * numpy.float64(self.step)).astype(numpy.float32).reshape(-1, 3)
+        normals   = None
+        if self.normals:
+            normals = (values[1] / VertexAnimationWriter.NORMAL_SCALE).astype(numpy.float32)
+            normals = normals.reshape(-1, 3)
+        return positions, normals
+
+    def close(self):
+        self.file.close()
+
+
+def iter_json(obj, indent=2, precision=None, chunk=4096, check_circular=False, _level=0, _markers=None):
+    """Encodes obj to JSON piece by piece, so whole document never lives in memory.
+       Dictionaries are indented as json.dump() would do, but arrays of numbers
+       (including GeometryBuffers) are written compactly, chunk values per line.
+       precision is number of significant digits of floats (None keeps all of them).
+       Keys and non-finite floats (NaN, Infinity) are written as json.dump() does.
+    """
+    from json import dumps
+    if isinstance(obj, float):
+        yield _format_float(obj, precision)
+        return
+    if not isinstance(obj, (dict, list, tuple, GeometryBuffer)):
+        yield dumps(obj, default=json_default)
+        return
+    if not obj:
+        yield "{}" if isinstance(obj, dict) else "[]"
+        return
+    if check_circular:
+        _markers = _markers if _markers is not None else set()
+        if id(obj) in _markers:
+            raise ValueError("Circular reference detected")
+        _markers.add(id(obj))
+
+    inner = "\n" + " " * (indent * (_level + 1))
+    outer = "\n" + " " * (indent * _level)
+    if isinstance(obj, GeometryBuffer) or _is_number_array(obj):
+        yield "["
+        for start in range(0, len(obj), chunk):
+            values = obj[start:start + chunk]
+            if isinstance(values, GeometryBuffer) or hasattr(values, 'tolist'):
+                values = values.tolist()
+            yield ("," if start else "") + inner
+            yield ",".join(_format_number(x, precision) for x in values)
+        yield outer + "]"
+    elif isinstance(obj, dict):
+        separator = "{"
+        for key, value in obj.items():
+            yield separator + inner + dumps(_format_key(key)) + ": "
+            for piece in iter_json(value, indent, precision, chunk, check_circular, _level + 1, _markers):
+                yield piece
+            separator = ","
+        yield outer + "}"
+    else:
+        separator = "["
+        for value in obj:
+            yield separator + inner
+            for piece in iter_json(value, indent, precision, chunk, check_circular, _level + 1, _markers):
+                yield piece
+            separator = ","
+        yield outer + "]"
+
+    if check_circular:
+        _markers.discard(id(obj))
+
+
+def _is_number_array(obj):
+    return isinstance(obj, (list, tuple)) and \
+        all(type(x) in (int, long, float) for x in obj)
+
+
+def _format_key(key):
+    """Keys become strings the way json.dump() makes them.
+    """
+    if isinstance(key, basestring):
+        return key
+    if key is True or key is False or key is None:
+        return {True: "true", False: "false", None: "null"}[key]
+    if isinstance(key, float):
+        return _format_float(key, None)
+    if isinstance(key, (int, long)):
+        return str(key)
+    raise TypeError("key %r is not a string" % (key,))
+
+
+def _format_float(value, precision):
+    # NOTE: Like json.dump(), which isn't JSON either:
+    if value != value:
+        return "NaN"
+    if value in (float('inf'), float('-inf')):
+        return "Infinity" if value > 0 else "-Infinity"
+    if precision is None:
+        return repr(value)
+    return "%.*g" % (precision, value)
+
+
+def _format_number(value, precision):
+    if isinstance(value, float):
+        return _format_float(value, precision)
+    return str(value)
+
 
 # TODO: Inherit from collections.OrderedDict, not dict.
 class BObject(dict):
@@ -22,15 +680,22 @@ class BObject(dict):
     #__setattr__ = dict.__setitem__
 
     def __init__(self, schema, obj):
-        super(BObject, self).__init__(schema[obj])
+        """Prefer Scene.new(), which uses precompiled BObjectFactory.
+        """
+        factory = BObjectFactory(obj, schema[obj])
+        super(BObject, self).__init__(factory.defaults())
         # type is Babylon object type (camera, light, mesh etc).
-        self.type = obj
+        self.type   = obj
+        self._types = factory.types
        
     def __setitem__(self, key, value):
         """Custom item setter. Main reason fo it is type checking.
         """
-        assert key in self, "Key %s not defined in schema" % key
-        if isinstance(value, type(self[key])):
+        assert key in self._types, "Key %s not defined in schema" % key
+        # Schema's lists can hold GeometryBuffer too:
+        expected = self._types[key]
+        if isinstance(value, expected) or \
+            (expected is list and isinstance(value, GeometryBuffer)):
             super(BObject, self).__setitem__(key, value)
         else:
             raise TypeError("Wrong type of %s: %s" % (key, value))
@@ -39,7 +704,7 @@ class BObject(dict):
         """ Uses json.dumps to pretty print diconary.
         """
         from json import dumps
-        return dumps(self, indent=1)
+        return dumps(self, indent=1, default=json_default)
 
     def rename_key(self, key, newkey):
         """ Rename key entry in dictonary.
@@ -50,24 +715,170 @@ class BObject(dict):
             return True
         return
 
-    def dump(self, filename, check_circular=False):
-        from json import dump
-        with open(filename, 'w') as file:
-            return dump(self, file, indent=2, check_circular=check_circular)
+    def dump(self, filename, check_circular=False, precision=None, compress=False):
+        """Streams object to a file with iter_json(). precision limits number
+           of significant digits of floats. With compress the file is gzipped
+           (and gets .gz extension), so http server can send it as is with 
+           Content-Encoding: gzip. Returns written filename.
+        """
+        import gzip
+        if compress:
+            if not filename.endswith(".gz"):
+                filename += ".gz"
+            file = gzip.open(filename, 'wb')
+        else:
+            file = open(filename, 'w')
+        with file:
+            for piece in iter_json(self, precision=precision, check_circular=check_circular):
+                file.write(piece)
+        return filename
 
     def to_binary_string(self, attribute_array, formatter='f'):
         """ Return binary string from the provided int or float array. 
         """
         from struct import pack
+        # Buffers are already packed:
+        if isinstance(attribute_array, GeometryBuffer):
+            return attribute_array.data.tostring()
         if isinstance(attribute_array[0], type(0)):
             formatter  = 'i'
         return pack(formatter*len(attribute_array), *attribute_array)
 
 
+class BObjectFactory(object):
+    """Creates BObjects of one type. Defaults and types of values are worked out
+       once, and only mutable defaults (lists, dictionaries) are copied per object,
+       deeply only if they hold other containers.
+    """
+    def __init__(self, type, definition):
+        self.type      = type
+        self.types     = dict((key, value.__class__) for key, value in definition.items())
+        self.immutable = dict((key, value) for key, value in definition.items() \
+                              if not isinstance(value, (list, dict)))
+        self.mutable   = []
+        for key, value in definition.items():
+            if not isinstance(value, (list, dict)):
+                continue
+            items = value.values() if isinstance(value, dict) else value
+            if any(isinstance(item, (list, dict)) for item in items):
+                from copy import deepcopy as copier
+            else:
+                copier = value.__class__
+            self.mutable.append((key, value, copier))
+
+    def defaults(self):
+        """New dictionary of default values.
+        """
+        values = dict(self.immutable)
+        for key, value, copier in self.mutable:
+            values[key] = copier(value)
+        return values
+
+    def __call__(self):
+        bobject = BObject.__new__(BObject)
+        dict.update(bobject, self.immutable)
+        for key, value, copier in self.mutable:
+            dict.__setitem__(bobject, key, copier(value))
+        bobject.type   = self.type
+        bobject._types = self.types
+        return bobject
+
+    def many(self, items):
+        """Trusted bulk construction: creates object per dictionary in items
+           without type checking its values. Meant for generated data like keyframes.
+        """
+        objects = []
+        for item in items:
+            bobject = self()
+            dict.update(bobject, item)
+            objects.append(bobject)
+        return objects
+
+
+class SchemaRegistry(object):
+    """Babylon objects' definitions from schema/*.json compiled to factories.
+       Use SchemaRegistry.get(), which loads each schema directory once per process.
+       With cache definitions are pickled next to the directory (schema.cache)
+       and reused until any json file changes.
+    """
+    registries = {}
+
+    def __init__(self, path, cache=False):
+        self.path      = path
+        self.schema    = self.load(path, cache)
+        self.factories = dict((name, BObjectFactory(name, definition)) \
+                              for name, definition in self.schema.items())
+
+    @classmethod
+    def get(cls, path, cache=False):
+        path = os.path.abspath(path)
+        if path not in cls.registries:
+            cls.registries[path] = cls(path, cache)
+        return cls.registries[path]
+
+    @staticmethod
+    def load_json(path):
+        """Load *.json files defining Babylon objects.
+        """
+        from glob import glob
+        schema = {}
+        for file in glob(os.path.join(path, "*.json")):
+            with open(file) as file_object:
+                name = os.path.splitext(os.path.split(file)[1])[0]
+                schema[name] = json.load(file_object)
+        return schema
+
+    def load(self, path, cache=False):
+        import cPickle as pickle
+        from glob import glob
+        if not cache:
+            return self.load_json(path)
+
+        stamps     = sorted((file, os.path.getmtime(file)) for file in glob(os.path.join(path, "*.json")))
+        cache_file = os.path.normpath(path) + ".cache"
+        try:
+            with open(cache_file, 'rb') as file:
+                cached_stamps, schema = pickle.load(file)
+            if cached_stamps == stamps:
+                return schema
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        schema = self.load_json(path)
+        try:
+            with open(cache_file, 'wb') as file:
+                pickle.dump((stamps, schema), file, pickle.HIGHEST_PROTOCOL)
+        except IOError:
+            pass
+        return schema
+
+    def new(self, type):
+        return self.factories[type]()
+
+    def many(self, type, items):
+        return self.factories[type].many(items)
+
+
 class Scene(BObject):
     """Ideally this should be the only specialized class derived from BObject. 
        Scene takes care of creation and adding object to the Babylon scene.
+       Objects are indexed by their ids in registries (see add() and get()).
     """
+    # Type, path of its list in the scene and key it is indexed by. Dependencies 
+    # go first, so objects from added_since() can be added back in that order:
+    COLLECTIONS = (('box',             ('geometries', 'boxes'),      None),
+                   ('sphere',          ('geometries', 'spheres'),    None),
+                   ('vertexData',      ('geometries', 'vertexData'), 'id'),
+                   ('material',        ('materials',),               'id'),
+                   ('multiMaterial',   ('multiMaterials',),          'id'),
+                   ('mesh',            ('meshes',),                  'id'),
+                   ('light',           ('lights',),                  'id'),
+                   ('shadowGenerator', ('shadowGenerators',),        'lightId'),
+                   ('camera',          ('cameras',),                 'id'))
+
+    # Objects of these types with identical definitions (but id and name) are merged:
+    SHARED = ('material',)
+
     def __init__(self, *args):
         """Initilize with scene (global in Babylon docs) schema.
         """
@@ -75,61 +886,245 @@ class Scene(BObject):
         path = os.getenv("HABYLON_PATH", "./")
 
         # Get the notion who we are...
-        self.schema = self.load_schemas(os.path.join(path, "schema"))
+        self.schemas = SchemaRegistry.get(os.path.join(path, "schema"), \
+                                          bool(os.getenv("HABYLON_SCHEMA_CACHE")))
+        self.schema  = self.schemas.schema
         super(Scene, self).__init__(self.schema, "scene")
 
          # Copy here Babylon constants, so we keep them close later on:
         for const in BABYLON_CONSTANTS:
             setattr(self, const, BABYLON_CONSTANTS[const])
 
+        # Geometry already exported (see GeometryRegistry):
+        self.geometry_registry = GeometryRegistry()
+
+        # Animation keys sampled and exported (after reduction):
+        self.animation_keys = [0, 0]
+
+        # Timings and sizes of export (see ExportReport):
+        self.report = ExportReport()
+
+        # Memory maps of binary files of loaded scene (see load() and attributes()):
+        self.directory    = os.curdir
+        self.binary_files = {}
+
+        # Objects by type and id, ids of merged objects and shared definitions:
+        self.registries  = dict((type, collections.OrderedDict()) for type, _, _ in self.COLLECTIONS)
+        self.aliases     = {}
+        self.definitions = {}
+
         # Matrix fliping X axis for Babylon coorindate system.
         self.HOUDINI_TO_BABYLON_SPACE = (-1,0,0,0,0,1,0,0,0,0,1,0,0,0,0,1)
 
-    def load_schemas(self, path, schema={}):
+    def load_schemas(self, path, schema=None):
         """Load *.json files defining Babylon objects.
         """
-        from glob import glob
-        location = os.path.join(path, "*.json")
-        files    = glob(location)
- 
-        for file in files:
-            with open(file) as file_object:
-                obj  = json.load(file_object)
-                name = os.path.split(file)[1]
-                name = os.path.splitext(name)[0]
-                schema[name] = obj
+        schema = {} if schema is None else schema
+        schema.update(SchemaRegistry.load_json(path))
         return schema
 
+    def _collection(self, type):
+        for name, path, key in self.COLLECTIONS:
+            if name == type:
+                items = self
+                for part in path:
+                    items = items[part]
+                return items, key
+        return None, None
+
+    def _definition(self, child):
+        """Digest of object without its id and name.
+        """
+        import hashlib
+        definition = dict((key, value) for key, value in child.items() if key not in ('id', 'name'))
+        return hashlib.sha1(json.dumps(definition, sort_keys=True, default=json_default)).hexdigest()
+
     def add(self, child):
-        """Babylon file has pretty much hardcoded structure...
-        """
-        if self.type == "scene":
-            if child.type == 'box':
-                self['geometries']['boxes'].append(child)
-            elif child.type == 'sphere':
-                self['geometries']['spheres'].append(child)
-            elif child.type == 'vertexData':
-                self['geometries']['vertexData'].append(child)
-            elif child.type == "mesh":
-                self['meshes'].append(child)
-            elif child.type == 'light':
-                self['lights'].append(child)
-            elif child.type == 'shadowGenerator':
-                self['shadowGenerators'].append(child)
-            elif child.type == "material":
-                self['materials'].append(child)
-            elif child.type == 'camera':
-                self['cameras'].append(child)
-                # NOTE: Last added became active one:
-                self['activeCamera'] = child['name']
-            return True
-        return
+        """Babylon file has pretty much hardcoded structure... Returns the object
+        which is in the scene now: child or one added before with the same id
+        (or identical definition for SHARED types). References of meshes to merged
+        objects are redirected to the ones kept.
+        """
+        if self.type != "scene":
+            return
+        items, field = self._collection(child.type)
+        if items is None:
+            return
+        registry = self.registries[child.type]
+        key      = child.get(field) if field else None
+        if key and key in registry:
+            return registry[key]
+
+        if child.type in self.SHARED and key:
+            digest = self._definition(child)
+            if digest in self.definitions:
+                shared = self.definitions[digest]
+                self.aliases[child.type, key] = shared[field]
+                return shared
+            self.definitions[digest] = child
+
+        if child.type == 'mesh':
+            for reference, type in (('materialId', 'material'), ('geometryId', 'vertexData')):
+                if (type, child.get(reference)) in self.aliases:
+                    child[reference] = self.aliases[type, child[reference]]
+
+        items.append(child)
+        if key:
+            registry[key] = child
+        if child.type == 'camera':
+            # NOTE: Last added became active one:
+            self['activeCamera'] = child['name']
+        return child
+
+    def remove(self, *children):
+        """Takes objects out of the scene and its registries.
+        """
+        for type in set(child.type for child in children):
+            items, field = self._collection(type)
+            removed  = set(id(child) for child in children if child.type == type)
+            registry = self.registries[type]
+            items[:] = [item for item in items if id(item) not in removed]
+            for child in children:
+                key = child.get(field) if field and child.type == type else None
+                if key and registry.get(key) is child:
+                    del registry[key]
+
+    def get(self, type, id, default=None):
+        """Object of type with id (or its alias) in O(1).
+        """
+        id = self.aliases.get((type, id), id)
+        return self.registries.get(type, {}).get(id, default)
+
+    def has(self, type, id):
+        return self.get(type, id) is not None
+
+    def ids(self, type):
+        """Ids of objects of type in order they were added.
+        """
+        return list(self.registries[type])
+
+    def references(self, bobject):
+        """Objects (material, vertexData) the mesh refers to.
+        """
+        if bobject.type != 'mesh':
+            return []
+        references = [self.get('material', bobject.get('materialId')), 
+                      self.get('vertexData', bobject.get('geometryId'))]
+        return [item for item in references if item is not None]
+
+    def link_shadows(self, meshes=None):
+        """Adds ids of meshes (all of them by default) to render lists of all 
+        shadow generators, skipping ones which are there already.
+        """
+        meshes = self.ids('mesh') if meshes is None else meshes
+        for shadow in self['shadowGenerators']:
+            present = set(shadow['renderList'])
+            shadow['renderList'].extend(id for id in meshes if id not in present)
+
+    def collections(self):
+        """Lists holding scene's objects, in the order of COLLECTIONS.
+        """
+        return [self._collection(type)[0] for type, _, _ in self.COLLECTIONS]
+
+    def snapshot(self):
+        """Sizes of collections. See added_since().
+        """
+        return [len(items) for items in self.collections()]
+
+    def added_since(self, snapshot):
+        """Objects added to the scene after snapshot() was taken.
+        """
+        return [obj for items, size in zip(self.collections(), snapshot) for obj in items[size:]]
+
+    def restore(self, type, data):
+        """Recreates object of type from dictionary (trusted, i.e. 
+           previously exported one) without type checking.
+        """
+        bobject = self.new(type)
+        dict.clear(bobject)
+        dict.update(bobject, data)
+        return bobject
+
+    @classmethod
+    def load(cls, filename, directory=None):
+        """Counterpart of dump(): reads .babylon file (gzipped if it ends with .gz)
+        into new Scene. Objects of COLLECTIONS become BObjects (without type
+        checking, see restore()) indexed as add() does it, but nothing is merged.
+        Binary files of meshes are looked for in directory (file's one by
+        default) and memory mapped when they are asked for (see attributes()).
+        """
+        import gzip
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, 'rb') as file:
+            data = json.load(file)
+
+        scene = cls()
+        scene.directory = directory or os.path.dirname(os.path.abspath(filename))
+        paths = [path for _, path, _ in cls.COLLECTIONS]
+        for key, value in data.items():
+            if (key,) in paths:
+                continue
+            if isinstance(value, dict) and isinstance(dict.get(scene, key), dict):
+                # Nested lists (geometries) are filled below:
+                scene[key].update((name, item) for name, item in value.items() \
+                                  if (key, name) not in paths)
+            else:
+                dict.__setitem__(scene, key, value)
+
+        for type, path, field in cls.COLLECTIONS:
+            items = data
+            for part in path:
+                items = items.get(part) or {}
+            collection, _ = scene._collection(type)
+            registry      = scene.registries[type]
+            for item in items or []:
+                bobject = scene.restore(type, item)
+                collection.append(bobject)
+                if field and bobject.get(field):
+                    registry[bobject[field]] = bobject
+        return scene
+
+    def attributes(self, mesh):
+        """Binary attributes of mesh (see BinaryAttributes) or None if it has 
+        no binary file. The file is memory mapped on first use and shared with 
+        other meshes using it (like chunks of progressive.py). Precompressed 
+        file (.gz) without plain one is read into memory instead.
+        """
+        import mmap
+        filename = mesh.get('delayLoadingFile')
+        if not filename or not mesh.get('_binaryInfo'):
+            return None
+        if filename not in self.binary_files:
+            path = os.path.join(self.directory, filename)
+            if not os.path.exists(path) and os.path.exists(path + ".gz"):
+                import gzip
+                with gzip.open(path + ".gz", 'rb') as file:
+                    self.binary_files[filename] = file.read()
+            else:
+                with open(path, 'rb') as file:
+                    self.binary_files[filename] = mmap.mmap(file.fileno(), 0, 
+                                                            access=mmap.ACCESS_READ)
+        return BinaryAttributes(self.binary_files[filename], mesh['_binaryInfo'])
+
+    def close(self):
+        """Unmaps binary files (see attributes()).
+        """
+        for data in self.binary_files.values():
+            if hasattr(data, 'close'):
+                data.close()
+        self.binary_files = {}
 
     def new(self, type):
         """Creats a new class of specified type from schema definition.
         """
         if type in self.schema:
-            return BObject(self.schema, type)
+            return self.schemas.new(type)
+
+    def new_many(self, type, items):
+        """Creates objects of type from list of dictionaries without
+           type checking (see BObjectFactory.many()).
+        """
+        return self.schemas.many(type, items)
 
 
 def float_equal(float1, float2, epsilon=2.0e-9):
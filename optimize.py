@@ -0,0 +1,269 @@
+"""Optimizations of exported data. Everything here works on plain numpy arrays
+   (or GeometryBuffers), so none of it needs Houdini.
+"""
+
+
+def weld_vertices(attributes, indices, tolerance=None):
+    """Merges vertices with identical attributes. attributes is a list of per vertex
+       arrays (positions first, then normals, uvs...) for the same number of vertices,
+       flat or (nvertices, size) shaped. With tolerance values are quantized
+       to it before comparison. Returns new list of (nvertices, size) arrays
+       and remapped indices. Vertices keep order of their first use.
+    """
+    import numpy
+    positions = numpy.asarray(attributes[0])
+    count     = len(positions) if positions.ndim == 2 else len(positions) / 3
+    columns   = [numpy.asarray(a, dtype=numpy.float32).reshape(count, -1) for a in attributes]
+    table     = numpy.hstack(columns)
+    if tolerance:
+        keys = numpy.round(table / tolerance).astype(numpy.int64)
+    else:
+        # NOTE: Adding zero turns -0.0 into 0.0, so they are equal byte-wise:
+        keys = table + numpy.float32(0)
+    keys = numpy.ascontiguousarray(keys)
+    rows = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, first, inverse = numpy.unique(rows, return_index=True, return_inverse=True)
+
+    order        = numpy.argsort(first, kind='mergesort')
+    remap        = numpy.empty(len(order), dtype=numpy.int32)
+    remap[order] = numpy.arange(len(order), dtype=numpy.int32)
+    unique       = first[order]
+    indices      = remap[inverse][numpy.asarray(indices)]
+    return [column[unique] for column in columns], indices
+
+
+def constant_samples(samples, epsilon=2.0e-9):
+    """True if every row of samples (frames x components) equals the first one,
+       using the same relative comparison as habylon.float_equal(), but for all
+       frames at once.
+    """
+    import numpy
+    samples = numpy.asarray(samples, dtype=numpy.float64)
+    exact   = samples[:1]
+    approx  = samples[1:]
+    zero    = (exact == 0.0) | (approx == 0.0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        error = numpy.where(zero, numpy.abs(exact + approx), numpy.abs(approx / exact - 1.0))
+    return bool((error < epsilon).all())
+
+
+def reduce_keys(frames, values, tolerance):
+    """Returns indices of keys to keep, so linear interpolation between them
+       reproduces every dropped key within tolerance in every component.
+       values is (frames, components) array. First and last keys always stay.
+       It is Douglas-Peucker simplification with errors measured per component.
+    """
+    import numpy
+    frames = numpy.asarray(frames, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(len(frames), -1)
+    if len(frames) < 3:
+        return numpy.arange(len(frames))
+
+    keep     = numpy.zeros(len(frames), dtype=bool)
+    keep[0]  = keep[-1] = True
+    segments = [(0, len(frames) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        weights = (frames[first+1:last] - frames[first]) / (frames[last] - frames[first])
+        line    = values[first] + weights[:, None] * (values[last] - values[first])
+        error   = numpy.abs(values[first+1:last] - line).max(axis=1)
+        worst   = int(error.argmax())
+        if error[worst] > tolerance:
+            split       = first + 1 + worst
+            keep[split] = True
+            segments   += [(first, split), (split, last)]
+    return numpy.flatnonzero(keep)
+
+
+def decimate(positions, indices, ratio, normals=None, attributes=()):
+    """Simplifies triangle mesh to about ratio of its triangles. Vertices are
+       clustered on a regular grid (its resolution is searched for to hit the ratio)
+       and every cluster is replaced by single vertex placed where it minimizes
+       quadric error of original faces around it. Normals and other attributes
+       (uvs, colors...) are averaged per cluster. Returns positions, normals
+       (or None), list of attributes and indices, all as numpy arrays.
+    """
+    import numpy
+    positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+    triangles = numpy.asarray(indices, dtype=numpy.int64).reshape(-1, 3)
+    target    = max(1, int(len(triangles) * ratio))
+    low       = positions.min(axis=0) if len(positions) else numpy.zeros(3)
+    size      = (positions.max(axis=0) - low).max() if len(positions) else 0.0
+    size      = size or 1.0
+
+    def cluster(resolution):
+        cells    = numpy.minimum((positions - low) / size * resolution, resolution - 1)
+        cells    = cells.astype(numpy.int64)
+        keys     = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+        _, inverse = numpy.unique(keys, return_inverse=True)
+        faces    = inverse[triangles]
+        valid    = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & \
+                   (faces[:, 0] != faces[:, 2])
+        return inverse, faces, valid
+
+    # Smallest grid, which keeps at least target triangles:
+    lower, upper = 1, 2**20
+    while lower < upper:
+        middle = (lower + upper) // 2
+        if cluster(middle)[2].sum() >= target:
+            upper = middle
+        else:
+            lower = middle + 1
+    inverse, faces, valid = cluster(lower)
+    clusters = inverse.max() + 1 if len(inverse) else 0
+
+    # Quadrics of original faces' planes, weighted by area, summed per cluster:
+    a, b, c = (positions[triangles[:, n]] for n in range(3))
+    cross   = numpy.cross(b - a, c - a)
+    length  = numpy.sqrt((cross ** 2).sum(axis=1))
+    normal  = cross / numpy.where(length > 0, length, 1.0)[:, None]
+    area    = length / 2.0
+    offset  = -(normal * a).sum(axis=1)
+    outer   = normal[:, :, None] * normal[:, None, :] * area[:, None, None]
+    linear  = normal * (offset * area)[:, None]
+    A       = numpy.zeros((clusters, 3, 3))
+    B       = numpy.zeros((clusters, 3))
+    for corner in range(3):
+        owner = inverse[triangles[:, corner]]
+        for i in range(3):
+            B[:, i] += numpy.bincount(owner, linear[:, i], clusters)
+            for j in range(3):
+                A[:, i, j] += numpy.bincount(owner, outer[:, i, j], clusters)
+
+    def average(values):
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(len(positions), -1)
+        counts = numpy.bincount(inverse, minlength=clusters).astype(numpy.float64)
+        sums   = numpy.column_stack([numpy.bincount(inverse, values[:, n], clusters) \
+                                     for n in range(values.shape[1])])
+        return sums / numpy.maximum(counts, 1.0)[:, None]
+
+    # Pull solution slightly towards cluster's mean, so flat or
+    # degenerate clusters have well defined vertex:
+    mean     = average(positions)
+    weight   = 1e-3 * numpy.trace(A, axis1=1, axis2=2)[:, None] / 3.0 + 1e-12
+    system   = A + weight[:, :, None] * numpy.eye(3)[None]
+    vertices = numpy.linalg.solve(system, (weight * mean - B)[:, :, None])[:, :, 0]
+
+    # Drop collapsed and duplicated triangles, and unused clusters:
+    faces    = faces[valid]
+    _, first = numpy.unique(numpy.sort(faces, axis=1), axis=0, return_index=True)
+    faces    = faces[numpy.sort(first)]
+    used, first_use = numpy.unique(faces.ravel(), return_index=True)
+    order    = used[numpy.argsort(first_use)]
+    remap    = numpy.empty(clusters, dtype=numpy.int64)
+    remap[order] = numpy.arange(len(order))
+
+    if normals is not None:
+        normals = average(normals)[order]
+        normals /= numpy.maximum(numpy.sqrt((normals ** 2).sum(axis=1)), 1e-12)[:, None]
+    attributes = [average(values)[order] for values in attributes]
+    return vertices[order], normals, attributes, remap[faces].ravel()
+
+
+def vertex_cache_misses(indices, cache_size=16):
+    """Number of vertices GPU transforms drawing indices with FIFO post-transform
+       cache of cache_size vertices. Divided by number of triangles it is ACMR
+       (average cache miss ratio, 0.5 is about the best, 3.0 the worst).
+    """
+    import numpy
+    indices = numpy.asarray(indices).ravel()
+    if not len(indices):
+        return 0
+    # Vertex is in the cache if it missed less than cache_size misses ago:
+    stamps  = [-cache_size - 1] * (int(indices.max()) + 1)
+    misses  = 0
+    for vertex in indices.tolist():
+        if misses - stamps[vertex] > cache_size:
+            stamps[vertex] = misses
+            misses += 1
+    return misses
+
+
+def optimize_vertex_cache(indices, vertices=None, cache_size=16):
+    """Reorders triangles, so their vertices are found in post-transform cache
+       of cache_size as often as possible. It is Tipsify (Sander, Nehab and 
+       Barczak, Fast Triangle Reordering for Vertex Locality and Reduced 
+       Overdraw, 2007): triangles are emitted in fans around vertices, the next
+       fan is the vertex which stays in the cache. Linear in size of mesh.
+       Returns new indices (int32), vertices aren't touched.
+    """
+    import numpy
+    indices   = numpy.asarray(indices, dtype=numpy.int64).ravel()
+    triangles = len(indices) // 3
+    if vertices is None:
+        vertices = int(indices.max()) + 1 if len(indices) else 0
+    if not triangles:
+        return indices.astype(numpy.int32)
+
+    # Triangles around every vertex:
+    valence  = numpy.bincount(indices, minlength=vertices)
+    starts   = numpy.zeros(vertices + 1, dtype=numpy.int64)
+    starts[1:] = numpy.cumsum(valence)
+    adjacent = (numpy.argsort(indices, kind='mergesort') // 3).tolist()
+    starts   = starts.tolist()
+    live     = valence.tolist()
+    corners  = indices.tolist()
+
+    stamps   = [0] * vertices
+    emitted  = [False] * triangles
+    order    = []
+    dead     = []
+    time     = cache_size + 1
+    cursor   = 0
+    fan      = corners[0]
+    while fan >= 0:
+        candidates = []
+        for triangle in adjacent[starts[fan]:starts[fan + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            order.append(triangle)
+            for vertex in corners[3 * triangle:3 * triangle + 3]:
+                dead.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - stamps[vertex] > cache_size:
+                    stamps[vertex] = time
+                    time += 1
+
+        # Vertex still in the cache after its remaining triangles go, and the oldest one:
+        best, fan = -1, -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                priority = 0
+                if time - stamps[vertex] + 2 * live[vertex] <= cache_size:
+                    priority = time - stamps[vertex]
+                if priority > best:
+                    best, fan = priority, vertex
+        # Dead end, recently used vertices first, then any vertex with triangles left:
+        while fan < 0 and dead:
+            vertex = dead.pop()
+            if live[vertex] > 0:
+                fan = vertex
+        if fan < 0:
+            while cursor < vertices and live[cursor] == 0:
+                cursor += 1
+            fan = cursor if cursor < vertices else -1
+
+    triangles = indices.reshape(-1, 3)[numpy.array(order, dtype=numpy.int64)]
+    return triangles.ravel().astype(numpy.int32)
+
+
+def optimize_vertex_fetch(attributes, indices):
+    """Renumbers vertices in order of their first use by indices, so GPU reads
+       vertex buffers mostly forward. attributes is a list of per vertex arrays
+       (like weld_vertices() takes). Unused vertices are dropped. Returns new list
+       of (nvertices, size) arrays, indices and old number of every new vertex.
+    """
+    import numpy
+    indices   = numpy.asarray(indices).ravel()
+    positions = numpy.asarray(attributes[0])
+    count     = len(positions) if positions.ndim == 2 else len(positions) / 3
+    columns   = [numpy.asarray(a).reshape(count, -1) for a in attributes]
+    used, first  = numpy.unique(indices, return_index=True)
+    order        = used[numpy.argsort(first, kind='mergesort')]
+    remap        = numpy.empty(count, dtype=numpy.int32)
+    remap[order] = numpy.arange(len(order), dtype=numpy.int32)
+    return [column[order] for column in columns], remap[indices], order
@@ -0,0 +1,128 @@
+"""Progressive scene output for streaming load. Binary files of meshes are
+   regrouped into few size bounded chunks, meshes biggest on the screen first,
+   and every chunk is gzipped ahead, so http server can send it as is. Scene
+   file then holds only cameras, lights, materials and meshes' bounding boxes,
+   and Babylon shows them before any geometry arrives (meshes with
+   delayLoadingFile are loaded when they get into view).
+"""
+import json
+import os
+
+
+def importance(mesh, camera=None):
+    """Rough size of mesh on the screen: radius of its bounding box, or with
+       camera, the radius divided by distance from the camera. Rotation is
+       ignored, we only need order of meshes.
+    """
+    import numpy
+    low, high = (numpy.asarray(mesh.get(key) or [0, 0, 0], dtype=numpy.float64) \
+                 for key in ('boundingBoxMinimum', 'boundingBoxMaximum'))
+    scaling   = numpy.asarray(mesh.get('scaling') or [1, 1, 1], dtype=numpy.float64)
+    radius    = numpy.sqrt((((high - low) * scaling) ** 2).sum()) / 2.0
+    if camera is None:
+        return float(radius)
+    center    = numpy.asarray(mesh.get('position') or [0, 0, 0]) + (high + low) / 2.0 * scaling
+    distance  = numpy.sqrt(((center - numpy.asarray(camera['position'])) ** 2).sum())
+    # Camera inside of the box sees it whole:
+    return float(radius / max(distance, radius, 1e-9))
+
+
+def active_camera(scene):
+    """Camera the scene starts with (or None).
+    """
+    for camera in scene['cameras']:
+        if camera['name'] == scene['activeCamera']:
+            return camera
+
+
+def _write_chunk(filename, sources, compression):
+    """Concatenates sources (4 bytes aligned) into filename and its gzipped
+       copy. Returns offsets of sources and sizes of both files.
+    """
+    import gzip
+    offsets = []
+    offset  = 0
+    with open(filename, 'wb') as file:
+        # NOTE: mtime=0 keeps gzipped files identical between exports:
+        with gzip.GzipFile(filename + ".gz", 'wb', compression, mtime=0) as packed:
+            for source in sources:
+                offsets.append(offset)
+                with open(source, 'rb') as data:
+                    for piece in iter(lambda: data.read(1024**2), b''):
+                        file.write(piece)
+                        packed.write(piece)
+                        offset += len(piece)
+                if offset % 4:
+                    padding = b'\0' * (4 - offset % 4)
+                    file.write(padding)
+                    packed.write(padding)
+                    offset += len(padding)
+    return offsets, offset, os.path.getsize(filename + ".gz")
+
+
+def write_chunks(scene, directory, name, chunk_bytes=4*1024**2, remove=True, compression=6):
+    """Moves binary files of scene's meshes (see convert_to_binary()) into chunks
+       of about chunk_bytes named name.chunkN.babylonbinarymeshdata, plus .gz copy
+       of each. Files of more important meshes (see importance()) go to earlier
+       chunks, file bigger than chunk_bytes gets a chunk of its own. Meshes'
+       delayLoadingFile and _binaryInfo offsets are pointed to their chunk.
+       With remove original files are deleted. Returns list of chunks in order
+       they should be loaded (see write_manifest()).
+    """
+    camera = active_camera(scene)
+    meshes = [mesh for mesh in scene['meshes'] if mesh.get('delayLoadingFile')]
+    meshes.sort(key=lambda mesh: -importance(mesh, camera))
+
+    # Shared files go where their most important mesh does:
+    files  = []
+    users  = {}
+    for mesh in meshes:
+        filename = mesh['delayLoadingFile']
+        if filename not in users:
+            files.append(filename)
+            users[filename] = []
+        users[filename].append(mesh)
+
+    groups = [[]]
+    size   = 0
+    for filename in files:
+        nbytes = os.path.getsize(os.path.join(directory, filename))
+        if groups[-1] and size + nbytes > chunk_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(filename)
+        size += nbytes + (-nbytes % 4)
+
+    chunks = []
+    for number, group in enumerate(group for group in groups if group):
+        chunk   = u"%s.chunk%03d.babylonbinarymeshdata" % (name, number)
+        sources = [os.path.join(directory, filename) for filename in group]
+        offsets, nbytes, packed = _write_chunk(os.path.join(directory, chunk), sources, compression)
+        ids     = []
+        for filename, base in zip(group, offsets):
+            for mesh in users[filename]:
+                # NOTE: Descriptors of shared files are shared too, so they are copied:
+                mesh['_binaryInfo']      = dict((key, dict(value, offset=value['offset'] + base)) \
+                                                for key, value in mesh['_binaryInfo'].items())
+                mesh['delayLoadingFile'] = chunk
+                ids.append(mesh['id'])
+        chunks.append({'file': chunk, 'bytes': nbytes, 'gzipBytes': packed, 'meshes': ids})
+
+    if remove:
+        for filename in files:
+            os.remove(os.path.join(directory, filename))
+    return chunks
+
+
+def write_manifest(filename, scene_file, chunks):
+    """Saves json telling viewer what to fetch in which order: scene file
+       first, then chunks (see write_chunks()).
+    """
+    manifest = {'scene':  os.path.basename(scene_file),
+                'bytes':  os.path.getsize(scene_file),
+                'chunks': chunks}
+    if os.path.exists(scene_file + ".gz"):
+        manifest['gzipBytes'] = os.path.getsize(scene_file + ".gz")
+    with open(filename, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    return manifest
@@ -0,0 +1,101 @@
+"""Tests of static batching on fakehou scenes. No Houdini needed.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.environ.setdefault('HABYLON_PATH', here)
+
+import fakehou
+fakehou.install()
+import batching
+import fromHoudini
+import habylon
+
+
+def babylon_matrix(position, rotation, scaling):
+    """World matrix Babylon makes of mesh's transform: Matrix.ComposeToRef() with
+       Quaternion.RotationYawPitchRoll(rotation.y, rotation.x, rotation.z), 
+       written after Babylon's sources. rotation is in degrees, as we export it.
+    """
+    pitch, yaw, roll = numpy.radians(rotation) * 0.5
+    sr, cr = numpy.sin(roll), numpy.cos(roll)
+    sp, cp = numpy.sin(pitch), numpy.cos(pitch)
+    sy, cy = numpy.sin(yaw), numpy.cos(yaw)
+    x = cy * sp * cr + sy * cp * sr
+    y = sy * cp * cr - cy * sp * sr
+    z = cy * cp * sr - sy * sp * cr
+    w = cy * cp * cr + sy * sp * sr
+    xx, yy, zz = x * x * 2, y * y * 2, z * z * 2
+    xy, zx, yz = x * y * 2, z * x * 2, y * z * 2
+    wx, wy, wz = w * x * 2, w * y * 2, w * z * 2
+    sx, sy, sz = scaling
+    return numpy.array([[(1 - yy - zz) * sx, (xy + wz) * sx, (zx - wy) * sx, 0],
+                        [(xy - wz) * sy, (1 - zz - xx) * sy, (yz + wx) * sy, 0],
+                        [(zx + wy) * sz, (yz - wx) * sz, (1 - yy - xx) * sz, 0],
+                        list(position) + [1]])
+
+
+class TestTransforms(unittest.TestCase):
+    ROTATIONS = [(30, 45, 60), (-120, 10, 75), (89, -170, 5), (0, 90, 90), (90, 30, -40)]
+
+    def test_compose(self):
+        for rotation in self.ROTATIONS:
+            composed = fromHoudini.compose([(1, 2, 3)], [rotation], [(0.5, 2, -1.5)])[0]
+            self.assertLess(numpy.abs(composed - babylon_matrix((1, 2, 3), rotation, 
+                                                                (0.5, 2, -1.5))).max(), 1e-12)
+
+    def test_decompose(self):
+        # Babylon rebuilds exported transforms of Houdini's objects:
+        for rotation in self.ROTATIONS:
+            world  = fakehou.transform((1, -2, 3), rotation, (1, 2, 3))._matrix
+            matrix = fromHoudini.babylon_matrices([world], habylon.Scene().HOUDINI_TO_BABYLON_SPACE)
+            translates, rotates, scales = fromHoudini.decompose(matrix)
+            self.assertLess(numpy.abs(babylon_matrix(translates[0], rotates[0], scales[0]) - \
+                                      matrix[0]).max(), 1e-9)
+
+
+class TestBatching(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.directories = [tempfile.mkdtemp(prefix='habylon_test') for n in range(2)]
+        self.nodes = [fakehou.geo('grid%d' % n, fakehou.grid(4 + n, 3), translate=(n, 1, -n), 
+                                  rotate=rotation, scale=(1 + n, 1, 0.5)) \
+                      for n, rotation in enumerate(TestTransforms.ROTATIONS)]
+
+    def tearDown(self):
+        for directory in self.directories:
+            shutil.rmtree(directory, True)
+
+    def test_baked_positions(self):
+        plain   = fromHoudini.run(habylon.Scene(), self.nodes, True, self.directories[0])
+        batched = fromHoudini.run(habylon.Scene(), self.nodes, True, self.directories[1], batch=65535)
+        self.assertEqual(len(batched['meshes']), 1)
+        mesh    = batched['meshes'][0]
+        merged  = batching.mesh_arrays(batched, mesh, self.directories[1])['positions']
+
+        # Babylon would put vertices of separate meshes exactly there:
+        expected = []
+        for original in plain['meshes']:
+            positions = batching.mesh_arrays(plain, original, self.directories[0])['positions']
+            matrix    = babylon_matrix(original['position'], original['rotation'], original['scaling'])
+            expected.append(numpy.dot(positions, matrix[:3, :3]) + matrix[3, :3])
+        expected = numpy.concatenate(expected)
+        self.assertEqual(merged.shape, expected.shape)
+        # NOTE: Batch orders meshes in space, so vertices are compared sorted:
+        merged, expected = [values[numpy.lexsort(numpy.round(values, 4).T)] \
+                            for values in (merged, expected)]
+        self.assertLess(numpy.abs(merged - expected).max(), 1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Tests of fromGeo's reading of Houdini's geometry files. No Houdini needed.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.environ.setdefault('HABYLON_PATH', here)
+
+import fakehou
+fakehou.install()
+import fromGeo
+import habylon
+
+# Two quads on a strip, split into triangles, the right one bent up:
+FIXTURE   = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "strip.geo")
+POSITIONS = [[-1, 0, -0.5], [0, 0, -0.5], [1, 0.25, -0.5], [-1, 0, 0.5], [0, 0, 0.5], [1, 0.25, 0.5]]
+INDICES   = [0, 3, 1, 1, 3, 4, 1, 4, 2, 2, 4, 5]
+NORMALS   = [[0, 1, 0], [0, 1, 0], [-0.242536, 0.970143, 0]] * 2
+
+
+class TestReadGeometry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def assertGeometry(self, geometry):
+        positions = numpy.array(geometry.pointFloatAttribValues('P')).reshape(-1, 3)
+        normals   = numpy.array(geometry.pointFloatAttribValues('N')).reshape(-1, 3)
+        self.assertTrue(numpy.allclose(positions, POSITIONS))
+        self.assertTrue(numpy.allclose(normals, NORMALS))
+        self.assertEqual([prim.numVertices() for prim in geometry.prims()], [3] * 4)
+        self.assertEqual([v.point().number() for prim in geometry.prims() for v in prim.vertices()],
+                         INDICES)
+        uvs = numpy.array(geometry.vertexFloatAttribValues('uv')).reshape(-1, 3)
+        self.assertEqual(uvs[:3, :2].tolist(), [[0, 0], [0, 1], [0.5, 0]])
+
+    def test_ascii(self):
+        self.assertGeometry(fromGeo.read_geometry(FIXTURE))
+
+    def test_gzipped(self):
+        filename = os.path.join(self.directory, "strip.geo.gz")
+        with open(FIXTURE, 'rb') as source:
+            with gzip.open(filename, 'wb') as target:
+                target.write(source.read())
+        self.assertGeometry(fromGeo.read_geometry(filename))
+
+    def test_convert(self):
+        filename, scene_file, prims, seconds = fromGeo.convert((FIXTURE, self.directory, {}))
+        self.assertEqual((os.path.basename(scene_file), prims), ("strip.babylon", 4))
+        scene  = habylon.Scene.load(scene_file)
+        mesh   = scene['meshes'][0]
+        arrays = scene.attributes(mesh)
+        self.assertEqual(mesh['id'], "obj_strip")
+        self.assertTrue(numpy.allclose(numpy.asarray(arrays['positions']).reshape(-1, 3), POSITIONS))
+        self.assertTrue(numpy.allclose(numpy.asarray(arrays['normals']).reshape(-1, 3), NORMALS))
+        self.assertEqual(numpy.asarray(arrays['indices']).tolist(), INDICES)
+        scene.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
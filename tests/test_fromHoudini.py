@@ -0,0 +1,413 @@
+"""Tests of fromHoudini's geometry reads on fakehou scenes, so they run
+   without Houdini.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.environ.setdefault('HABYLON_PATH', here)
+
+import fakehou
+fakehou.install()
+import fromHoudini
+import habylon
+
+
+def loop_topology(geometry):
+    return [v.point().number() for prim in geometry.prims() for v in prim.vertices()]
+
+
+class TestTopology(unittest.TestCase):
+    def test_bulk(self):
+        geometry = fakehou.grid(7, 5)
+        self.assertEqual(fromHoudini.bulk_topology(geometry).tolist(), loop_topology(geometry))
+        self.assertEqual(fromHoudini.bulk_prim_counts(geometry).tolist(), 
+                         [prim.numVertices() for prim in geometry.prims()])
+
+    def test_fallback(self):
+        geometry = fakehou.grid(7, 5)
+        counts   = fromHoudini.bulk_prim_counts(geometry).tolist()
+        # Houdini without verbs:
+        category = fakehou.sopNodeTypeCategory
+        del fakehou.sopNodeTypeCategory
+        try:
+            self.assertIsNone(fromHoudini.vertex_topology(geometry))
+            self.assertEqual(fromHoudini.bulk_topology(geometry, chunk_size=4).tolist(),
+                             loop_topology(geometry))
+            self.assertEqual(fromHoudini.bulk_prim_counts(geometry).tolist(), counts)
+        finally:
+            fakehou.sopNodeTypeCategory = category
+
+    def test_mixed_prims(self):
+        # Quad and triangle:
+        geometry = fakehou.Geometry((4, 3), (0, 1, 2, 3, 3, 2, 4))
+        geometry.setPointAttrib('P', numpy.zeros((5, 3)))
+        self.assertEqual(fromHoudini.bulk_topology(geometry).tolist(), [0, 1, 2, 3, 3, 2, 4])
+        self.assertEqual(fromHoudini.bulk_prim_counts(geometry).tolist(), [4, 3])
+        self.assertEqual(fromHoudini.vertex_topology(geometry)[1].tolist(), [0, 0, 0, 0, 1, 1, 1])
+
+
+class TestParseSop(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def parse(self, geometry, **keywords):
+        scene = habylon.Scene()
+        mesh  = fromHoudini.parse_sop(scene, scene.new('mesh'), 
+                                      fakehou.geo('grid', geometry).renderNode(), True, **keywords)
+        return scene, mesh
+
+    def test_point(self):
+        geometry    = fakehou.grid(6, 4, colors=True)
+        scene, mesh = self.parse(geometry)
+        self.assertTrue(numpy.allclose(numpy.reshape(mesh['positions'].data, (-1, 3)), 
+                                       geometry._point_attribs['P']))
+        self.assertEqual(list(mesh['indices'].data), loop_topology(geometry))
+        self.assertEqual(len(mesh['colors'].data), 6 * 4 * 3)
+        self.assertEqual(mesh['subMeshes'][0]['indexCount'], 5 * 3 * 6)
+
+    def test_vertex(self):
+        geometry    = fakehou.grid(6, 4, normals='vertex')
+        scene, mesh = self.parse(geometry)
+        positions   = geometry._point_attribs['P'][loop_topology(geometry)]
+        self.assertTrue(numpy.allclose(numpy.reshape(mesh['positions'].data, (-1, 3)), positions))
+        self.assertEqual(len(mesh['uvs'].data), len(positions) * 2)
+
+        # Welded grid has a vertex per point:
+        scene, mesh = self.parse(geometry, weld=True)
+        self.assertEqual(len(mesh['positions'].data), 6 * 4 * 3)
+
+    def test_no_normals(self):
+        geometry = fakehou.grid(3, 3)
+        del geometry._point_attribs['N']
+        scene, mesh = self.parse(geometry)
+        self.assertFalse(mesh.get('positions'))
+
+    def test_shared_vertex_data(self):
+        scene  = habylon.Scene()
+        grids  = [fakehou.grid(4, 4), fakehou.grid(4, 4), fakehou.grid(4, 5)]
+        meshes = []
+        for number, geometry in enumerate(grids):
+            mesh = scene.new('mesh')
+            mesh['id'] = u"mesh%d" % number
+            sop  = fakehou.geo('grid%d' % number, geometry).renderNode()
+            meshes.append(fromHoudini.parse_sop(scene, mesh, sop))
+        self.assertEqual(meshes[0]['geometryId'], meshes[1]['geometryId'])
+        self.assertNotEqual(meshes[0]['geometryId'], meshes[2]['geometryId'])
+        self.assertEqual(len(scene['geometries']['vertexData']), 2)
+        self.assertEqual(scene.geometry_registry.deduplicated, 1)
+
+    def test_stream(self):
+        for normals in ('point', 'vertex'):
+            for compact in (False, True):
+                geometry    = fakehou.grid(9, 7, normals=normals, colors=True)
+                scene, mesh = self.parse(geometry)
+                mesh, buffers = fromHoudini.convert_to_binary(scene, mesh, compact)
+
+                scene  = habylon.Scene()
+                stream = scene.new('mesh')
+                stream['id'] = u"stream"
+                sop    = fakehou.geo('stream', geometry).renderNode()
+                fromHoudini.stream_sop(scene, stream, sop, self.directory, 16, compact)
+                with open(os.path.join(self.directory, stream['delayLoadingFile']), 'rb') as file:
+                    data = file.read()
+                self.assertEqual(data, b''.join(buffer.tostring() for buffer in buffers))
+                self.assertEqual(stream['_binaryInfo'], mesh['_binaryInfo'])
+                self.assertEqual(stream['boundingBoxMinimum'], list(geometry.boundingBox().minvec()))
+                self.assertEqual(stream['boundingBoxMaximum'], list(geometry.boundingBox().maxvec()))
+
+    def test_stream_without_normals(self):
+        geometry = fakehou.grid(3, 3)
+        del geometry._point_attribs['N']
+        scene    = habylon.Scene()
+        sop      = fakehou.geo('grid', geometry).renderNode()
+        self.assertIsNone(fromHoudini.stream_sop(scene, scene.new('mesh'), sop, self.directory))
+
+
+class TestPacked(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.geometry = fakehou.copy_to_points([fakehou.grid(3, 3), fakehou.grid(4, 2)], 50)
+
+    def test_bulk(self):
+        matrices, ids, sources = fromHoudini.bulk_packed(self.geometry)
+        prims = self.geometry.prims()
+        self.assertEqual(matrices.shape, (50, 4, 4))
+        self.assertTrue(numpy.array_equal(matrices, 
+            [numpy.reshape(prim.fullTransform().asTuple(), (4, 4)) for prim in prims]))
+        self.assertEqual(ids.tolist(), [prim.intrinsicValue('geometryid') for prim in prims])
+        # Embedded geometry per id, in order of first use:
+        self.assertEqual(list(sources.keys()), sorted(set(ids.tolist()), key=ids.tolist().index))
+        for prim in prims:
+            self.assertIs(sources[prim.intrinsicValue('geometryid')], prim.getEmbeddedGeometry())
+
+    def test_instances(self):
+        scene  = habylon.Scene()
+        node   = fakehou.geo('copies', self.geometry)
+        obj    = fromHoudini.parse_obj(scene, scene.new('mesh'), node)
+        meshes = fromHoudini.parse_packed(scene, obj, node.renderNode(), True)
+        self.assertEqual(len(meshes), 2)
+        self.assertEqual(sum(len(mesh['instances']) + 1 for mesh in meshes), 50)
+        # Babylon's instances don't follow parent of their mesh:
+        for mesh in meshes:
+            self.assertEqual(mesh['parentId'], obj['id'])
+            self.assertTrue(all(instance['parentId'] == obj['id'] for instance in mesh['instances']))
+
+
+class TestTransforms(unittest.TestCase):
+    def matrices(self, rotations, scales, translates):
+        matrices = numpy.zeros((len(rotations), 4, 4))
+        matrices[:, :3, :3] = rotations * scales[:, :, None]
+        matrices[:, 3, :3]  = translates
+        matrices[:, 3, 3]   = 1.0
+        return matrices
+
+    def assertRoundTrip(self, matrices):
+        composed = fromHoudini.compose(*fromHoudini.decompose(matrices))
+        self.assertLess(numpy.abs(composed - matrices).max(), 1e-9)
+
+    def test_round_trip(self):
+        random    = numpy.random.RandomState(7)
+        rotations = numpy.array([numpy.linalg.qr(random.normal(size=(3, 3)))[0] for i in range(200)])
+        # Proper rotations, and mirrored ones too:
+        rotations[::2, 2] *= -1
+        determinant = numpy.linalg.det(rotations)
+        self.assertTrue((determinant < 0).any() and (determinant > 0).any())
+        scales    = random.uniform(0.1, 5.0, (200, 3))
+        self.assertRoundTrip(self.matrices(rotations, scales, random.normal(size=(200, 3))))
+        # Mirrored by negative scales:
+        scales[::3, 1] *= -1
+        self.assertRoundTrip(self.matrices(rotations, scales, random.normal(size=(200, 3))))
+
+    def test_angles(self):
+        random  = numpy.random.RandomState(3)
+        rotates = random.uniform(-89, 89, (100, 3))
+        scales  = random.uniform(0.5, 2.0, (100, 3))
+        translates, extracted, extracted_scales = \
+            fromHoudini.decompose(fromHoudini.compose(numpy.zeros((100, 3)), rotates, scales))
+        self.assertLess(numpy.abs(extracted - rotates).max(), 1e-9)
+        self.assertLess(numpy.abs(extracted_scales - scales).max(), 1e-9)
+
+    def test_gimbal(self):
+        rotates = [(x, y, z) for x in (-90, 0, 90, 30) for y in (-90, 90, 45) for z in (0, 60)]
+        rotates += [(90, 90, 90), (-90, -90, 180), (180, 90, -90)]
+        matrices = fromHoudini.compose(numpy.ones((len(rotates), 3)), rotates, 
+                                       numpy.tile([1.0, 2.0, 3.0], (len(rotates), 1)))
+        self.assertRoundTrip(matrices)
+        # Axes swapped, exactly locked:
+        rotations = numpy.array([[[0, 0, -1], [0, 1, 0], [1, 0, 0]],
+                                 [[0, 1, 0], [0, 0, 1], [1, 0, 0]],
+                                 [[1, 0, 0], [0, 0, 1], [0, -1, 0]]], dtype=numpy.float64)
+        self.assertRoundTrip(self.matrices(rotations, numpy.ones((3, 3)), numpy.zeros((3, 3))))
+
+
+class TestXform(unittest.TestCase):
+    def test_constant_channels(self):
+        fakehou.clear()
+        node     = fakehou.geo('moving', fakehou.grid(2, 2))
+        matrices = numpy.tile(numpy.diag([2.0, 2.0, 2.0, 1.0]), (24, 1, 1))
+        matrices[:, 3, 0] = numpy.arange(24) * 0.5
+        scene    = habylon.Scene()
+        xform    = fromHoudini.parse_xform(scene, None, node, 1, 24, 1, 1e-6, matrices)
+        # Rotation and scaling never change:
+        self.assertEqual([item['property'] for item in xform], ['position'])
+        # Linear motion needs just the ends:
+        keys = xform[0]['keys']
+        self.assertEqual([key['frame'] for key in keys], [0.0, 23.0])
+        space = scene.HOUDINI_TO_BABYLON_SPACE
+        self.assertAlmostEqual(keys[-1]['values'][0], 
+                               fromHoudini.babylon_matrices(matrices, space)[-1, 3, 0])
+
+
+class TestLods(unittest.TestCase):
+    LODS = [(0.5, 10), (0.1, 40)]
+
+    def setUp(self):
+        fakehou.clear()
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+        self.node      = fakehou.geo('grid', fakehou.grid(41, 41))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def assertLevels(self, scene, arrays):
+        mesh, levels = scene['meshes'][0], scene['meshes'][1:]
+        self.assertEqual(mesh['lodMeshIds'], [level['id'] for level in levels])
+        self.assertEqual(mesh['lodDistances'], [10.0, 40.0])
+        full = len(arrays(mesh)['indices'])
+        for level, (ratio, distance) in zip(levels, self.LODS):
+            level = arrays(level)
+            self.assertLess(abs(len(level['indices']) - full * ratio), 0.2 * full * ratio)
+            self.assertLess(level['indices'].max(), len(level['positions']) / 3)
+
+    def test_binary(self):
+        scene = fromHoudini.run(habylon.Scene(), [self.node], True, self.directory, lods=self.LODS)
+        files = [mesh['delayLoadingFile'] for mesh in scene['meshes']]
+        self.assertEqual(len(set(files)), 3)
+        def arrays(mesh):
+            with open(os.path.join(self.directory, mesh['delayLoadingFile']), 'rb') as file:
+                return habylon.decode_binary(file.read(), mesh['_binaryInfo'])
+        self.assertLevels(scene, arrays)
+
+    def test_vertex_data(self):
+        scene = habylon.Scene()
+        fromHoudini.export_node(scene, self.node, False, self.directory, lods=self.LODS)
+        geometries = [mesh['geometryId'] for mesh in scene['meshes']]
+        self.assertEqual(geometries, scene.ids('vertexData'))
+        self.assertEqual(len(set(geometries)), 3)
+        def arrays(mesh):
+            data = scene.get('vertexData', mesh['geometryId'])
+            return dict((name, numpy.asarray(data[name].data if hasattr(data[name], 'data') \
+                        else data[name])) for name in ('positions', 'indices'))
+        self.assertLevels(scene, arrays)
+
+
+class TestLoad(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+        shared     = fakehou.grid(6, 5, normals='vertex', colors=True)
+        self.nodes = [fakehou.geo('point', fakehou.grid(7, 4, colors=True), translate=(1, 2, 3)),
+                      fakehou.geo('vertex', shared), fakehou.geo('copy', shared)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def originals(self, node):
+        """Arrays parse_sop() makes of node, before binary conversion."""
+        scene = habylon.Scene()
+        mesh  = fromHoudini.parse_sop(scene, scene.new('mesh'), node.renderNode(), True)
+        return dict((name, numpy.asarray(mesh[name].data)) for name in \
+                    ('positions', 'normals', 'uvs', 'colors', 'indices') if mesh.get(name))
+
+    def test_round_trip(self):
+        # Largest error of quantized attributes (see convert_to_binary()):
+        tolerances = {'normals': 0.5 / 32767, 'uvs': 1.0 / 65535, 'colors': 1.0 / 255}
+        for compact in (False, True):
+            exported = fromHoudini.run(habylon.Scene(), self.nodes, True, self.directory,
+                                       compact=compact)
+            for filename in ("test.binary.babylon", "test.binary.babylon.gz"):
+                if filename.endswith(".gz"):
+                    exported.dump(os.path.join(self.directory, "test.binary.babylon"), compress=True)
+                scene = habylon.Scene.load(os.path.join(self.directory, filename))
+                self.assertEqual(scene.ids('mesh'), exported.ids('mesh'))
+                self.assertEqual(scene['clearColor'], exported['clearColor'])
+                # Nothing is mapped until it is asked for, shared file only once:
+                self.assertEqual(scene.binary_files, {})
+                for node in self.nodes:
+                    mesh   = scene.get('mesh', fromHoudini.id_from_path(node.path()))
+                    self.assertEqual(mesh['position'], exported.get('mesh', mesh['id'])['position'])
+                    arrays = scene.attributes(mesh)
+                    self.assertEqual(arrays['normals'].dtype == numpy.float32, not compact)
+                    for name, values in self.originals(node).items():
+                        decoded = arrays.decoded(name)
+                        self.assertEqual(decoded.shape, values.shape)
+                        if name == 'indices':
+                            self.assertEqual(decoded.tolist(), values.tolist())
+                        else:
+                            error = numpy.abs(decoded - values).max()
+                            self.assertLessEqual(error, tolerances.get(name, 0) * compact + 1e-6)
+                self.assertEqual(len(scene.binary_files), 2)
+                scene.close()
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+        self.geometry  = fakehou.grid(5, 5, normals='vertex', colors=True)
+        self.node      = fakehou.geo('grid', self.geometry)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def export(self):
+        """Returns whether the node was parsed and decoded arrays of its mesh."""
+        scene = fromHoudini.run(habylon.Scene(), [self.node], True, self.directory, cache=True)
+        with open(os.path.join(self.directory, "test.binary.report.json")) as file:
+            stages = json.load(file)['stages']
+        mesh  = scene['meshes'][0]
+        with open(os.path.join(self.directory, mesh['delayLoadingFile']), 'rb') as file:
+            return 'parse_sop' in stages, habylon.decode_binary(file.read(), mesh['_binaryInfo'])
+
+    def test_edits(self):
+        self.assertTrue(self.export()[0])
+        self.assertFalse(self.export()[0])
+
+        self.geometry._point_attribs['Cd'][:] = 0.25
+        self.geometry._vertex_attribs['uv'][:] *= 0.5
+        parsed, arrays = self.export()
+        self.assertTrue(parsed)
+        self.assertTrue(numpy.allclose(arrays['colors'], 0.25))
+
+        self.geometry._vertex_attribs['N'][:] = (1, 0, 0)
+        parsed, arrays = self.export()
+        self.assertTrue(parsed)
+        self.assertTrue(numpy.allclose(arrays['normals'].reshape(-1, 3), (1, 0, 0)))
+
+        # The same counts, other triangles:
+        points = self.geometry._vertex_points
+        points[:] = points.reshape(-1, 3)[:, [1, 2, 0]].ravel()
+        self.assertTrue(self.export()[0])
+        self.assertFalse(self.export()[0])
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.directories = [tempfile.mkdtemp(prefix='habylon_test') for workers in (0, 4)]
+        grid  = fakehou.grid(9, 7, normals='vertex', colors=True)
+        self.nodes = [fakehou.geo('grid%d' % i, grid) for i in range(3)] + \
+                     [fakehou.geo('size%d' % i, fakehou.grid(4 + i, 3 + i % 3, normals='point'))
+                      for i in range(12)]
+
+    def tearDown(self):
+        for directory in self.directories:
+            shutil.rmtree(directory, True)
+
+    def files(self, directory):
+        """Contents of exported files, but timings and cache's access times."""
+        files = {}
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                if not name.endswith('.report.json') and name != 'index.json':
+                    with open(os.path.join(root, name), 'rb') as file:
+                        files[os.path.relpath(os.path.join(root, name), directory)] = file.read()
+        return files
+
+    def test_identical(self):
+        for compact in (False, True):
+            for directory, workers in zip(self.directories, (0, 4)):
+                fromHoudini.run(habylon.Scene(), self.nodes, True, directory, cache=True,
+                                workers=workers, compact=compact)
+            serial, parallel = [self.files(directory) for directory in self.directories]
+            self.assertEqual(sorted(serial), sorted(parallel))
+            self.assertTrue(serial == parallel)
+            # Shared geometry is written once:
+            self.assertEqual(len([name for name in serial if name.endswith('meshdata')]), 13)
+
+            # Half restored from the cache:
+            for node in self.nodes[::2]:
+                node.renderNode().geometry()._point_attribs['P'][:, 1] += 1
+            for directory, workers in zip(self.directories, (0, 4)):
+                fromHoudini.run(habylon.Scene(), self.nodes, True, directory, cache=True,
+                                workers=workers, compact=compact)
+            self.assertTrue(self.files(self.directories[0]) == self.files(self.directories[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
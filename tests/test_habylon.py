@@ -0,0 +1,354 @@
+"""Tests of habylon module. No Houdini needed.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.environ.setdefault('HABYLON_PATH', here)
+
+import habylon
+
+
+class TestGeometryBuffer(unittest.TestCase):
+    def test_types(self):
+        floats = habylon.GeometryBuffer.floats([[1, 2, 3], [4, 5, 6]])
+        ints   = habylon.GeometryBuffer.ints(numpy.arange(6, dtype=numpy.int64))
+        self.assertEqual(floats.data.dtype, numpy.dtype('<f4'))
+        self.assertEqual(ints.data.dtype, numpy.dtype('<i4'))
+        self.assertEqual(floats.data.shape, (6,))
+        self.assertEqual(floats.nbytes, 24)
+        self.assertEqual(list(floats), [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+        self.assertEqual(ints[1:3], [1, 2])
+        self.assertEqual(floats, [1, 2, 3, 4, 5, 6])
+        self.assertNotEqual(floats, [1, 2, 3])
+        self.assertRaises(KeyError, habylon.GeometryBuffer, [1], 'd')
+
+    def test_bobject(self):
+        scene = habylon.Scene()
+        data  = scene.new('vertexData')
+        data['positions'] = habylon.GeometryBuffer.floats([0, 1, 2])
+        data['indices']   = [0, 1, 2]
+        self.assertRaises(TypeError, data.__setitem__, 'positions', (0, 1, 2))
+        self.assertRaises(TypeError, data.__setitem__, 'id', habylon.GeometryBuffer.ints([1]))
+        self.assertTrue('[\n    0.0,1.0,2.0\n  ]' in ''.join(habylon.iter_json(data)))
+
+
+class TestIterJson(unittest.TestCase):
+    def scene(self):
+        scene = habylon.Scene()
+        mesh  = scene.new('mesh')
+        mesh['id']        = u"mesh\u00e9"
+        mesh['positions'] = habylon.GeometryBuffer.floats([0.1, 1.0 / 3, -2.5e-8, 1e20])
+        mesh['indices']   = habylon.GeometryBuffer.ints([0, 1, 2])
+        mesh['subMeshes'] = [scene.new('subMesh')]
+        scene.add(mesh)
+        return scene
+
+    def test_json_dumps(self):
+        scene = self.scene()
+        text  = ''.join(habylon.iter_json(scene, chunk=2))
+        self.assertEqual(json.loads(text), json.loads(json.dumps(scene, default=habylon.json_default)))
+
+    def test_precision(self):
+        scene     = self.scene()
+        positions = json.loads(''.join(habylon.iter_json(scene, precision=4)))['meshes'][0]['positions']
+        self.assertEqual(positions, [0.1, 0.3333, -2.5e-8, 1e20])
+        self.assertTrue('0.3333,' in ''.join(habylon.iter_json(scene, precision=4)))
+
+    def test_keys_and_nan(self):
+        data = {1: 2, 2.5: None, None: [float('nan')], 'a': [float('inf'), -float('inf')]}
+        text = ''.join(habylon.iter_json(data))
+        self.assertEqual(json.loads(text).keys(), json.loads(json.dumps(data)).keys())
+        self.assertTrue('"1": 2' in text and '"null": [' in text)
+        self.assertTrue('NaN' in text and 'Infinity,-Infinity' in text)
+        self.assertRaises(TypeError, ''.join, habylon.iter_json({(1, 2): 3}))
+
+    def test_circular(self):
+        data = {'a': []}
+        data['a'].append(data)
+        self.assertRaises(ValueError, ''.join, habylon.iter_json(data, check_circular=True))
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp(prefix='habylon_test')
+        try:
+            scene    = self.scene()
+            plain    = scene.dump(os.path.join(directory, 'scene.babylon'))
+            packed   = scene.dump(os.path.join(directory, 'scene.babylon'), compress=True)
+            self.assertEqual(packed, plain + ".gz")
+            with open(plain) as file:
+                text = file.read()
+            with gzip.open(packed) as file:
+                self.assertEqual(file.read(), text)
+            self.assertEqual(json.loads(text), json.loads(''.join(habylon.iter_json(scene))))
+        finally:
+            shutil.rmtree(directory, True)
+
+
+class TestWriteBinary(unittest.TestCase):
+    def test_buffers(self):
+        import io
+        buffers = [numpy.arange(5, dtype='<f4'), numpy.zeros(0, dtype='<i4'), 
+                   numpy.array([1, 2, 3], dtype='<u2'), numpy.zeros(2, dtype=numpy.uint8)]
+        joined  = b''.join(buffer.tostring() for buffer in buffers)
+        output  = io.BytesIO()
+        habylon.write_binary(output, buffers)
+        self.assertEqual(output.getvalue(), joined)
+
+        directory = tempfile.mkdtemp(prefix='habylon_test')
+        try:
+            filename = os.path.join(directory, 'mesh.babylonbinarymeshdata')
+            writer   = habylon.BinaryWriter(workers=2)
+            writer.write(filename, buffers)
+            writer.close()
+            with open(filename, 'rb') as file:
+                self.assertEqual(file.read(), joined)
+        finally:
+            shutil.rmtree(directory, True)
+
+
+class TestGeometryRegistry(unittest.TestCase):
+    def test_digest(self):
+        registry = habylon.GeometryRegistry()
+        floats   = habylon.GeometryBuffer.floats([1, 2, 3])
+        self.assertEqual(registry.digest([floats, []]), registry.digest([[1, 2, 3], []]))
+        self.assertNotEqual(registry.digest([[], [1]]), registry.digest([[1], []]))
+        self.assertNotEqual(registry.digest([floats]), registry.digest([habylon.GeometryBuffer.ints([1, 2, 3])]))
+
+    def test_find(self):
+        registry = habylon.GeometryRegistry()
+        digest   = registry.digest([[1, 2, 3]])
+        shared   = object()
+        self.assertIsNone(registry.find(digest, 12))
+        registry.register(digest, shared)
+        self.assertIs(registry.find(digest, 12), shared)
+        self.assertEqual((registry.deduplicated, registry.deduplicated_bytes), (1, 12))
+        self.assertEqual(registry.digest_of(shared), digest)
+
+
+class TestQuantize(unittest.TestCase):
+    def setUp(self):
+        random       = numpy.random.RandomState(0)
+        normals      = random.uniform(-1, 1, (1000, 3))
+        self.normals = normals / numpy.sqrt((normals ** 2).sum(axis=1))[:, None]
+        self.uvs     = random.uniform(-3, 5, (1000, 2))
+
+    def test_signed(self):
+        for bits in (8, 16):
+            packed, dataType, extra = habylon.quantize(self.normals, 3, bits, True)
+            self.assertEqual(packed.dtype, numpy.dtype(habylon.BINARY_DATA_TYPES[dataType]))
+            values = habylon.dequantize(packed, extra, 3).reshape(-1, 3)
+            self.assertTrue(numpy.allclose(values, self.normals, atol=1.0 / (2 ** (bits - 1) - 1)))
+
+    def test_unsigned(self):
+        for bits in (8, 16):
+            packed, dataType, extra = habylon.quantize(self.uvs, 2, bits)
+            values = habylon.dequantize(packed, extra, 2).reshape(-1, 2)
+            step   = (self.uvs.max(axis=0) - self.uvs.min(axis=0)) / (2 ** bits - 1)
+            self.assertTrue((numpy.abs(values - self.uvs) <= step / 2 + 1e-5).all())
+            self.assertEqual(extra['min'], self.uvs.min(axis=0).tolist())
+
+    def test_range(self):
+        # Chunk of bigger array packed with its range:
+        packed, _, extra = habylon.quantize(self.uvs[:10], 2, 16, False, (-3, -3), (5, 5))
+        self.assertEqual(extra['min'], [-3, -3])
+        values = habylon.dequantize(packed, extra, 2).reshape(-1, 2)
+        self.assertTrue(numpy.allclose(values, self.uvs[:10], atol=8.0 / 65535))
+
+    def test_constant(self):
+        packed, _, extra = habylon.quantize(numpy.ones((4, 2)), 2, 8)
+        self.assertTrue(numpy.allclose(habylon.dequantize(packed, extra, 2), 1.0))
+
+
+class TestDecodeBinary(unittest.TestCase):
+    def test_round_trip(self):
+        positions = numpy.arange(12, dtype=numpy.float32)
+        normals, normalsType, extra = habylon.quantize(numpy.tile((0.0, 1.0, 0.0), 4), 3, 16, True)
+        indices   = numpy.array([0, 1, 2, 2, 1, 3], dtype='<u2')
+        submeshes = numpy.array([0, 0, 6, 0, 4], dtype='<i4')
+        sections  = [positions, normals, indices, submeshes]
+        offsets   = numpy.cumsum([0] + [section.nbytes for section in sections])
+        binaryInfo = {
+            'positionsAttrDesc': {'count': 12, 'stride': 3, 'offset': int(offsets[0]), 'dataType': 1},
+            'normalsAttrDesc':   dict({'count': 12, 'stride': 3, 'offset': int(offsets[1]), 
+                                       'dataType': normalsType}, **extra),
+            'indicesAttrDesc':   {'count': 6, 'stride': 1, 'offset': int(offsets[2]), 'dataType': 3},
+            'subMeshesAttrDesc': {'count': 1, 'stride': 5, 'offset': int(offsets[3]), 'dataType': 0}}
+        data   = b''.join(section.tostring() for section in sections)
+        arrays = habylon.decode_binary(data, binaryInfo)
+        self.assertTrue(numpy.array_equal(arrays['positions'], positions))
+        self.assertTrue(numpy.allclose(arrays['normals'], numpy.tile((0, 1, 0), 4)))
+        self.assertEqual(arrays['indices'].dtype, numpy.int32)
+        self.assertEqual(arrays['indices'].tolist(), indices.tolist())
+        self.assertEqual(arrays['subMeshes'].tolist(), submeshes.tolist())
+
+class TestFactory(unittest.TestCase):
+    def test_registry(self):
+        path = os.path.join(here, "schema")
+        self.assertIs(habylon.SchemaRegistry.get(path), habylon.SchemaRegistry.get(path))
+        self.assertIs(habylon.Scene().schemas, habylon.Scene().schemas)
+
+    def test_defaults_not_shared(self):
+        scene  = habylon.Scene()
+        first, second = scene.new('mesh'), scene.new('mesh')
+        first['position'][0] = 5.0
+        first['subMeshes'].append(scene.new('subMesh'))
+        first['vertexAnimation']['step'] = 0.1
+        self.assertEqual(second['position'], [0.0, 0.0, 0.0])
+        self.assertEqual((second['subMeshes'], second['vertexAnimation']), ([], {}))
+        self.assertEqual(scene.new('mesh')['position'], [0.0, 0.0, 0.0])
+        # Nested lists of scene are copied too:
+        scene['geometries']['vertexData'].append(scene.new('vertexData'))
+        self.assertEqual(habylon.Scene()['geometries']['vertexData'], [])
+        many = scene.new_many('animationKey', [{'frame': 0.0}, {'frame': 1.0}])
+        many[0]['values'].append(1.0)
+        self.assertEqual(many[1]['values'], [0])
+
+    def test_nested(self):
+        definition = {'flat': [1, 2], 'nested': [[1], [2]], 'map': {'a': {'b': 1}}, 'number': 1}
+        factory    = habylon.BObjectFactory('thing', definition)
+        first, second = factory(), factory()
+        first['flat'].append(3)
+        first['nested'][0].append(3)
+        first['map']['a']['b'] = 2
+        self.assertEqual(dict(second), definition)
+        self.assertEqual(factory.defaults(), definition)
+        self.assertEqual(definition['nested'], [[1], [2]])
+        # Types of schema are checked:
+        with self.assertRaises(TypeError):
+            second['number'] = 'one'
+
+class TestVertexAnimation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+        self.filename  = os.path.join(self.directory, 'mesh.babylonvertexanimation')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def frames(self, count=70, vertices=50):
+        random = numpy.random.RandomState(5)
+        rest   = random.uniform(-10, 10, (vertices, 3))
+        for frame in range(count):
+            positions = rest + numpy.sin(rest[:, ::-1] + frame * 0.2) * 3.0
+            normals   = positions / numpy.sqrt((positions ** 2).sum(axis=1))[:, None]
+            yield positions.astype(numpy.float32), normals.astype(numpy.float32)
+
+    def test_round_trip(self):
+        step = 1e-3
+        for normals, compression in ((True, 6), (True, 0), (False, 6)):
+            writer = habylon.VertexAnimationWriter(self.filename, 50, normals, step, 
+                                                   keyframes=30, compression=compression)
+            for positions, frame_normals in self.frames():
+                writer.write(positions, frame_normals)
+            writer.close()
+
+            reader = habylon.VertexAnimationReader(self.filename)
+            self.assertEqual((reader.frames, reader.vertices, reader.normals), (70, 50, normals))
+            frames = list(self.frames())
+            # Random access, keyframes and differences after them:
+            for number in (69, 0, 31, 29, 30, 45, 1):
+                positions, frame_normals = reader.frame(number)
+                error = numpy.abs(positions - frames[number][0]).max()
+                self.assertLessEqual(error, writer.step / 2 + 1e-5)
+                if normals:
+                    error = numpy.abs(frame_normals - frames[number][1]).max()
+                    self.assertLessEqual(error, 0.5 / habylon.VertexAnimationWriter.NORMAL_SCALE + 1e-6)
+                else:
+                    self.assertIsNone(frame_normals)
+            reader.close()
+
+    def test_overflow(self):
+        writer = habylon.VertexAnimationWriter(self.filename, 1, False, 1e-9)
+        with self.assertRaises(ValueError):
+            writer.write(numpy.array([[1e3, 0, 0]]))
+        writer.close()
+
+class TestScene(unittest.TestCase):
+    def mesh(self, scene, id, **values):
+        mesh = scene.new('mesh')
+        mesh['id'] = mesh['name'] = id
+        for key, value in values.items():
+            mesh[key] = value
+        return mesh
+
+    def material(self, scene, id, diffuse=(1.0, 1.0, 1.0)):
+        material = scene.new('material')
+        material['id'] = material['name'] = id
+        material['diffuse'] = list(diffuse)
+        return material
+
+    def test_add(self):
+        scene = habylon.Scene()
+        first = self.mesh(scene, u'box')
+        self.assertIs(scene.add(first), first)
+        # The same id is added once, the first object stays:
+        self.assertIs(scene.add(self.mesh(scene, u'box')), first)
+        self.assertEqual(len(scene['meshes']), 1)
+        self.assertIs(scene.get('mesh', u'box'), first)
+        self.assertTrue(scene.has('mesh', u'box'))
+        self.assertIsNone(scene.get('mesh', u'sphere'))
+        self.assertIsNone(scene.get('light', u'box'))
+
+    def test_shared(self):
+        scene = habylon.Scene()
+        red   = scene.add(self.material(scene, u'red', (1.0, 0.0, 0.0)))
+        # Identical definition under other id is merged, meshes are redirected:
+        self.assertIs(scene.add(self.material(scene, u'red2', (1.0, 0.0, 0.0))), red)
+        self.assertIs(scene.get('material', u'red2'), red)
+        mesh  = scene.add(self.mesh(scene, u'box', materialId=u'red2'))
+        self.assertEqual(mesh['materialId'], u'red')
+        self.assertEqual(scene.references(mesh), [red])
+        blue  = scene.add(self.material(scene, u'blue', (0.0, 0.0, 1.0)))
+        self.assertEqual(scene.ids('material'), [u'red', u'blue'])
+        self.assertIsNot(blue, red)
+
+    def test_remove(self):
+        scene  = habylon.Scene()
+        meshes = [scene.add(self.mesh(scene, u'mesh%d' % n)) for n in range(5)]
+        scene.remove(meshes[1], meshes[3])
+        self.assertEqual(scene.ids('mesh'), [u'mesh0', u'mesh2', u'mesh4'])
+        self.assertEqual([mesh['id'] for mesh in scene['meshes']], scene.ids('mesh'))
+        self.assertIsNone(scene.get('mesh', u'mesh1'))
+        # Removed id can be added again:
+        again = self.mesh(scene, u'mesh1')
+        self.assertIs(scene.add(again), again)
+        # Object which isn't the registered one doesn't unregister it:
+        scene.remove(self.mesh(scene, u'mesh2'))
+        self.assertIs(scene.get('mesh', u'mesh2'), meshes[2])
+
+        snapshot = scene.snapshot()
+        light    = scene.new('light')
+        light['id'] = u'sun'
+        scene.add(light)
+        self.assertEqual(scene.added_since(snapshot), [light])
+
+    def test_link_shadows(self):
+        scene = habylon.Scene()
+        for n in range(3):
+            scene.add(self.mesh(scene, u'mesh%d' % n))
+        for light in (u'sun', u'lamp'):
+            shadow = scene.new('shadowGenerator')
+            shadow['lightId'] = light
+            scene.add(shadow)
+        scene['shadowGenerators'][0]['renderList'].append(u'mesh1')
+        scene.link_shadows()
+        scene.link_shadows([u'mesh0', u'mesh3'])
+        self.assertEqual(scene['shadowGenerators'][0]['renderList'], 
+                         [u'mesh1', u'mesh0', u'mesh2', u'mesh3'])
+        self.assertEqual(scene['shadowGenerators'][1]['renderList'], 
+                         [u'mesh0', u'mesh1', u'mesh2', u'mesh3'])
+
+
+if __name__ == "__main__":
+    unittest.main()
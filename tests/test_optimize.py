@@ -0,0 +1,145 @@
+"""Tests of optimize module. No Houdini needed.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+import numpy
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.environ.setdefault('HABYLON_PATH', here)
+
+import habylon
+import optimize
+
+
+class TestKeys(unittest.TestCase):
+    def interpolate(self, frames, values, keep):
+        return numpy.column_stack([numpy.interp(frames, frames[keep], values[keep, n]) \
+                                   for n in range(values.shape[1])])
+
+    def test_tolerance(self):
+        frames = numpy.arange(120) * 1.0
+        values = numpy.column_stack([numpy.sin(frames / 7.0) * 10, frames ** 1.5 / 50,
+                                     numpy.where(frames < 60, 0.0, 3.0)])
+        for tolerance in (0.5, 0.01, 1e-4):
+            keep  = optimize.reduce_keys(frames, values, tolerance)
+            error = numpy.abs(self.interpolate(frames, values, keep) - values).max()
+            self.assertLessEqual(error, tolerance)
+            self.assertEqual((keep[0], keep[-1]), (0, len(frames) - 1))
+        # Tighter tolerance keeps more:
+        self.assertLess(len(optimize.reduce_keys(frames, values, 0.01)), len(frames))
+        self.assertLess(len(optimize.reduce_keys(frames, values, 0.5)),
+                        len(optimize.reduce_keys(frames, values, 0.01)))
+
+    def test_linear(self):
+        frames = numpy.arange(0, 300, 3) * 1.0
+        values = numpy.column_stack([frames * 2 - 1, -frames / 5])
+        self.assertEqual(optimize.reduce_keys(frames, values, 1e-9).tolist(), [0, len(frames) - 1])
+        self.assertEqual(optimize.reduce_keys(frames[:2], values[:2], 1.0).tolist(), [0, 1])
+
+    def test_constant(self):
+        samples = numpy.tile([1.5, 0.0, -2.0], (50, 1))
+        self.assertTrue(optimize.constant_samples(samples))
+        # Relative error, as habylon.float_equal() has:
+        samples[7] *= 1 + 1e-12
+        self.assertTrue(optimize.constant_samples(samples))
+        samples[9, 1] = 1e-3
+        self.assertFalse(optimize.constant_samples(samples))
+        samples = numpy.tile([1.0e6, 1.0], (10, 1))
+        samples[3, 0] += 1.0
+        self.assertFalse(optimize.constant_samples(samples))
+        # Zeros and tiny values compare like habylon.float_equal() does them:
+        for pair in ((0.0, 0.0), (0.0, 1e-10), (0.0, 1e-8), (1e-12, 2e-12), (-0.0, 0.0)):
+            self.assertEqual(optimize.constant_samples([[pair[0]], [pair[1]]]),
+                             habylon.float_equal(*pair))
+
+def bumpy_grid(size=41):
+    """Positions, indices and normals of wavy grid facing +Y."""
+    xs, zs    = numpy.meshgrid(numpy.linspace(0, 1, size), numpy.linspace(0, 1, size))
+    positions = numpy.column_stack([xs.ravel(), 0.1 * numpy.sin(xs.ravel() * 6) * \
+                                    numpy.cos(zs.ravel() * 5), zs.ravel()])
+    quads     = numpy.arange(size * size).reshape(size, size)[:-1, :-1].ravel()
+    indices   = numpy.column_stack((quads, quads + size, quads + 1, quads + 1, 
+                                    quads + size, quads + size + 1)).ravel()
+    normals   = numpy.tile([0.0, 1.0, 0.0], (size * size, 1))
+    return positions, indices, normals
+
+
+class TestDecimate(unittest.TestCase):
+    def test_ratio(self):
+        positions, indices, normals = bumpy_grid()
+        triangles = len(indices) / 3
+        for ratio in (0.9, 0.5, 0.25, 0.1, 0.02):
+            vertices, decimated_normals, attributes, decimated = optimize.decimate(
+                positions, indices, ratio, normals, [positions[:, ::2]])
+            count = len(decimated) / 3
+            self.assertLess(abs(count - triangles * ratio), 0.15 * triangles * ratio)
+            # Indices are in range and every vertex is used:
+            self.assertEqual(decimated.min(), 0)
+            self.assertEqual(decimated.max(), len(vertices) - 1)
+            self.assertEqual(len(numpy.unique(decimated)), len(vertices))
+            self.assertEqual((len(decimated_normals), len(attributes[0])), (len(vertices),) * 2)
+            # Faces keep their winding (clustering may fold a rare sliver):
+            a, b, c = (vertices[decimated.reshape(-1, 3)[:, n]] for n in range(3))
+            self.assertGreater((numpy.cross(b - a, c - a)[:, 1] > 0).mean(), 0.99)
+            # Vertices stay (about) within the surface's bounds:
+            self.assertTrue((vertices.min(axis=0) > positions.min(axis=0) - 0.01).all())
+            self.assertTrue((vertices.max(axis=0) < positions.max(axis=0) + 0.01).all())
+
+def canonical(indices):
+    """Triangles rotated to start with their smallest index (keeping winding), sorted."""
+    triangles = numpy.asarray(indices).reshape(-1, 3)
+    first     = triangles.argmin(axis=1)
+    rotated   = numpy.array([numpy.roll(triangle, -shift) for triangle, shift in zip(triangles, first)])
+    return sorted(map(tuple, rotated.tolist()))
+
+
+class TestVertexCache(unittest.TestCase):
+    def test_permutation(self):
+        positions, indices, normals = bumpy_grid(31)
+        random   = numpy.random.RandomState(11)
+        shuffled = indices.reshape(-1, 3)[random.permutation(len(indices) / 3)].ravel()
+        for order in (indices, shuffled):
+            optimized = optimize.optimize_vertex_cache(order, len(positions), 16)
+            self.assertEqual(optimized.dtype, numpy.int32)
+            self.assertEqual(canonical(optimized), canonical(order))
+
+    def test_acmr(self):
+        positions, indices, normals = bumpy_grid(61)
+        random    = numpy.random.RandomState(13)
+        shuffled  = indices.reshape(-1, 3)[random.permutation(len(indices) / 3)].ravel()
+        triangles = len(indices) / 3.0
+        for cache_size in (16, 32):
+            for order in (indices, shuffled):
+                before = optimize.vertex_cache_misses(order, cache_size) / triangles
+                after  = optimize.vertex_cache_misses(
+                    optimize.optimize_vertex_cache(order, None, cache_size), cache_size) / triangles
+                self.assertLessEqual(after, before)
+                self.assertLess(after, 1.0)
+
+    def test_fetch(self):
+        positions, indices, normals = bumpy_grid(21)
+        random   = numpy.random.RandomState(17)
+        # Some vertices unused, the rest used in random order:
+        indices  = indices.reshape(-1, 3)[random.permutation(len(indices) / 3)[:500]].ravel()
+        uvs      = positions[:, ::2].ravel()
+        (new_positions, new_uvs), new_indices, order = \
+            optimize.optimize_vertex_fetch([positions, uvs], indices)
+        self.assertEqual(len(new_positions), len(numpy.unique(indices)))
+        self.assertEqual(new_positions.tolist(), positions[order].tolist())
+        # Every corner still points at the same data:
+        self.assertEqual(new_positions[new_indices].tolist(), positions[indices].tolist())
+        self.assertEqual(new_uvs[new_indices].tolist(), uvs.reshape(-1, 2)[indices].tolist())
+        # Vertices are numbered in order of first use:
+        first = numpy.unique(new_indices, return_index=True)[1]
+        self.assertEqual(numpy.argsort(first).tolist(), range(len(new_positions)))
+        self.assertTrue((numpy.diff(first) > 0).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests of progressive output on fakehou scenes. No Houdini needed.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+os.environ.setdefault('HABYLON_PATH', here)
+
+import fakehou
+fakehou.install()
+import fromHoudini
+import habylon
+
+
+class TestChunks(unittest.TestCase):
+    def setUp(self):
+        fakehou.clear()
+        self.directories = [tempfile.mkdtemp(prefix='habylon_test') for n in range(2)]
+        shared     = fakehou.grid(12, 12, colors=True)
+        self.nodes = [fakehou.geo('grid%d' % n, fakehou.grid(5 + 3 * n, 4 + n, size=2.0 + n)) \
+                      for n in range(6)] + [fakehou.geo('shared%d' % n, shared) for n in range(2)]
+
+    def tearDown(self):
+        for directory in self.directories:
+            shutil.rmtree(directory, True)
+
+    def arrays(self, directory, mesh, gzipped=False):
+        filename = os.path.join(directory, mesh['delayLoadingFile'])
+        opener   = gzip.open if gzipped else open
+        with opener(filename + (".gz" if gzipped else ""), 'rb') as file:
+            return habylon.decode_binary(file.read(), mesh['_binaryInfo'])
+
+    def test_offsets(self):
+        for compact in (False, True):
+            for directory in self.directories:
+                shutil.rmtree(directory)
+                os.makedirs(directory)
+            plain, chunked = [fromHoudini.run(habylon.Scene(), self.nodes, True, directory, 
+                                              compact=compact, chunk_bytes=chunk_bytes) \
+                              for directory, chunk_bytes in zip(self.directories, (None, 8192))]
+            with open(os.path.join(self.directories[1], "test.binary.manifest.json")) as file:
+                chunks = json.load(file)['chunks']
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(sorted(id for chunk in chunks for id in chunk['meshes']),
+                             sorted(mesh['id'] for mesh in chunked['meshes']))
+            # Original files are gone, chunks are all there is:
+            files = [name for name in os.listdir(self.directories[1]) if name.endswith('meshdata')]
+            self.assertEqual(sorted(files), sorted(chunk['file'] for chunk in chunks))
+
+            originals = dict((mesh['id'], mesh) for mesh in plain['meshes'])
+            for mesh in chunked['meshes']:
+                expected = self.arrays(self.directories[0], originals[mesh['id']])
+                for gzipped in (True, False):
+                    arrays = self.arrays(self.directories[1], mesh, gzipped)
+                    self.assertEqual(sorted(arrays), sorted(expected))
+                    for name in expected:
+                        self.assertEqual(arrays[name].tolist(), expected[name].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
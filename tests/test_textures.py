@@ -0,0 +1,100 @@
+"""Tests of textures module. No Houdini needed, images are made with PIL.
+
+   Usage:
+        python -m unittest discover -s tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+from textures import TexturePipeline
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+@unittest.skipIf(Image is None, "PIL is missing")
+class TestTexturePipeline(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='habylon_test')
+        self.sources   = os.path.join(self.directory, 'sources')
+        self.output    = os.path.join(self.directory, 'output')
+        os.makedirs(self.sources)
+        os.makedirs(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    def image(self, name, color=(255, 0, 0), size=(8, 8)):
+        path = os.path.join(self.sources, name)
+        Image.new('RGB', size, color).save(path)
+        return path
+
+    def manifest(self):
+        with open(os.path.join(self.output, ".habylon_textures.json")) as file:
+            return json.load(file)
+
+    def test_shared(self):
+        first  = self.image('brick.png')
+        os.makedirs(os.path.join(self.sources, 'copy'))
+        second = os.path.join(self.sources, 'copy', 'wall.png')
+        shutil.copyfile(first, second)
+        other  = self.image('grass.png', (0, 255, 0))
+
+        pipeline = TexturePipeline(self.output)
+        name     = pipeline.add(first)
+        self.assertEqual(pipeline.add(second), name)
+        self.assertEqual(pipeline.add(first), name)
+        self.assertNotEqual(pipeline.add(other), name)
+        pipeline.close()
+        self.assertEqual(pipeline.copied, 2)
+        self.assertEqual(sorted(os.listdir(self.output)), 
+                         sorted(['.habylon_textures.json', name, pipeline.add(other)]))
+
+    def test_skipped(self):
+        paths = [self.image('brick.png'), self.image('big.png', size=(64, 32))]
+        for workers in (0, 2, 0):
+            pipeline = TexturePipeline(self.output, max_size=16, format='jpg', workers=workers)
+            names    = [pipeline.add(path) for path in paths]
+            pipeline.close()
+            self.assertEqual(Image.open(os.path.join(self.output, names[1])).size, (16, 8))
+        self.assertEqual((pipeline.copied, pipeline.skipped), (0, 2))
+
+        # Changed image and other options are exported again:
+        changed = self.image('brick.png', (0, 0, 255))
+        # NOTE: Digests are remembered by size and time of modification:
+        os.utime(changed, (os.path.getatime(changed), os.path.getmtime(changed) + 10))
+        pipeline = TexturePipeline(self.output, max_size=16, format='jpg')
+        [pipeline.add(path) for path in paths]
+        pipeline.close()
+        self.assertEqual((pipeline.copied, pipeline.skipped), (1, 1))
+        pipeline = TexturePipeline(self.output, max_size=32, format='jpg')
+        [pipeline.add(path) for path in paths]
+        pipeline.close()
+        self.assertEqual((pipeline.copied, pipeline.skipped), (2, 0))
+
+    def test_unreadable(self):
+        source = os.path.join(self.sources, 'broken.png')
+        with open(source, 'wb') as file:
+            file.write(b'not an image at all')
+        for attempt in range(2):
+            pipeline = TexturePipeline(self.output, max_size=16)
+            name     = pipeline.add(source)
+            pipeline.close()
+            # Copied as it is, and tried again next time:
+            self.assertEqual((pipeline.copied, pipeline.skipped), (1, 0))
+            with open(os.path.join(self.output, name), 'rb') as file:
+                self.assertEqual(file.read(), b'not an image at all')
+            self.assertNotIn(name, self.manifest()['outputs'])
+
+
+if __name__ == "__main__":
+    unittest.main()
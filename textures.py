@@ -0,0 +1,166 @@
+"""Textures of exported materials. Every image is hashed, and each unique one is
+   written once to the output directory under a content addressed name. Images
+   can be downscaled and converted to web formats (with PIL, if we have it) on
+   a thread pool. A manifest in the output directory lets re-export skip
+   images which didn't change.
+"""
+import json
+import os
+
+# Formats browsers read, others have to be converted:
+WEB_FORMATS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+
+class TexturePipeline(object):
+    """Collects textures of an export. add() returns name the texture will have
+       in directory right away, conversion happens on workers threads (or right
+       there without them). max_size limits resolution (longer side), format
+       ('jpg', 'png', 'webp') is preferred output format. Images with alpha
+       never become jpg. Call close() after export.
+    """
+    def __init__(self, directory, max_size=None, format=None, quality=90, workers=0):
+        self.directory = directory
+        self.max_size  = max_size
+        self.format    = format and '.' + format.lower().lstrip('.')
+        self.quality   = quality
+        self.names     = {}
+        self.digests   = {}
+        self.results   = []
+        self.copied    = 0
+        self.skipped   = 0
+        self.pool      = None
+        if workers:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(workers)
+
+        self.manifest_file = os.path.join(directory, ".habylon_textures.json")
+        self.manifest      = {'sources': {}, 'outputs': {}}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as file:
+                self.manifest = json.load(file)
+
+    @staticmethod
+    def resolve(path):
+        """Absolute path of texture or None if there is no such file. Relative paths
+           are tried against $HIP and $JOB.
+        """
+        path = os.path.expanduser(os.path.expandvars(path))
+        candidates = [path]
+        if not os.path.isabs(path):
+            try:
+                import hou
+                candidates += [os.path.join(hou.expandString(variable), path) \
+                               for variable in ('$HIP', '$JOB')]
+            except ImportError:
+                pass
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+
+    def digest(self, path):
+        """sha1 of file's content. It is remembered in manifest by path, size
+           and modification time, so unchanged files aren't read again.
+        """
+        import hashlib
+        stat   = os.stat(path)
+        source = self.manifest['sources'].get(path)
+        if source and source[:2] == [stat.st_size, stat.st_mtime]:
+            return source[2]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024**2), b''):
+                sha.update(chunk)
+        self.manifest['sources'][path] = [stat.st_size, stat.st_mtime, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def _extension(self, path):
+        """Extension of output image. Images which can't be converted (PIL is
+           missing or can't read them) keep their own.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        wanted    = self.format or (extension if extension in WEB_FORMATS else '.png')
+        if wanted == extension:
+            return wanted
+        try:
+            from PIL import Image
+            mode = Image.open(path).mode
+        except (ImportError, IOError):
+            return extension
+        if wanted in ('.jpg', '.jpeg') and extension not in ('.jpg', '.jpeg') and 'A' in mode:
+            return '.png'
+        return wanted
+
+    def add(self, path):
+        """Returns file name of texture in directory, or None if there is no such image.
+        """
+        source = self.resolve(path)
+        if source is None:
+            print "Texture not found: %s" % path
+            return None
+        if source in self.names:
+            return self.names[source]
+
+        digest    = self.digest(source)
+        extension = self._extension(source)
+        # Identical images under different paths share the first name:
+        if (digest, extension) in self.digests:
+            self.names[source] = self.digests[digest, extension]
+            return self.names[source]
+        stem = os.path.splitext(os.path.basename(source))[0]
+        name = u"%s_%s%s" % (stem, digest[:12], extension)
+        self.names[source] = self.digests[digest, extension] = name
+
+        key    = [digest, self.max_size, extension, self.quality]
+        target = os.path.join(self.directory, name)
+        if self.manifest['outputs'].get(name) == key and os.path.exists(target):
+            self.skipped += 1
+            return name
+        self.manifest['outputs'][name] = key
+        self.copied += 1
+        if self.pool is None:
+            self.convert(source, target)
+        else:
+            self.results.append(self.pool.apply_async(self.convert, (source, target)))
+        return name
+
+    def convert(self, source, target):
+        """Copies source to target, downscaled and converted if needed.
+        """
+        import shutil
+        same_format = os.path.splitext(source)[1].lower() == os.path.splitext(target)[1]
+        try:
+            from PIL import Image
+        except ImportError:
+            if not same_format or self.max_size:
+                print "PIL is missing, %s is copied as it is." % source
+            shutil.copyfile(source, target)
+            return
+
+        try:
+            image = Image.open(source)
+            if (not self.max_size or max(image.size) <= self.max_size) and same_format:
+                shutil.copyfile(source, target)
+                return
+            if self.max_size and max(image.size) > self.max_size:
+                image.thumbnail((self.max_size, self.max_size), Image.LANCZOS)
+            if target.endswith(('.jpg', '.jpeg')) and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(target, quality=self.quality)
+        except (IOError, ValueError) as error:
+            # One bad image shouldn't stop the export, nor be skipped next time:
+            print "Texture %s can't be converted (%s), it is copied as it is." % (source, error)
+            self.manifest['outputs'].pop(os.path.basename(target), None)
+            shutil.copyfile(source, target)
+
+    def close(self):
+        """Waits for conversions and saves manifest. Errors of workers are raised here.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        results, self.results = self.results, []
+        for result in results:
+            result.get()
+        with open(self.manifest_file, 'w') as file:
+            json.dump(self.manifest, file)